@@ -5,10 +5,9 @@ from products.models import Product
 class Cart(object):
     def __init__(self, request):
         self.session = request.session
-        cart = self.session.get(settings.CART_SESSION_ID)
-        if not cart:
-            cart = self.session[settings.CART_SESSION_ID] = {}
-        self.cart = cart
+        # Stored on the first change only, so browsing never creates a session
+        self.cart = self.session.get(settings.CART_SESSION_ID) or {}
+        self._items = None
 
     def add(self, product, quantity=1, override_quantity=False):
         product_id = str(product.id)
@@ -21,7 +20,9 @@ class Cart(object):
         self.save()
 
     def save(self):
+        self.session[settings.CART_SESSION_ID] = self.cart
         self.session.modified = True
+        self._items = None
 
     def remove(self, product):
         product_id = str(product.id)
@@ -29,16 +30,22 @@ class Cart(object):
             del self.cart[product_id]
             self.save()
 
+    def _hydrate(self):
+        """Line items with their products, loaded in one query the first time they're needed"""
+        if self._items is None:
+            products = Product.objects.filter(id__in=self.cart.keys()).for_listing().in_bulk()
+            self._items = []
+            for product_id, entry in self.cart.items():
+                # Fresh dicts: views may annotate items without touching the session
+                item = {'quantity': entry['quantity'], 'price': Decimal(entry['price'])}
+                item['total_price'] = item['price'] * item['quantity']
+                if int(product_id) in products:
+                    item['product'] = products[int(product_id)]
+                self._items.append(item)
+        return self._items
+
     def __iter__(self):
-        product_ids = self.cart.keys()
-        products = Product.objects.filter(id__in=product_ids)
-        cart = self.cart.copy()
-        for product in products:
-            cart[str(product.id)]['product'] = product
-        for item in cart.values():
-            item['price'] = Decimal(item['price'])
-            item['total_price'] = item['price'] * item['quantity']
-            yield item
+        return iter(self._hydrate())
 
     def __len__(self):
         return sum(item['quantity'] for item in self.cart.values())
@@ -47,5 +54,13 @@ class Cart(object):
         return sum(Decimal(item['price']) * item['quantity'] for item in self.cart.values())
 
     def clear(self):
-        del self.session[settings.CART_SESSION_ID]
-        self.save()
\ No newline at end of file
+        self.cart = {}
+        self._items = None
+        self.session.pop(settings.CART_SESSION_ID, None)
+
+
+def get_cart(request):
+    """The request's cart, shared by views and the context processor so it is hydrated once"""
+    if not hasattr(request, '_cart'):
+        request._cart = Cart(request)
+    return request._cart
@@ -1,4 +1,4 @@
-from .cart import Cart as CartUtil  # We'll define this utility below
+from .cart import get_cart
 
 def cart(request):
-    return {'cart': CartUtil(request)}
\ No newline at end of file
+    return {'cart': get_cart(request)}
\ No newline at end of file
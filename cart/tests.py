@@ -1,3 +1,34 @@
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
-# Create your tests here.
+from products.models import Category
+from products.testing import QueryCountMixin
+
+
+class CartQueryCountTests(QueryCountMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Books', slug='books')
+
+    def add_to_cart(self, count):
+        self.fill_cart(self.add_products(count, [self.category], name='Book'))
+
+    def test_constant_queries(self):
+        self.add_to_cart(10)
+        self.assertConstantQueries(reverse('cart_detail'), lambda: self.add_to_cart(90))
+
+    def test_products_are_loaded_once_per_request(self):
+        # The view, the template and the context processor share one hydrated cart
+        self.add_to_cart(5)
+        self.client.force_login(User.objects.create_user('shopper', password='secret'))
+        for url in (reverse('cart_detail'), reverse('order_create')):
+            self.client.get(url, secure=True)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, secure=True)
+            self.assertContains(response, 'Book 4')
+            product_queries = [q for q in queries if 'FROM "products_product"' in q['sql']]
+            self.assertEqual(len(product_queries), 1, url)
+            self.assertIn('products_category', product_queries[0]['sql'])
@@ -1,28 +1,34 @@
+from django.contrib import messages
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views.decorators.http import require_POST
+from products import stock
 from products.models import Product
-from .cart import Cart
+from .cart import get_cart
 from .forms import CartAddProductForm
 
 @require_POST
 def cart_add(request, product_id):
-    cart = Cart(request)
+    cart = get_cart(request)
     product = get_object_or_404(Product, id=product_id)
     form = CartAddProductForm(request.POST)
     if form.is_valid():
         cd = form.cleaned_data
-        cart.add(product=product, quantity=cd['quantity'], override_quantity=cd['override'])
+        in_cart = 0 if cd['override'] else cart.cart.get(str(product.id), {}).get('quantity', 0)
+        if stock.can_supply(product, in_cart + cd['quantity']):
+            cart.add(product=product, quantity=cd['quantity'], override_quantity=cd['override'])
+        else:
+            messages.error(request, f'Sorry, there are not enough units of {product.name} left.')
     return redirect('cart_detail')
 
 @require_POST
 def cart_remove(request, product_id):
-    cart = Cart(request)
+    cart = get_cart(request)
     product = get_object_or_404(Product, id=product_id)
     cart.remove(product)
     return redirect('cart_detail')
 
 def cart_detail(request):
-    cart = Cart(request)
+    cart = get_cart(request)
     for item in cart:
         item['update_quantity_form'] = CartAddProductForm(initial={'quantity': item['quantity'], 'override': True})
     return render(request, 'cart/cart.html', {'cart': cart})
\ No newline at end of file
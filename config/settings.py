@@ -35,7 +35,6 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'recommendations.middleware.EnsureSessionMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -52,6 +51,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'cart.context_processors.cart',
+                'products.context_processors.catalog',
             ],
         },
     },
@@ -64,9 +64,37 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # WAL lets reads run during a write; IMMEDIATE takes the write lock
+            # when a transaction starts, so concurrent checkouts wait their turn
+            # (up to ``timeout`` seconds) instead of failing with "database is locked"
+            'init_command': 'PRAGMA journal_mode=WAL;',
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 }
 
+# Cache (per-process by default; point at a shared backend in production)
+# Page validators, index versions and shared guest pages must be seen by
+# every worker, so production needs CACHE_URL; the in-process default only
+# suits a single development server
+CACHE_URL = config('CACHE_URL', default='')  # e.g. redis://127.0.0.1:6379/1
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'my-store',
+        }
+    }
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -103,6 +131,19 @@ CRISPY_TEMPLATE_PACK = 'bootstrap5'
 # Cart settings
 CART_SESSION_ID = 'cart'
 
+# Product search
+PRODUCTS_SEARCH_BACKEND = 'auto'  # 'fts5', 'python', or 'auto' (FTS5 when its table exists)
+
+# Recommendation settings
+RECOMMENDATIONS_INDEX_DIR = BASE_DIR / 'indexes'  # Memory-mapped recommendation indexes
+RECOMMENDATIONS_TRENDING_HALF_LIFE_DAYS = 7  # A view counts half as much after this many days
+RECOMMENDATIONS_VIEW_TRACKING = config('RECOMMENDATIONS_VIEW_TRACKING', default='sync')  # 'sync' or 'buffered'
+RECOMMENDATIONS_VIEW_FLUSH_INTERVAL = 5  # Seconds between buffered view flushes
+RECOMMENDATIONS_VIEW_RETENTION_DAYS = 30  # Older views are rolled up into daily totals
+RECOMMENDATIONS_BLOCK_TIMEOUT = 0.5  # Seconds before a deferred block falls back to popular products
+RECOMMENDATIONS_PIPELINE_BUDGET = 0.3  # Seconds before optional pipeline stages are skipped
+RECOMMENDATIONS_ANN_PROBES = 1  # Also search LSH buckets one bit away (0 = exact bucket only)
+
 # Security settings for production
 SECURE_SSL_REDIRECT = config('SECURE_SSL_REDIRECT', default=True, cast=bool)
 SECURE_HSTS_SECONDS = 31536000
@@ -111,6 +152,12 @@ SECURE_HSTS_PRELOAD = True
 SESSION_COOKIE_SECURE = True
 CSRF_COOKIE_SECURE = True
 
+# Behind a TLS-terminating reverse proxy that sets X-Forwarded-Proto/Host
+# (only enable when the proxy overwrites these headers from clients)
+if config('BEHIND_PROXY', default=False, cast=bool):
+    SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
+    USE_X_FORWARDED_HOST = True
+
 # Logging
 LOGGING = {
     'version': 1,
@@ -26,5 +26,6 @@ urlpatterns = [
     path('wishlist/', include('wishlist.urls')),  # New
     path('cart/', include('cart.urls')),
     path('orders/', include('orders.urls')),
+    path('recommendations/', include('recommendations.urls')),
     path('', include('products.urls')),  # Home as product list
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
@@ -1,3 +1,41 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from products import stock
+from products.models import Category, Product
+from .models import Order
+
+
+class CheckoutStockTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Books', slug='books')
+        cls.book = Product.objects.create(category=category, name='Book', slug='book', price=10, stock=2)
+        cls.user = User.objects.create_user('shopper', password='secret')
+
+    def add_to_cart(self, quantity):
+        self.client.post(reverse('cart_add', args=[self.book.id]),
+                         {'quantity': quantity, 'override': True}, secure=True)
+
+    def checkout(self):
+        return self.client.post(reverse('order_create'), {
+            'first_name': 'A', 'last_name': 'B', 'email': 'a@example.com', 'address': '1 Road',
+            'postal_code': '123', 'city': 'Pune', 'phone': '123',
+        }, secure=True)
+
+    def test_checkout_takes_stock_and_refuses_to_oversell(self):
+        self.client.force_login(self.user)
+        self.add_to_cart(2)
+        # Someone else buys one while this cart waits
+        stock.reserve([(self.book, 1)])
+        response = self.checkout()
+        self.assertContains(response, 'Not enough stock left for: Book')
+        self.assertFalse(Order.objects.exists())
+
+        self.add_to_cart(1)
+        response = self.checkout()
+        self.assertRedirects(response, reverse('order_confirmation', args=[Order.objects.get().id]),
+                             fetch_redirect_response=False)
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.stock, 0)
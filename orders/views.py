@@ -1,7 +1,9 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
 from .models import Order, OrderItem
-from cart.cart import Cart
+from cart.cart import get_cart
+from products import stock
 from .forms import OrderCreateForm
 
 @login_required
@@ -11,17 +13,24 @@ def order_list(request):
 
 @login_required
 def order_create(request):
-    cart = Cart(request)
+    cart = get_cart(request)
     if request.method == 'POST':
         form = OrderCreateForm(request.POST)
         if form.is_valid():
-            order = form.save(commit=False)
-            order.user = request.user
-            order.save()
-            for item in cart:
-                OrderItem.objects.create(order=order, product=item['product'], price=item['price'], quantity=item['quantity'])
-            cart.clear()
-            return redirect('order_confirmation', order_id=order.id)
+            try:
+                # Units are taken with the order, or neither is saved
+                with transaction.atomic():
+                    stock.reserve((item['product'], item['quantity']) for item in cart)
+                    order = form.save(commit=False)
+                    order.user = request.user
+                    order.save()
+                    for item in cart:
+                        OrderItem.objects.create(order=order, product=item['product'], price=item['price'], quantity=item['quantity'])
+            except stock.OutOfStock as short:
+                form.add_error(None, f'Not enough stock left for: {short}. Please update your bag.')
+            else:
+                cart.clear()
+                return redirect('order_confirmation', order_id=order.id)
     else:
         form = OrderCreateForm()
     return render(request, 'orders/order_create.html', {'cart': cart, 'form': form})
@@ -8,7 +8,11 @@ class CategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ['name', 'slug', 'price', 'available', 'created', 'updated']
+    list_display = ['name', 'slug', 'price', 'stock', 'stock_shards', 'available', 'created', 'updated']
     list_filter = ['available', 'created', 'updated']
     list_editable = ['price', 'available']
-    prepopulated_fields = {'slug': ('name',)}
\ No newline at end of file
+    prepopulated_fields = {'slug': ('name',)}
+
+    def get_readonly_fields(self, request, obj=None):
+        # Saving a form would overwrite units sold since it was loaded; use ``manage.py restock``
+        return ['stock'] if obj is not None else []
@@ -0,0 +1,111 @@
+"""
+Concurrency benchmark for stock reservation.
+
+``run_stock_benchmark`` puts ``stock`` units on a scratch product,
+optionally split over shards, then starts ``workers`` threads at once,
+each with its own database connection, that check out 1 to
+``max_quantity`` units at a time through ``stock.reserve`` until
+``checkouts`` attempts have been made. It reports throughput, latency
+percentiles, sold-out and failed attempts (e.g. "database is locked"),
+and whether units sold plus units left still equals the starting stock,
+i.e. that nothing was oversold.
+
+It runs against the configured database, so point it at a scratch copy.
+With SQLite the journal mode is reported too: the settings turn on WAL
+and ``BEGIN IMMEDIATE``, which is what keeps lock errors away here.
+"""
+import math
+import random
+import threading
+import time
+
+from django.db import OperationalError, connection
+
+from . import stock
+from .models import Category, Product
+
+SLUG = 'stock-benchmark'
+
+
+def _percentile(values, percentile):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, math.ceil(percentile / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _journal_mode():
+    if connection.vendor != 'sqlite':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode')
+        return cursor.fetchone()[0]
+
+
+def run_stock_benchmark(workers=16, checkouts=2000, stock_units=1000, shards=0, max_quantity=3, seed=0):
+    category, _ = Category.objects.get_or_create(slug=SLUG, defaults={'name': 'Stock benchmark'})
+    product, _ = Product.objects.update_or_create(
+        slug=SLUG, category=category,
+        defaults={'name': 'Stock benchmark', 'price': 1, 'available': False, 'stock': stock_units},
+    )
+    stock.split(product, shards)
+    product.refresh_from_db()
+
+    rng = random.Random(seed)
+    quantities = [rng.randint(1, max_quantity) for _ in range(checkouts)]
+    start = threading.Barrier(workers)
+    lock = threading.Lock()
+    results = {'timings': [], 'succeeded': 0, 'sold_out': 0, 'errors': 0, 'units_sold': 0}
+
+    def worker(index):
+        mine = quantities[index::workers]
+        timings, succeeded, sold_out, errors, units = [], 0, 0, 0, 0
+        try:
+            start.wait()
+            for quantity in mine:
+                started = time.perf_counter()
+                try:
+                    stock.reserve([(product, quantity)])
+                    succeeded += 1
+                    units += quantity
+                except stock.OutOfStock:
+                    sold_out += 1
+                except OperationalError:
+                    errors += 1
+                timings.append(1000 * (time.perf_counter() - started))
+        finally:
+            connection.close()
+        with lock:
+            results['timings'] += timings
+            results['succeeded'] += succeeded
+            results['sold_out'] += sold_out
+            results['errors'] += errors
+            results['units_sold'] += units
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(workers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+
+    remaining = stock.on_hand(product)
+    timings = results.pop('timings')
+    product.delete()
+    category.delete()
+    return {
+        'workers': workers,
+        'checkouts': checkouts,
+        'shards': shards,
+        'journal_mode': _journal_mode(),
+        'seconds': seconds,
+        'checkouts_per_second': checkouts / seconds if seconds else 0.0,
+        'p50_ms': _percentile(timings, 50),
+        'p95_ms': _percentile(timings, 95),
+        'p99_ms': _percentile(timings, 99),
+        **results,
+        'remaining': remaining,
+        'consistent': results['units_sold'] + remaining == stock_units,
+    }
@@ -0,0 +1,60 @@
+"""
+Process-local snapshot of catalog metadata (categories and their URLs).
+
+Categories change rarely but are needed on every page for the
+navigation. Each process keeps a snapshot and only compares its version
+with the one in the shared cache per request; ``signals.py`` bumps that
+version when a category is saved or deleted, and every worker reloads
+with one query the next time it looks.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+
+VERSION_KEY = 'products:catalog:version'
+
+
+class CatalogSnapshot:
+    def __init__(self, version, categories):
+        self.version = version
+        self.categories = categories
+        self.by_id = {category.id: category for category in categories}
+        self.by_slug = {category.slug: category for category in categories}
+
+
+_lock = threading.Lock()
+_snapshot = None
+
+
+def _load(version):
+    from .models import Category
+
+    categories = list(Category.objects.all())
+    for category in categories:
+        category.url = category.get_absolute_url()
+    return CatalogSnapshot(version, tuple(categories))
+
+
+def get_catalog():
+    """The current snapshot, reloaded if another process changed a category"""
+    global _snapshot
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Seeded from the clock so an evicted key never matches an old snapshot
+        cache.add(VERSION_KEY, time.time_ns(), None)
+        version = cache.get(VERSION_KEY)
+    snapshot = _snapshot
+    if snapshot is None or snapshot.version != version:
+        with _lock:
+            if _snapshot is None or _snapshot.version != version:
+                _snapshot = _load(version)
+            snapshot = _snapshot
+    return snapshot
+
+
+def bump_version():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, time.time_ns(), None)
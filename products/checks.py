@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+PER_PROCESS_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(deploy=True)
+def shared_cache_check(app_configs, **kwargs):
+    """Catalog validators and index versions are only coherent in a shared cache"""
+    if settings.CACHES['default']['BACKEND'] not in PER_PROCESS_CACHES:
+        return []
+    return [Warning(
+        'The default cache is private to each process.',
+        hint=(
+            'Set CACHE_URL to a cache every worker shares, or workers keep serving '
+            'catalog pages, 304s and index versions from before changes made elsewhere.'
+        ),
+        id='products.W001',
+    )]
@@ -0,0 +1,138 @@
+"""
+Conditional GET for catalog pages.
+
+Listing and product pages carry a weak ETag and a Last-Modified date, and
+a request whose validators still match gets a 304 before any template is
+rendered. The validators are cheap: the last change time and number of
+the products involved (all of them, or one category's) come from one
+``Max('updated')``/``Count`` query, kept in the cache as a stamp for
+``STAMP_TIMEOUT`` seconds. ``signals.py`` clears the stamps on every
+product save or delete, so this worker sees the change at once; the
+timeout bounds how long any other stale copy can be served (counting the
+products catches deletions, which leave ``Max('updated')`` alone). The
+ETag adds the facet index version (sidebar counts span every category),
+the catalog snapshot version (the category nav) and the visitor's own
+state: who they are, their wishlist version, the number of items in
+their cart and their CSRF cookie.
+
+Those versions are only seen by every worker when the cache is shared
+between them (``CACHE_URL``); the ``products.W001`` check warns when a
+deployment runs on the per-process default.
+
+Responses are ``Cache-Control: private, no-cache`` with ``Vary: Cookie``,
+so a reverse proxy never shares them between visitors and browsers
+revalidate on every visit. ETags are weak, which survives proxies that
+compress responses (nginx downgrades strong ETags when it gzips), and
+Django compares ``If-None-Match`` weakly for GET. Bump ``ETAG_VERSION``
+when page markup changes, so browsers holding old pages refetch them.
+
+The ETag minus the visitor's part is also the version of the shared copy
+that ``page_cache.py`` keeps of the page for visitors without a session.
+"""
+import hashlib
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+from . import facets, page_cache
+from .catalog import get_catalog
+
+ETAG_VERSION = 1
+STAMP_TIMEOUT = 60
+EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+
+def _stamp_key(category_id):
+    return f'products:modified:{category_id if category_id is not None else "all"}'
+
+
+def catalog_stamp(category_id=None):
+    """``(last change, product count)`` of a category, or of the whole catalog"""
+    key = _stamp_key(category_id)
+    stamp = cache.get(key)
+    if stamp is None:
+        from .models import Product
+
+        products = Product.objects.all()
+        if category_id is not None:
+            products = products.filter(category_id=category_id)
+        row = products.aggregate(latest=Max('updated'), count=Count('id'))
+        stamp = (row['latest'] or EPOCH, row['count'])
+        cache.set(key, stamp, STAMP_TIMEOUT)
+    return stamp
+
+
+def last_modified(category_id=None):
+    """When the products of a category (or of the whole catalog) last changed"""
+    return catalog_stamp(category_id)[0]
+
+
+def touch(*category_ids):
+    """Drop the stamps of ``category_ids`` and of the whole catalog after a change"""
+    keys = [_stamp_key(cid) for cid in {None, *category_ids}]
+    cache.delete_many(keys)
+    # Again on commit: a request may have re-stamped from the rows as they were before
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _user_state_key(user_id):
+    return f'products:user-state:{user_id}'
+
+
+def user_state_version(user_id):
+    return cache.get(_user_state_key(user_id), 0)
+
+
+def bump_user_state(user_id):
+    """Invalidate a user's pages after a change they would see (e.g. their wishlist)"""
+    try:
+        cache.incr(_user_state_key(user_id))
+    except ValueError:
+        cache.add(_user_state_key(user_id), 1, None)
+
+
+def _visitor_state(request):
+    user = request.user
+    user_part = f'{user.id}.{user_state_version(user.id)}' if user.is_authenticated else 'anon'
+    cart = request.session.get(settings.CART_SESSION_ID) or {}
+    items = sum(item['quantity'] for item in cart.values())
+    return f'{user_part}:{items}:{request.COOKIES.get(settings.CSRF_COOKIE_NAME, "")}'
+
+
+def _validators(request, modified, *parts):
+    page_version = ':'.join(str(part) for part in (ETAG_VERSION, *parts))
+    digest = hashlib.md5(f'{page_version}:{_visitor_state(request)}'.encode()).hexdigest()
+    return f'W/"{digest}"', modified, page_version
+
+
+def catalog_validators(request, category=None):
+    """``(etag, last_modified, page version)`` for a listing, search or next-page fragment"""
+    modified, count = catalog_stamp(category.id if category else None)
+    return _validators(
+        request, modified, modified.isoformat(), count, facets.index.current_version(), get_catalog().version
+    )
+
+
+def product_validators(request, product):
+    """``(etag, last_modified, page version)`` for a product page"""
+    modified = product.updated
+    return _validators(request, modified, product.id, modified.isoformat(), get_catalog().version)
+
+
+def respond(request, validators, render):
+    """304 if the client's copy still matches ``validators``, else the (shared or new) page"""
+    etag, modified, page_version = validators
+    response = get_conditional_response(request, etag=etag, last_modified=int(modified.timestamp()))
+    if response is None:
+        response = page_cache.get_or_render(request, page_version, render)
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(modified.timestamp())
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ['Cookie'])
+    return response
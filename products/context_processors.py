@@ -0,0 +1,5 @@
+from .catalog import get_catalog
+
+
+def catalog(request):
+    return {'categories': get_catalog().categories}
@@ -0,0 +1,161 @@
+"""
+In-memory facet counts for the catalog sidebar.
+
+Every available product is held as ``id -> (category_id, price bucket)``
+with a ``(category_id, bucket) -> count`` table next to it, so listing
+facets are a sum over that small table and search facets a count over
+the matched ids: no aggregate queries per request. Each facet is counted
+with the other facet's selection applied, the usual "disjunctive" way.
+
+The index is built per process with one query and updated in place by
+``signals.py`` when a product is saved or deleted. Once the change
+commits it bumps a cache version, which makes other processes reload on
+their next lookup.
+"""
+import threading
+import time
+from bisect import bisect_right
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import transaction
+
+# Lower edges of the price buckets in rupees; the last one is open-ended
+PRICE_BUCKETS = [0, 500, 1000, 2500, 5000, 10000]
+# Search matches counted in the sidebar (results are capped separately)
+MAX_MATCHES = 5000
+
+
+def price_bucket(price):
+    return max(0, bisect_right(PRICE_BUCKETS, price) - 1)
+
+
+def bucket_range(bucket):
+    """``(low, high)`` bounds of a bucket; ``high`` is None for the last one"""
+    high = PRICE_BUCKETS[bucket + 1] if bucket + 1 < len(PRICE_BUCKETS) else None
+    return PRICE_BUCKETS[bucket], high
+
+
+def bucket_label(bucket):
+    low, high = bucket_range(bucket)
+    if high is None:
+        return f'₹{low:,}+'
+    if low == 0:
+        return f'Under ₹{high:,}'
+    return f'₹{low:,} – ₹{high:,}'
+
+
+class FacetIndex:
+    VERSION_KEY = 'products:facets:version'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self.built = False
+
+    def _load(self):
+        from .models import Product
+
+        self.products = {}
+        self.counts = Counter()
+        for product_id, category_id, price in Product.objects.filter(available=True).values_list(
+            'id', 'category_id', 'price'
+        ).iterator():
+            self._add(product_id, category_id, price)
+        self.built = True
+
+    def _add(self, product_id, category_id, price):
+        key = (category_id, price_bucket(price))
+        self.products[product_id] = key
+        self.counts[key] += 1
+
+    def _discard(self, product_id):
+        key = self.products.pop(product_id, None)
+        if key is not None:
+            self.counts[key] -= 1
+            if not self.counts[key]:
+                del self.counts[key]
+
+    def _shared_version(self):
+        version = cache.get(self.VERSION_KEY)
+        if version is None:
+            # Seeded from the clock so an evicted key never matches an old build
+            cache.add(self.VERSION_KEY, time.time_ns(), None)
+            version = cache.get(self.VERSION_KEY)
+        return version
+
+    def _bump_version(self):
+        try:
+            return cache.incr(self.VERSION_KEY)
+        except ValueError:
+            cache.add(self.VERSION_KEY, time.time_ns(), None)
+            return cache.get(self.VERSION_KEY)
+
+    def _ensure_current(self):
+        version = self._shared_version()
+        if not self.built or version != self.version:
+            self._load()
+            self.version = version
+
+    def _publish(self, product_id, row):
+        with self._lock:
+            version = self._bump_version()
+            if self.built and version == self.version + 1:
+                self._discard(product_id)
+                if row is not None:
+                    self._add(product_id, *row)
+                self.version = version
+            else:
+                # Another process published in between: reload on the next lookup
+                self.built = False
+
+    def update(self, product):
+        key = (product.category_id, price_bucket(product.price)) if product.available else None
+        with self._lock:
+            if self.built and self.products.get(product.id) == key and self._shared_version() == self.version:
+                return  # Counts unchanged
+        product_id, row = product.id, (product.category_id, product.price) if product.available else None
+        # Once committed, so no process reloads the old rows under the new version
+        transaction.on_commit(lambda: self._publish(product_id, row))
+
+    def current_version(self):
+        """Changes whenever any facet count does (part of catalog page ETags)"""
+        return self._shared_version()
+
+    def remove(self, product_id):
+        transaction.on_commit(lambda: self._publish(product_id, None))
+
+    def counts_for(self, category_id=None, bucket=None, product_ids=None):
+        """
+        ``(category counts, price bucket counts)``: categories counted within
+        ``bucket``, buckets within ``category_id``, over ``product_ids`` if given.
+        """
+        with self._lock:
+            self._ensure_current()
+            if product_ids is None:
+                cells = self.counts.items()
+            else:
+                cells = Counter(self.products[pid] for pid in product_ids if pid in self.products).items()
+            categories, buckets = Counter(), [0] * len(PRICE_BUCKETS)
+            for (cell_category, cell_bucket), count in cells:
+                if bucket is None or cell_bucket == bucket:
+                    categories[cell_category] += count
+                if category_id is None or cell_category == category_id:
+                    buckets[cell_bucket] += count
+            return categories, buckets
+
+    def filter_ids(self, product_ids, category_id=None, bucket=None):
+        """``product_ids`` (order kept) narrowed to a category and/or price bucket"""
+        with self._lock:
+            self._ensure_current()
+            keep = []
+            for pid in product_ids:
+                key = self.products.get(pid)
+                if key is None:
+                    continue
+                if (category_id is None or key[0] == category_id) and (bucket is None or key[1] == bucket):
+                    keep.append(pid)
+            return keep
+
+
+index = FacetIndex()
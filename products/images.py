@@ -0,0 +1,183 @@
+"""
+Responsive variants of product images.
+
+Every product image is resized to the ``WIDTHS`` below (never upscaled)
+and saved as WebP plus a JPEG fallback under
+``MEDIA_ROOT/products/variants/``. Variant files are named after the
+SHA-256 of the source file, so an unchanged image maps to files that
+already exist, and a product whose stored hash matches its current file
+is skipped altogether: rebuilds only touch new or replaced images.
+
+What was generated is stored on ``Product.image_variants``::
+
+    {'source': <image name>, 'hash': <sha256>,
+     'webp': [[width, path], ...], 'jpeg': [[width, path], ...]}
+
+and templates read it through ``Product.webp_srcset``,
+``Product.jpeg_srcset`` and ``Product.thumbnail_url``.
+
+``signals.py`` builds the variants of a newly uploaded image in the
+request; ``manage.py build_image_variants`` builds the rest in a process
+pool, optionally after restoring media from a zip archive such as
+``media_backup.zip``. Only filesystem storage is supported, since the
+workers read and write files directly.
+"""
+import hashlib
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+WIDTHS = (240, 480, 960)
+FORMATS = {
+    # name -> (Pillow format, extension, save options)
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+VARIANTS_DIR = 'products/variants'
+CHUNK_SIZE = 1 << 20
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def variant_widths(width):
+    """The target widths for a source ``width`` pixels wide"""
+    widths = [w for w in WIDTHS if w < width]
+    return widths + [min(width, WIDTHS[-1])] if len(widths) < len(WIDTHS) else widths
+
+
+def _flatten(image):
+    """RGB copy of ``image`` on white, for formats without alpha"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render_variants(source_path, media_root, digest=None):
+    """
+    Write the variants of one source file and return ``(hash, variants)``.
+    Runs in worker processes, so it only touches the filesystem.
+    """
+    digest = digest or file_hash(source_path)
+    directory = f'{VARIANTS_DIR}/{digest[:2]}'
+    os.makedirs(os.path.join(media_root, directory), exist_ok=True)
+
+    variants = {name: [] for name in FORMATS}
+    with Image.open(source_path) as original:
+        original = ImageOps.exif_transpose(original)
+        for width in variant_widths(original.width):
+            resized = None
+            for name, (image_format, extension, options) in FORMATS.items():
+                path = f'{directory}/{digest}-{width}.{extension}'
+                target = os.path.join(media_root, path)
+                if not os.path.exists(target):
+                    if resized is None:
+                        height = max(1, round(original.height * width / original.width))
+                        resized = original.resize((width, height), Image.Resampling.LANCZOS)
+                    image = resized if image_format == 'WEBP' else _flatten(resized)
+                    if image.mode not in ('RGB', 'RGBA'):
+                        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+                    # Write then rename, so a half-written file is never served
+                    image.save(f'{target}.tmp', image_format, **options)
+                    os.replace(f'{target}.tmp', target)
+                variants[name].append([width, path])
+    return digest, variants
+
+
+def _task(product_id, source_path, media_root, known_hash, force):
+    digest = file_hash(source_path)
+    if digest == known_hash and not force:
+        return product_id, None, None
+    return (product_id, *render_variants(source_path, media_root, digest))
+
+
+def _record(product, digest, variants):
+    return {'source': product.image.name, 'hash': digest, **variants}
+
+
+def build_product_variants(product):
+    """Build one product's variants in this process and save them on the row"""
+    from .models import Product
+
+    if not product.image:
+        record = {}
+    elif not os.path.exists(product.image.path):
+        return
+    else:
+        record = _record(product, *render_variants(product.image.path, str(settings.MEDIA_ROOT)))
+    product.image_variants = record
+    Product.objects.filter(pk=product.pk).update(image_variants=record)
+
+
+def build_variants(workers=None, force=False):
+    """
+    Build missing or outdated variants for every product with an image.
+    Returns ``(built, skipped, missing)`` counts.
+    """
+    from .models import Product
+
+    media_root = str(settings.MEDIA_ROOT)
+    products = {p.id: p for p in Product.objects.exclude(image='').only('id', 'image', 'image_variants')}
+    tasks, missing = [], 0
+    for product in products.values():
+        path = default_storage.path(product.image.name)
+        if not os.path.exists(path):
+            missing += 1
+            continue
+        tasks.append((product.id, path, media_root, product.image_variants.get('hash'), force))
+
+    built = []
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for product_id, digest, variants in pool.map(_task, *zip(*tasks), chunksize=4):
+                if digest is not None:
+                    product = products[product_id]
+                    product.image_variants = _record(product, digest, variants)
+                    built.append(product)
+        Product.objects.bulk_update(built, ['image_variants'], batch_size=500)
+    return len(built), len(tasks) - len(built), missing
+
+
+def extract_archive(archive_path):
+    """
+    Restore media files from a zip archive into ``MEDIA_ROOT``, leaving
+    files with identical contents alone. Returns the number written.
+    """
+    media_root = os.path.realpath(settings.MEDIA_ROOT)
+    written = 0
+    with zipfile.ZipFile(archive_path) as archive:
+        for member in archive.infolist():
+            # Archives made on Windows use backslashes
+            name = member.filename.replace('\\', '/')
+            if name.endswith('/'):
+                continue
+            target = os.path.realpath(os.path.join(media_root, name))
+            if not target.startswith(media_root + os.sep):
+                continue
+            data = archive.read(member)
+            if os.path.exists(target):
+                with open(target, 'rb') as existing:
+                    if existing.read() == data:
+                        continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as output:
+                output.write(data)
+            written += 1
+    return written
+
+
+def srcset(variants, name):
+    """``srcset`` attribute value for one format of ``Product.image_variants``"""
+    return ', '.join(f'{default_storage.url(path)} {width}w' for width, path in variants.get(name, ()))
@@ -0,0 +1,46 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from products.benchmark import run_stock_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Simulate simultaneous checkouts of one product and report throughput, latency and oversells'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=16, help='Concurrent checkout threads')
+        parser.add_argument('--checkouts', type=int, default=2000, help='Checkout attempts in total')
+        parser.add_argument('--stock', type=int, default=1000, help='Units on hand at the start')
+        parser.add_argument('--shards', type=int, nargs='+', default=[0, 8],
+                            help='Shard counts to compare (0 keeps the stock on the product row)')
+        parser.add_argument('--max-quantity', type=int, default=3, help='Most units in one checkout')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--json', metavar='PATH', help='Also write the results to a JSON file')
+
+    def handle(self, *args, **options):
+        results = [
+            run_stock_benchmark(
+                workers=options['workers'], checkouts=options['checkouts'], stock_units=options['stock'],
+                shards=shards, max_quantity=options['max_quantity'], seed=options['seed'],
+            )
+            for shards in options['shards']
+        ]
+        if results[0]['journal_mode']:
+            self.stdout.write(f"SQLite journal mode: {results[0]['journal_mode']}")
+
+        self.stdout.write(
+            f"{'shards':>6}{'per s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+            f"{'sold':>7}{'sold out':>10}{'errors':>8}{'left':>6}  consistent"
+        )
+        for result in results:
+            self.stdout.write(
+                f"{result['shards']:>6}{result['checkouts_per_second']:>9.0f}{result['p50_ms']:>9.2f}"
+                f"{result['p95_ms']:>9.2f}{result['p99_ms']:>9.2f}{result['units_sold']:>7}"
+                f"{result['sold_out']:>10}{result['errors']:>8}{result['remaining']:>6}  {result['consistent']}"
+            )
+
+        if options['json']:
+            with open(options['json'], 'w') as fh:
+                json.dump(results, fh, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['json']}"))
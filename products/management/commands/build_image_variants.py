@@ -0,0 +1,30 @@
+import time
+import zipfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.images import build_variants, extract_archive
+
+
+class Command(BaseCommand):
+    help = 'Build resized WebP/JPEG variants of product images (only new or changed images)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--archive', help='Restore media from this zip archive (e.g. media_backup.zip) first')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Worker processes (default: one per CPU)')
+        parser.add_argument('--force', action='store_true', help='Rebuild variants of unchanged images too')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['archive']:
+            try:
+                written = extract_archive(options['archive'])
+            except (OSError, zipfile.BadZipFile) as exc:
+                raise CommandError(f'Cannot restore {options["archive"]}: {exc}')
+            self.stdout.write(f'Restored {written} files from {options["archive"]}')
+        built, skipped, missing = build_variants(workers=options['workers'], force=options['force'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Built variants for {built} products ({skipped} unchanged, {missing} missing files) '
+            f'in {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products import stock
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Add units to a product\'s stock (a sold-out product becomes available again)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('slug', help='Product slug')
+        parser.add_argument('units', type=int, help='Units received')
+
+    def handle(self, *args, **options):
+        if options['units'] < 0:
+            raise CommandError('units must not be negative')
+        product = Product.objects.filter(slug=options['slug']).first()
+        if product is None:
+            raise CommandError(f"No product with slug {options['slug']!r}")
+        product = stock.restock(product, options['units'])
+        self.stdout.write(self.style.SUCCESS(f'{product}: {stock.on_hand(product)} units on hand'))
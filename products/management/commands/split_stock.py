@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products import stock
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = "Spread a hot product's stock over several rows so checkouts contend less (0 merges it back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('slug', help='Product slug')
+        parser.add_argument('--shards', type=int, default=8, help='Number of stock shards, 0 for none')
+
+    def handle(self, *args, **options):
+        product = Product.objects.filter(slug=options['slug']).first()
+        if product is None:
+            raise CommandError(f"No product with slug {options['slug']!r}")
+        try:
+            stock.split(product, options['shards'])
+        except ValueError as error:
+            raise CommandError(error)
+        self.stdout.write(self.style.SUCCESS(
+            f"{product}: {stock.on_hand(product)} units over {options['shards']} shards"
+        ))
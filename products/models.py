@@ -1,6 +1,9 @@
+from django.core.files.storage import default_storage
 from django.db import models
 from django.urls import reverse
 
+from . import images
+
 class Category(models.Model):
     name = models.CharField(max_length=200)
     slug = models.SlugField(max_length=200, unique=True)
@@ -15,6 +18,14 @@ class Category(models.Model):
     def get_absolute_url(self):
         return reverse('product_list_by_category', args=[self.slug])
 
+class ProductQuerySet(models.QuerySet):
+    def for_listing(self):
+        """Load what cards and links need (category slug for the URL) in the same query"""
+        return self.select_related('category')
+
+# Written only by stock.py, never by Product.save() on an existing row
+STOCK_FIELDS = ('stock', 'stock_shards')
+
 class Product(models.Model):
     category = models.ForeignKey(Category, related_name='products', on_delete=models.CASCADE)
     name = models.CharField(max_length=200)
@@ -23,14 +34,74 @@ class Product(models.Model):
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     available = models.BooleanField(default=True)
+    # Units on hand, empty when stock isn't tracked (see stock.py)
+    stock = models.PositiveIntegerField(null=True, blank=True)
+    # How many StockShard rows hold part of the stock besides this row
+    stock_shards = models.PositiveSmallIntegerField(default=0, editable=False)
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+    # Resized WebP/JPEG copies of ``image`` (see images.py)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    objects = ProductQuerySet.as_manager()
 
     class Meta:
         ordering = ['name']
+        indexes = [
+            # Keyset pagination orderings (see pagination.py), all products and per category
+            models.Index(fields=['name', 'id'], name='product_avail_name_idx', condition=models.Q(available=True)),
+            models.Index(fields=['created', 'id'], name='product_avail_created_idx', condition=models.Q(available=True)),
+            models.Index(fields=['price', 'id'], name='product_avail_price_idx', condition=models.Q(available=True)),
+            models.Index(fields=['category', 'name', 'id'], name='product_cat_name_idx',
+                         condition=models.Q(available=True)),
+            models.Index(fields=['category', 'created', 'id'], name='product_cat_created_idx',
+                         condition=models.Q(available=True)),
+            models.Index(fields=['category', 'price', 'id'], name='product_cat_price_idx',
+                         condition=models.Q(available=True)),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        # Stock only moves through stock.py's conditional updates: a copy
+        # loaded before a checkout must not write its old count back
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in STOCK_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
     def get_absolute_url(self):
-        return reverse('product_detail', args=[self.category.slug, self.slug])
\ No newline at end of file
+        return reverse('product_detail', args=[self.category.slug, self.slug])
+
+    @property
+    def webp_srcset(self):
+        return images.srcset(self.image_variants, 'webp')
+
+    @property
+    def jpeg_srcset(self):
+        return images.srcset(self.image_variants, 'jpeg')
+
+    @property
+    def thumbnail_url(self):
+        """A mid-sized JPEG variant for ``src``, or the original image"""
+        jpeg = self.image_variants.get('jpeg')
+        if jpeg:
+            return default_storage.url(jpeg[min(1, len(jpeg) - 1)][1])
+        return self.image.url
+
+class StockShard(models.Model):
+    """Part of a hot product's stock, so checkouts don't all update one row"""
+    product = models.ForeignKey(Product, related_name='stock_shard_rows', on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField()
+    quantity = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'shard'], name='stock_shard_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.product} #{self.shard}: {self.quantity}'
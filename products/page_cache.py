@@ -0,0 +1,70 @@
+"""
+Shared copies of catalog pages for visitors without a session.
+
+Sessions are only created when a visitor does something stateful (adding
+to the cart, logging in, or the first product view recorded by the
+deferred "You may also like" request), so a visitor without a session
+cookie is anonymous with an empty cart, and every such visitor sees the
+same page for a URL. ``conditional.respond`` hands those requests here:
+the page is rendered once and served from the cache afterwards, keyed by
+the URL and the page version from ``conditional.py``. That version moves
+with the product stamps (last change and product count), so a change
+stops old copies from being served without deleting anything; they
+expire after ``PAGE_TIMEOUT``. Like the stamps, the copies are only
+shared between workers when the cache is (``CACHE_URL``).
+
+The only per-visitor markup left in those pages is the CSRF token of the
+add-to-cart form. Stored copies hold ``CSRF_MARKER`` in its place, which
+is replaced with the current visitor's token when the page is served.
+"""
+import hashlib
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+from recommendations.stats import CacheStats
+
+PAGE_TIMEOUT = 10 * 60
+CSRF_MARKER = '__csrf_token__'
+CSRF_INPUT = re.compile(r'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+stats = CacheStats('pages')
+
+
+def is_shared(request):
+    """Whether ``request`` gets the page every visitor without a session gets"""
+    return (
+        request.method in ('GET', 'HEAD')
+        and settings.SESSION_COOKIE_NAME not in request.COOKIES
+        and not request.user.is_authenticated
+    )
+
+
+def page_key(request, page_version):
+    digest = hashlib.md5(f'{page_version}|{request.build_absolute_uri()}'.encode()).hexdigest()
+    return f'products:page:{digest}'
+
+
+def get_or_render(request, page_version, render):
+    """The shared copy of the page if ``request`` can have one, else ``render()``"""
+    if not is_shared(request):
+        return render()
+
+    key = page_key(request, page_version)
+    entry = cache.get(key)
+    if entry is not None:
+        stats.hit()
+        content, headers = entry
+        if CSRF_MARKER in content:
+            content = content.replace(CSRF_MARKER, get_token(request))
+        return HttpResponse(content, headers=headers)
+
+    stats.miss()
+    response = render()
+    if response.status_code == 200 and not response.streaming and not response.cookies:
+        content = CSRF_INPUT.sub(rf'\g<1>{CSRF_MARKER}\g<2>', response.content.decode(response.charset))
+        cache.set(key, (content, dict(response.items())), PAGE_TIMEOUT)
+    return response
@@ -0,0 +1,103 @@
+"""
+Keyset (cursor) pagination for catalog listings.
+
+A page is fetched with ``WHERE (sort_value, id) > (last_value, last_id)``
+in one of the orderings below, each served by a composite index on
+``Product`` (see ``Product.Meta.indexes``), so page N costs the same as
+page 1: no OFFSET scan, and no COUNT unless the caller asks for one.
+Cursors are opaque url-safe strings holding the last row's sort value
+and id. Search results ranked by relevance page through the ranked id
+list instead, with the cursor holding a position in it.
+"""
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+from .models import Product
+
+# name -> (field, descending)
+SORTS = {
+    'name': ('name', False),
+    'newest': ('created', True),
+    'price': ('price', False),
+    'price_desc': ('price', True),
+}
+SORT_CHOICES = [
+    ('name', 'Name'),
+    ('newest', 'Newest'),
+    ('price', 'Price: low to high'),
+    ('price_desc', 'Price: high to low'),
+]
+DEFAULT_SORT = 'name'
+RELEVANCE = 'relevance'
+PAGE_SIZE = 24
+
+
+class Page:
+    def __init__(self, items, next_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def encode_cursor(*values):
+    payload = json.dumps(values, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """The values packed into ``token``, or None for a missing or malformed cursor"""
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def keyset_page(queryset, sort=DEFAULT_SORT, after=None, size=PAGE_SIZE):
+    """One page of ``queryset`` in ``sort`` order, starting after the ``after`` cursor"""
+    field, descending = SORTS[sort]
+    cursor = decode_cursor(after)
+    if cursor and len(cursor) == 2:
+        try:
+            value = Product._meta.get_field(field).to_python(cursor[0])
+            last_id = int(cursor[1])
+        except (ValidationError, TypeError, ValueError):
+            value = None
+        if value is not None:
+            # Range on the sort column first so the index is used, ties by id
+            if descending:
+                queryset = queryset.filter(
+                    Q(**{f'{field}__lte': value}) & (Q(**{f'{field}__lt': value}) | Q(id__lt=last_id))
+                )
+            else:
+                queryset = queryset.filter(
+                    Q(**{f'{field}__gte': value}) & (Q(**{f'{field}__gt': value}) | Q(id__gt=last_id))
+                )
+
+    ordering = (f'-{field}', '-id') if descending else (field, 'id')
+    rows = list(queryset.order_by(*ordering)[:size + 1])
+    if len(rows) <= size:
+        return Page(rows)
+    last = rows[size - 1]
+    return Page(rows[:size], encode_cursor(Product._meta.get_field(field).value_to_string(last), last.id))
+
+
+def ranked_page(ids, queryset, after=None, size=PAGE_SIZE):
+    """One page of products in the order of the ranked ``ids``"""
+    cursor = decode_cursor(after)
+    # JSON true decodes to a bool, which is an int too
+    start = cursor[0] if cursor and type(cursor[0]) is int and cursor[0] > 0 else 0
+    page_ids = ids[start:start + size]
+    rank = {pid: i for i, pid in enumerate(page_ids)}
+    rows = sorted(queryset.filter(id__in=page_ids), key=lambda p: rank[p.id])
+    end = start + size
+    return Page(rows, encode_cursor(end) if end < len(ids) else None)
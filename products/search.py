@@ -0,0 +1,306 @@
+"""
+Full-text product search.
+
+On SQLite with FTS5, migration 0002 creates the ``products_product_fts``
+virtual table holding each product's name and description under its id.
+Queries are BM25-ranked with the name weighted over the description,
+every word matches as a prefix ("runn sho" finds "running shoes"), and
+the join back to ``products_product`` applies availability and category
+filters in the same statement.
+
+On other databases, or with ``PRODUCTS_SEARCH_BACKEND = 'python'``, a
+process-local inverted index provides the same interface and ranking.
+Both are kept in sync by ``signals.py``; ``manage.py
+rebuild_search_index`` rebuilds them in bulk. With ``'auto'`` a process
+that found no FTS5 table looks again every ``AUTO_RECHECK`` seconds, so
+it switches over (and stops writing only to its own index) once
+``migrate`` creates the table.
+"""
+import math
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+FTS_TABLE = 'products_product_fts'
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+MAX_RESULTS = 500
+AUTO_RECHECK = 60
+TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or '').lower())
+
+
+class FTS5Backend:
+    """Search through the SQLite FTS5 virtual table"""
+
+    name = 'fts5'
+
+    def search(self, tokens, category_id=None, limit=MAX_RESULTS):
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        sql = (
+            f'SELECT {FTS_TABLE}.rowid FROM {FTS_TABLE} '
+            f'JOIN products_product ON products_product.id = {FTS_TABLE}.rowid '
+            f'WHERE {FTS_TABLE} MATCH %s AND products_product.available'
+        )
+        params = [match]
+        if category_id is not None:
+            sql += ' AND products_product.category_id = %s'
+            params.append(category_id)
+        sql += f' ORDER BY bm25({FTS_TABLE}, %s, %s) LIMIT %s'
+        params += [NAME_WEIGHT, DESCRIPTION_WEIGHT, limit]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+
+    def update(self, product):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product.id])
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)',
+                [product.id, product.name, product.description],
+            )
+
+    def remove(self, product_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, name, description) '
+                f'SELECT id, name, description FROM products_product'
+            )
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+            cursor.execute(f'SELECT COUNT(*) FROM {FTS_TABLE}')
+            return cursor.fetchone()[0]
+
+
+class PythonBackend:
+    """
+    In-memory inverted index with the same BM25 ranking. Each process
+    keeps its own copy. A committed change bumps a cache version and
+    records the changed product id under the new version; other processes
+    catch up on their next search by re-reading just those products, and
+    only rebuild from scratch when more than ``MAX_REPLAY`` versions
+    behind or when a change record is missing.
+    """
+
+    name = 'python'
+    VERSION_KEY = 'products:search:version'
+    CHANGE_KEY = 'products:search:change:{}'
+    CHANGE_TIMEOUT = 60 * 60
+    MAX_REPLAY = 100
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self.built = False
+
+    def _reset(self):
+        self.postings = defaultdict(dict)  # term -> {product_id: weighted tf}
+        self.terms = []  # sorted vocabulary, for prefix lookups
+        self.docs = {}  # product_id -> (terms, length, category_id, available)
+        self.total_length = 0.0
+
+    def _current_version(self):
+        version = cache.get(self.VERSION_KEY)
+        if version is None:
+            # Seeded from the clock so an evicted key never matches an old build
+            cache.add(self.VERSION_KEY, time.time_ns(), None)
+            version = cache.get(self.VERSION_KEY)
+        return version
+
+    def _bump_version(self, product_id=None):
+        """Publish a new version, recording which product it changed"""
+        try:
+            version = cache.incr(self.VERSION_KEY)
+        except ValueError:
+            cache.add(self.VERSION_KEY, time.time_ns(), None)
+            version = cache.get(self.VERSION_KEY)
+        if product_id is not None:
+            cache.set(self.CHANGE_KEY.format(version), product_id, self.CHANGE_TIMEOUT)
+        return version
+
+    def _add(self, product_id, name, description, category_id, available):
+        counts = Counter()
+        for term in tokenize(name):
+            counts[term] += NAME_WEIGHT
+        for term in tokenize(description):
+            counts[term] += DESCRIPTION_WEIGHT
+        for term, tf in counts.items():
+            if term not in self.postings:
+                insort(self.terms, term)
+            self.postings[term][product_id] = tf
+        length = sum(counts.values())
+        self.docs[product_id] = (list(counts), length, category_id, available)
+        self.total_length += length
+
+    def _discard(self, product_id):
+        doc = self.docs.pop(product_id, None)
+        if doc is None:
+            return
+        terms, length, _, _ = doc
+        for term in terms:
+            postings = self.postings[term]
+            postings.pop(product_id, None)
+            if not postings:
+                del self.postings[term]
+                self.terms.pop(bisect_left(self.terms, term))
+        self.total_length -= length
+
+    def _load(self):
+        from .models import Product
+
+        self._reset()
+        for row in Product.objects.values_list('id', 'name', 'description', 'category_id', 'available').iterator():
+            self._add(*row)
+        self.built = True
+
+    def _replay(self, version):
+        """Re-read the products changed since our version; False if that can't be done"""
+        from .models import Product
+
+        if not self.built or not 0 < version - self.version <= self.MAX_REPLAY:
+            return False
+        keys = [self.CHANGE_KEY.format(v) for v in range(self.version + 1, version + 1)]
+        changed = cache.get_many(keys)
+        if len(changed) != len(keys):
+            return False
+        product_ids = set(changed.values())
+        rows = Product.objects.filter(id__in=product_ids).values_list(
+            'id', 'name', 'description', 'category_id', 'available'
+        )
+        for product_id in product_ids:
+            self._discard(product_id)
+        for row in rows:
+            self._add(*row)
+        return True
+
+    def _ensure_current(self):
+        version = self._current_version()
+        if not self.built or version != self.version:
+            if not self._replay(version):
+                self._load()
+            self.version = version
+
+    def _expand(self, token):
+        """Vocabulary terms starting with ``token``"""
+        start = bisect_left(self.terms, token)
+        end = start
+        while end < len(self.terms) and self.terms[end].startswith(token):
+            end += 1
+        return self.terms[start:end]
+
+    def search(self, tokens, category_id=None, limit=MAX_RESULTS):
+        with self._lock:
+            self._ensure_current()
+            n_docs = len(self.docs)
+            if not n_docs:
+                return []
+            average = self.total_length / n_docs
+            scores = None
+            for token in tokens:
+                token_scores = defaultdict(float)
+                for term in self._expand(token):
+                    postings = self.postings[term]
+                    idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for product_id, tf in postings.items():
+                        length = self.docs[product_id][1]
+                        norm = tf + self.K1 * (1 - self.B + self.B * length / average)
+                        token_scores[product_id] += idf * tf * (self.K1 + 1) / norm
+                # Every word has to match
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {pid: score + token_scores[pid] for pid, score in scores.items() if pid in token_scores}
+                if not scores:
+                    return []
+
+            hits = [
+                (score, product_id) for product_id, score in scores.items()
+                if self.docs[product_id][3] and (category_id is None or self.docs[product_id][2] == category_id)
+            ]
+        hits.sort(key=lambda hit: (-hit[0], hit[1]))
+        return [product_id for _, product_id in hits[:limit]]
+
+    def _publish(self, product_id, row):
+        with self._lock:
+            version = self._bump_version(product_id)
+            if self.built and version == self.version + 1:
+                self._discard(product_id)
+                if row is not None:
+                    self._add(*row)
+                self.version = version
+            # Otherwise we were behind: the next search replays this change too
+
+    def update(self, product):
+        row = (product.id, product.name, product.description, product.category_id, product.available)
+        # Once committed, so no process re-reads the row before it is
+        transaction.on_commit(lambda: self._publish(product.id, row))
+
+    def remove(self, product_id):
+        transaction.on_commit(lambda: self._publish(product_id, None))
+
+    def rebuild(self):
+        with self._lock:
+            self._load()
+            self.version = self._bump_version()
+            return len(self.docs)
+
+
+_backends = {}
+_auto = {}  # The backend 'auto' picked, and when it last looked for the table
+
+
+def fts5_table_exists():
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        return cursor.fetchone() is not None
+
+
+def get_backend():
+    """The configured backend; 'auto' picks FTS5 once its table exists"""
+    name = settings.PRODUCTS_SEARCH_BACKEND
+    if name == 'auto':
+        now = time.monotonic()
+        if _auto.get('name') != 'fts5' and now - _auto.get('checked', -AUTO_RECHECK) >= AUTO_RECHECK:
+            _auto.update(name='fts5' if fts5_table_exists() else 'python', checked=now)
+        name = _auto['name']
+    if name not in _backends:
+        _backends[name] = FTS5Backend() if name == 'fts5' else PythonBackend()
+    return _backends[name]
+
+
+def search_product_ids(query, category_id=None, limit=MAX_RESULTS):
+    """Ids of available products matching every word of ``query``, best first"""
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+    return get_backend().search(tokens, category_id=category_id, limit=limit)
+
+
+def index_product(product):
+    get_backend().update(product)
+
+
+def remove_product(product_id):
+    get_backend().remove(product_id)
+
+
+def rebuild_index():
+    """Re-index every product; returns the number indexed"""
+    return get_backend().rebuild()
@@ -0,0 +1,60 @@
+"""
+Signal handlers keeping the product search, suggestion and facet indexes,
+image variants, the catalog snapshot and page validators in sync
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import catalog, conditional, facets, images, search, suggest
+from .models import Category, Product
+
+
+@receiver(pre_save, sender=Product)
+def remember_previous_state(sender, instance, raw=False, **kwargs):
+    # One lookup for every post_save handler here and in other apps
+    # (recommendations) that reacts to a change of category, availability
+    # or indexed text
+    previous = (
+        Product.objects.filter(pk=instance.pk)
+        .values_list('category_id', 'available', 'name', 'description').first()
+        if instance.pk and not raw else None
+    )
+    category_id, available, name, description = previous or (None, None, None, None)
+    instance._previous_category_id, instance._previous_available = category_id, available
+    instance._previous_text = (name, description) if previous else None
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    search.index_product(instance)
+    facets.index.update(instance)
+    transaction.on_commit(lambda: suggest.index.update_product(instance))
+    # A product that moved also changes its old category's pages
+    conditional.touch(instance.category_id, getattr(instance, '_previous_category_id', None))
+    # A new upload (or a cleared image) needs its variants rebuilt; fixture
+    # loads are left to ``build_image_variants`` as their files may not exist yet
+    if not raw and instance.image.name != instance.image_variants.get('source', ''):
+        images.build_product_variants(instance)
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_search_index(sender, instance, **kwargs):
+    search.remove_product(instance.id)
+    facets.index.remove(instance.id)
+    product_id = instance.id  # Cleared once the delete completes
+    transaction.on_commit(lambda: suggest.index.remove_product(product_id))
+    conditional.touch(instance.category_id)
+
+
+@receiver(post_save, sender=Category)
+def refresh_catalog(sender, instance, **kwargs):
+    catalog.bump_version()
+    transaction.on_commit(lambda: suggest.index.update_category(instance))
+
+
+@receiver(post_delete, sender=Category)
+def remove_category(sender, instance, **kwargs):
+    catalog.bump_version()
+    category_id = instance.id
+    transaction.on_commit(lambda: suggest.index.remove_category(category_id))
@@ -0,0 +1,159 @@
+"""
+Stock on hand and reservation at checkout.
+
+``Product.stock`` is the number of units on hand, or empty for products
+whose stock isn't tracked. Units are taken with a conditional
+``UPDATE ... SET stock = stock - n WHERE id = ... AND stock >= n``: the
+database checks and decrements in one statement, so two checkouts can
+never both sell the last unit, and nothing is held between a read and a
+write. ``reserve`` does that for every line of an order in one
+transaction and rolls all of it back when any line is short. For the
+same reason ``Product.save()`` never writes the stock columns of an
+existing row; units are added with ``restock`` (``manage.py restock``)
+as ``stock = stock + n``.
+
+A product whose last unit is sold is marked unavailable once the order
+commits, which takes it out of listings, search and recommendations
+through the usual save signals; ``restock`` puts it back. Adding to the
+cart checks ``can_supply`` so shoppers hear about shortages early, but
+only the reservation at checkout is authoritative.
+
+A hot product's units can be split over ``StockShard`` rows with
+``split`` so that simultaneous checkouts decrement different rows
+instead of queueing on one. A reservation starts at a random shard and
+moves on when one is short; units left on the product row (e.g. a
+restock entered in the admin) count as one more shard. Sharding pays off
+on databases with row locks (PostgreSQL, MySQL); SQLite takes one lock
+for any write, so there it only adds statements. ``manage.py
+benchmark_stock`` measures either way (see benchmark.py).
+"""
+import random
+
+from django.db import transaction
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import Product, StockShard
+
+
+class OutOfStock(Exception):
+    """Not enough units of ``products`` to reserve"""
+
+    def __init__(self, products):
+        self.products = products
+        super().__init__(', '.join(product.name for product in products))
+
+
+def _take(queryset, field, quantity):
+    """Decrement ``field`` of the row in ``queryset`` by ``quantity`` if it holds that many"""
+    return queryset.filter(**{f'{field}__gte': quantity}).update(**{field: F(field) - quantity}) == 1
+
+
+def _sources(product):
+    """Rows holding the product's units: its shards from a random one on, then the product"""
+    start = random.randrange(product.stock_shards) if product.stock_shards else 0
+    shards = [
+        (StockShard.objects.filter(product_id=product.id, shard=(start + i) % product.stock_shards), 'quantity')
+        for i in range(product.stock_shards)
+    ]
+    return shards + [(Product.objects.filter(id=product.id), 'stock')]
+
+
+def _take_units(product, quantity):
+    sources = _sources(product)
+    # Common case: one row holds them all, one statement
+    for queryset, field in sources:
+        if _take(queryset, field, quantity):
+            return True
+    if not product.stock_shards or (on_hand(product) or 0) < quantity:
+        return False
+
+    # Spread over several shards: take what each holds, re-reading after a lost race
+    needed = quantity
+    for queryset, field in sources:
+        while needed:
+            held = queryset.values_list(field, flat=True).first() or 0
+            if not held:
+                break
+            taken = min(held, needed)
+            if _take(queryset, field, taken):
+                needed -= taken
+    return not needed
+
+
+def reserve(lines):
+    """
+    Take the units for every ``(product, quantity)`` in ``lines``, or none
+    of them: raises ``OutOfStock`` naming the products that are short.
+    ``product`` needs ``id``, ``stock`` and ``stock_shards`` loaded.
+    """
+    # Fixed order, so concurrent orders lock rows in the same sequence
+    lines = sorted(lines, key=lambda line: line[0].id)
+    with transaction.atomic():
+        short = [
+            product for product, quantity in lines
+            if (product.stock is not None or product.stock_shards) and not _take_units(product, quantity)
+        ]
+        if short:
+            raise OutOfStock(short)
+        tracked = [product.id for product, _ in lines if product.stock is not None or product.stock_shards]
+        if tracked:
+            transaction.on_commit(lambda: _mark_sold_out(tracked))
+
+
+def _mark_sold_out(product_ids):
+    sold_out = Product.objects.filter(id__in=product_ids, available=True, stock=0).exclude(
+        stock_shard_rows__quantity__gt=0
+    )
+    for product in sold_out:
+        product.available = False
+        product.save(update_fields=['available', 'updated'])
+
+
+def restock(product, units):
+    """
+    Add ``units`` to ``product`` (starting to track its stock if it wasn't);
+    a product that had sold out is made available again.
+    """
+    with transaction.atomic():
+        sold_out = on_hand(product) == 0
+        Product.objects.filter(id=product.id).update(stock=Coalesce(F('stock'), Value(0)) + units)
+        product = Product.objects.get(id=product.id)
+        if sold_out and units and not product.available:
+            product.available = True
+            product.save(update_fields=['available', 'updated'])
+    return product
+
+
+def can_supply(product, quantity):
+    """Whether ``quantity`` units of ``product`` are on hand right now"""
+    units = on_hand(product)
+    return units is None or units >= quantity
+
+
+def on_hand(product):
+    """Units of ``product`` left across its row and shards (None if untracked)"""
+    stock = Product.objects.filter(id=product.id).values_list('stock', flat=True).first()
+    shards = StockShard.objects.filter(product_id=product.id).aggregate(total=Sum('quantity'))['total']
+    if stock is None and shards is None:
+        return None
+    return (stock or 0) + (shards or 0)
+
+
+def split(product, shards):
+    """
+    Spread ``product``'s units evenly over ``shards`` StockShard rows, or
+    move them all back onto the product row with ``shards=0``.
+    """
+    with transaction.atomic():
+        product = Product.objects.select_for_update().get(id=product.id)
+        held = list(StockShard.objects.select_for_update().filter(product=product).values_list('quantity', flat=True))
+        if product.stock is None and not held:
+            raise ValueError(f'Stock of {product} is not tracked')
+        total = (product.stock or 0) + sum(held)
+        StockShard.objects.filter(product=product).delete()
+        share, extra = divmod(total, shards) if shards else (0, 0)
+        StockShard.objects.bulk_create([
+            StockShard(product=product, shard=shard, quantity=share + (shard < extra)) for shard in range(shards)
+        ])
+        Product.objects.filter(id=product.id).update(stock=0 if shards else total, stock_shards=shards)
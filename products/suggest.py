@@ -0,0 +1,263 @@
+"""
+Typeahead suggestions for the search box.
+
+Product and category names are tokenized like search (``search.tokenize``)
+and every word-start suffix of a name becomes a key: "Trail Running
+Shoes" is found by "trail", "running sh" and "shoes". Keys are kept in a
+sorted list with a parallel ``array`` of packed references (id, kind and
+word offset), so a lookup is a bisect plus a short scan and never
+touches the database.
+
+Each process builds the index once, from a snapshot kept in the shared
+cache when one matches the current version, otherwise with two queries.
+The snapshot is a few flat strings and arrays, so storing and loading it
+stays cheap for large catalogs. ``signals.py`` updates the index in place
+when a product's or category's name, slug, category or availability
+changes, once the change commits; the process that applied the change
+stores a new snapshot and bumps the version, and other processes reload
+from it on their next lookup. A process whose index is out of date first
+loads the current snapshot, so a save that changes nothing suggestions
+show (a price or stock change) never makes every process reload.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+
+from django.core.cache import cache
+from django.urls import get_script_prefix, reverse
+
+from .search import tokenize
+
+MAX_PRODUCTS = 8
+MAX_CATEGORIES = 3
+SCAN_LIMIT = 200  # Keys looked at per lookup, enough to rank the top few
+PRODUCT, CATEGORY = 0, 1
+SEPARATOR = '\x00'
+
+
+def name_keys(name):
+    """Every word-start suffix of ``name``, with its word offset"""
+    tokens = tokenize(name)
+    return [(' '.join(tokens[i:]), i) for i in range(len(tokens))]
+
+
+def pack(kind, item_id, offset):
+    return item_id << 6 | min(offset, 31) << 1 | kind
+
+
+def unpack(ref):
+    return ref & 1, ref >> 6, ref >> 1 & 31
+
+
+class SuggestIndex:
+    VERSION_KEY = 'products:suggest:version'
+    SNAPSHOT_KEY = 'products:suggest:snapshot'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._urls = {}
+        self.version = None
+        self.built = False
+
+    def _add_keys(self, kind, item_id, name):
+        for key, offset in name_keys(name):
+            position = bisect_right(self.keys, key)
+            self.keys.insert(position, key)
+            self.refs.insert(position, pack(kind, item_id, offset))
+
+    def _discard_keys(self, kind, item_id, name):
+        for key, offset in name_keys(name):
+            ref = pack(kind, item_id, offset)
+            for position in range(bisect_left(self.keys, key), bisect_right(self.keys, key)):
+                if self.refs[position] == ref:
+                    del self.keys[position]
+                    del self.refs[position]
+                    break
+
+    def _store_snapshot(self):
+        product_ids = array('q', self.products)
+        cache.set(self.SNAPSHOT_KEY, {
+            'version': self.version,
+            'keys': SEPARATOR.join(self.keys),
+            'refs': self.refs.tobytes(),
+            'product_ids': product_ids.tobytes(),
+            'product_names': SEPARATOR.join(self.products[pid][0] for pid in product_ids),
+            'product_slugs': SEPARATOR.join(self.products[pid][1] for pid in product_ids),
+            'product_categories': array('q', (self.products[pid][2] for pid in product_ids)).tobytes(),
+            'categories': list(self.categories.items()),
+        }, None)
+
+    def _load_snapshot(self, version):
+        snapshot = cache.get(self.SNAPSHOT_KEY)
+        if snapshot is None or snapshot['version'] != version:
+            return False
+        self.keys = snapshot['keys'].split(SEPARATOR) if snapshot['keys'] else []
+        self.refs = array('q', snapshot['refs'])
+        product_ids = array('q', snapshot['product_ids'])
+        names = snapshot['product_names'].split(SEPARATOR) if product_ids else []
+        slugs = snapshot['product_slugs'].split(SEPARATOR) if product_ids else []
+        self.products = dict(zip(product_ids, zip(names, slugs, array('q', snapshot['product_categories']))))
+        self.categories = dict(snapshot['categories'])
+        return True
+
+    def _load(self):
+        from .models import Category, Product
+
+        self.categories = {cid: (name, slug) for cid, name, slug in Category.objects.values_list('id', 'name', 'slug')}
+        self.products = {
+            pid: (name, slug, category_id) for pid, name, slug, category_id in
+            Product.objects.filter(available=True).values_list('id', 'name', 'slug', 'category_id').iterator()
+        }
+        entries = [
+            (key, pack(CATEGORY, cid, offset))
+            for cid, (name, _) in self.categories.items() for key, offset in name_keys(name)
+        ]
+        entries.extend(
+            (key, pack(PRODUCT, pid, offset))
+            for pid, (name, _, _) in self.products.items() for key, offset in name_keys(name)
+        )
+        entries.sort()
+        self.keys = [key for key, _ in entries]
+        self.refs = array('q', (ref for _, ref in entries))
+
+    def _shared_version(self):
+        version = cache.get(self.VERSION_KEY)
+        if version is None:
+            # Seeded from the clock so an evicted key never matches an old build
+            cache.add(self.VERSION_KEY, time.time_ns(), None)
+            version = cache.get(self.VERSION_KEY)
+        return version
+
+    def _ensure_current(self):
+        version = self._shared_version()
+        if not self.built or version != self.version:
+            self.version = version
+            if not self._load_snapshot(version):
+                self._load()
+                self._store_snapshot()
+            self.built = True
+
+    def _apply(self, change):
+        """
+        Run ``change`` (which returns whether anything changed) on an index
+        that is current, then publish a new version.
+        """
+        with self._lock:
+            version = self._shared_version()
+            current = self.built and version == self.version
+            if not current and self._load_snapshot(version):
+                self.version, self.built, current = version, True, True
+            if current and not change():
+                return
+            previous = self.version
+            try:
+                self.version = cache.incr(self.VERSION_KEY)
+            except ValueError:
+                cache.add(self.VERSION_KEY, time.time_ns(), None)
+                self.version = cache.get(self.VERSION_KEY)
+            if current and self.version == previous + 1:
+                self._store_snapshot()
+            else:
+                # Stale, or another process changed it meanwhile: reload on next lookup
+                self.built = False
+
+    def update_product(self, product):
+        new = (product.name, product.slug, product.category_id) if product.available else None
+
+        def change():
+            old = self.products.get(product.id)
+            if old == new:
+                return False
+            if old is not None:
+                del self.products[product.id]
+                self._discard_keys(PRODUCT, product.id, old[0])
+            if new is not None:
+                self.products[product.id] = new
+                self._add_keys(PRODUCT, product.id, product.name)
+            return True
+
+        self._apply(change)
+
+    def remove_product(self, product_id):
+        def change():
+            old = self.products.pop(product_id, None)
+            if old is not None:
+                self._discard_keys(PRODUCT, product_id, old[0])
+            return old is not None
+
+        self._apply(change)
+
+    def update_category(self, category):
+        new = (category.name, category.slug)
+
+        def change():
+            old = self.categories.get(category.id)
+            if old == new:
+                return False
+            if old is not None:
+                self._discard_keys(CATEGORY, category.id, old[0])
+            self.categories[category.id] = new
+            self._add_keys(CATEGORY, category.id, category.name)
+            return True
+
+        self._apply(change)
+
+    def remove_category(self, category_id):
+        def change():
+            old = self.categories.pop(category_id, None)
+            if old is not None:
+                self._discard_keys(CATEGORY, category_id, old[0])
+            return old is not None
+
+        self._apply(change)
+
+    def _url_templates(self):
+        """Product and category URL patterns, reversed once per script prefix"""
+        prefix = get_script_prefix()
+        if prefix not in self._urls:
+            product_url = reverse('product_detail', args=['CATEGORY', 'PRODUCT'])
+            category_url = reverse('product_list_by_category', args=['CATEGORY'])
+            self._urls[prefix] = (
+                product_url.replace('CATEGORY', '{0}').replace('PRODUCT', '{1}'),
+                category_url.replace('CATEGORY', '{0}'),
+            )
+        return self._urls[prefix]
+
+    def suggest(self, query, max_products=MAX_PRODUCTS, max_categories=MAX_CATEGORIES):
+        """
+        ``(products, categories)`` whose names have a word run starting with
+        ``query``: lists of ``(name, url)``, names starting with it first.
+        """
+        prefix = ' '.join(tokenize(query))
+        if not prefix:
+            return [], []
+        product_url, category_url = self._url_templates()
+        with self._lock:
+            self._ensure_current()
+            found = ({}, {})  # per kind: id -> lowest word offset
+            start = bisect_left(self.keys, prefix)
+            for position in range(start, min(start + SCAN_LIMIT, len(self.keys))):
+                if not self.keys[position].startswith(prefix):
+                    break
+                kind, item_id, offset = unpack(self.refs[position])
+                if offset < found[kind].get(item_id, 32):
+                    found[kind][item_id] = offset
+
+            products = []
+            for _, name, pid in sorted((offset, self.products[pid][0], pid) for pid, offset in found[PRODUCT].items()):
+                _, slug, category_id = self.products[pid]
+                if category_id in self.categories:
+                    products.append((name, product_url.format(self.categories[category_id][1], slug)))
+                    if len(products) == max_products:
+                        break
+            categories = [
+                (name, category_url.format(self.categories[cid][1]))
+                for _, name, cid in sorted(
+                    (offset, self.categories[cid][0], cid) for cid, offset in found[CATEGORY].items()
+                )[:max_categories]
+            ]
+        return products, categories
+
+
+index = SuggestIndex()
@@ -0,0 +1,82 @@
+"""
+Cached product cards.
+
+``{% product_cards products %}`` renders a grid's cards from the cache:
+one ``get_many`` for the page, the template only for the misses, one
+``set_many`` to store them. A card's key holds ``Product.updated`` and a
+digest of the image name, variants hash and category slug, so editing
+the product, replacing its image, rebuilding its variants or renaming
+its category produces a new key and the
+old entry simply expires. Bump ``CARD_VERSION`` when the card markup
+changes.
+
+Cached markup is the same for every visitor; the wishlist heart is
+per-user and is substituted for ``WISHLIST_SLOT`` after the lookup.
+Hit ratios are reported under ``product_cards`` by the cache stats view.
+"""
+import hashlib
+
+from django import template
+from django.core.cache import cache
+from django.template.loader import get_template
+from django.urls import reverse
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from recommendations.stats import CacheStats
+
+register = template.Library()
+
+CARD_TEMPLATE = 'products/_product_card.html'
+CARD_VERSION = 2
+CARD_TIMEOUT = 24 * 60 * 60
+WISHLIST_SLOT = '<!-- wishlist -->'
+
+stats = CacheStats('product_cards')
+
+
+def card_key(product):
+    image_version = f"{product.image.name}:{product.image_variants.get('hash', '')}"
+    digest = hashlib.md5(f'{image_version}|{product.category.slug}'.encode()).hexdigest()[:12]
+    return f'products:card:v{CARD_VERSION}:{product.id}:{product.updated.timestamp():.6f}:{digest}'
+
+
+def wishlist_button(product, in_wishlist):
+    if in_wishlist:
+        return format_html(
+            '<a class="icon-button active" href="{}" title="Remove from wishlist" '
+            'aria-label="Remove from wishlist">♥</a>', reverse('wishlist_remove', args=[product.id])
+        )
+    return format_html(
+        '<a class="icon-button" href="{}" title="Add to wishlist" aria-label="Add to wishlist">♡</a>',
+        reverse('wishlist_add', args=[product.id])
+    )
+
+
+@register.simple_tag(takes_context=True)
+def product_cards(context, products):
+    """Cards for ``products``, with wishlist hearts for signed-in users"""
+    products = list(products)
+    keys = {product.id: card_key(product) for product in products}
+    cached = cache.get_many(keys.values())
+
+    missing = {}
+    card = get_template(CARD_TEMPLATE)
+    for product in products:
+        if keys[product.id] in cached:
+            stats.hit()
+        else:
+            stats.miss()
+            missing[keys[product.id]] = card.render({'product': product})
+    if missing:
+        cache.set_many(missing, CARD_TIMEOUT)
+        cached.update(missing)
+
+    user = context.get('user')
+    show_wishlist = user is not None and user.is_authenticated
+    wishlist_ids = set(context.get('wishlist_product_ids') or ())
+    html = []
+    for product in products:
+        button = wishlist_button(product, product.id in wishlist_ids) if show_wishlist else ''
+        html.append(cached[keys[product.id]].replace(WISHLIST_SLOT, button, 1))
+    return mark_safe(''.join(html))
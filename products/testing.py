@@ -0,0 +1,58 @@
+"""
+Fixtures shared by the apps' query-count tests.
+
+Listing pages (catalog, cart, wishlist, recommendation grids) should cost
+the same number of queries however many products they show. Test cases
+mix in ``QueryCountMixin``, grow the page between two counts with
+``add_products`` (and ``fill_cart``), and compare.
+"""
+from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from .models import Product
+
+
+class QueryCountMixin:
+    def add_products(self, count, categories, name='Widget'):
+        """``count`` more products named ``name`` and spread over ``categories``"""
+        start = Product.objects.count()
+        return [
+            Product.objects.create(
+                category=categories[i % len(categories)], name=f'{name} {i}', slug=f'{name.lower()}-{i}',
+                price=10 + i,
+            )
+            for i in range(start, start + count)
+        ]
+
+    def fill_cart(self, products):
+        """Put one of each of ``products`` in the test client's cart"""
+        session = self.client.session
+        cart = session.get(settings.CART_SESSION_ID, {})
+        for product in products:
+            cart[str(product.id)] = {'quantity': 1, 'price': str(product.price)}
+        session[settings.CART_SESSION_ID] = cart
+        session.save()
+
+    def warm_up(self, url):
+        """Run before the counted request, after a first request to ``url``"""
+
+    def count_queries(self, url):
+        # The first request warms the session and the per-process catalog,
+        # search and facet indexes
+        self.client.get(url, secure=True)
+        self.warm_up(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertConstantQueries(self, url, grow=None, few_url=None):
+        """
+        Requesting ``url`` costs as many queries after ``grow()`` as before
+        (or ``few_url`` before and ``url`` after, for pages sized by the URL).
+        """
+        few = self.count_queries(few_url or url)
+        if grow is not None:
+            grow()
+        self.assertEqual(self.count_queries(url), few)
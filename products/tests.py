@@ -1,3 +1,704 @@
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from recommendations.models import ProductView
+from wishlist.models import Wishlist
+from PIL import Image
+
+from . import checks, conditional, facets, images, page_cache, pagination, search, stock, suggest
+from .models import Category, Product, StockShard
+from .testing import QueryCountMixin
+from .templatetags.product_cards import stats as card_stats
+
+
+class ListingQueryCountTests(QueryCountMixin, TestCase):
+    """Listing pages cost the same number of queries however many cards they show"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories = [
+            Category.objects.create(name='Books', slug='books'),
+            Category.objects.create(name='Shoes', slug='shoes'),
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def assertConstantQueries(self, url):
+        self.add_products(10, self.categories)
+        super().assertConstantQueries(url, lambda: self.add_products(90, self.categories))
+
+    def test_product_list(self):
+        self.assertConstantQueries(reverse('product_list'))
+
+    def test_category_list(self):
+        self.assertConstantQueries(reverse('product_list_by_category', args=['books']))
+
+    def test_search(self):
+        self.assertConstantQueries(reverse('product_search') + '?query=widget')
+
+    def test_next_page_fragment(self):
+        self.assertConstantQueries(reverse('product_page') + '?sort=price')
+
+
+class PaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        books = Category.objects.create(name='Books', slug='books')
+        # Shared prices, names and creation times, so every sort breaks ties by id
+        cls.products = [
+            Product.objects.create(category=books, name=f'Book {i % 2}', slug=f'book-{i}', price=10 + i % 3)
+            for i in range(7)
+        ]
+        Product.objects.update(created=timezone.now())
+
+    def walk(self, sort, size=2):
+        seen, after = [], None
+        while True:
+            page = pagination.keyset_page(Product.objects.all(), sort, after, size)
+            seen += [product.id for product in page.items]
+            if not page.has_next:
+                return seen
+            after = page.next_cursor
+
+    def test_pages_cover_every_product_once_in_order(self):
+        for sort, (field, descending) in pagination.SORTS.items():
+            with self.subTest(sort=sort):
+                ordering = (f'-{field}', '-id') if descending else (field, 'id')
+                expected = list(Product.objects.order_by(*ordering).values_list('id', flat=True))
+                self.assertEqual(self.walk(sort), expected)
+
+    def test_tampered_cursor_starts_over(self):
+        first = [product.id for product in pagination.keyset_page(Product.objects.all(), 'price', size=3).items]
+        for token in (
+            'not a cursor!', 'e30',  # {}
+            pagination.encode_cursor('10'),
+            pagination.encode_cursor('cheap', 1),
+            pagination.encode_cursor('NaN', 1),
+            pagination.encode_cursor('10', 'x'),
+            pagination.encode_cursor(None, 1),
+            pagination.encode_cursor('10', [1]),
+        ):
+            with self.subTest(token=token):
+                page = pagination.keyset_page(Product.objects.all(), 'price', token, size=3)
+                self.assertEqual([product.id for product in page.items], first)
+
+    def test_tampered_cursor_in_url_is_harmless(self):
+        cache.clear()
+        for sort in ('newest', 'price', 'name'):
+            response = self.client.get(
+                reverse('product_page'), {'sort': sort, 'after': pagination.encode_cursor('garbage', 'x')},
+                secure=True,
+            )
+            self.assertEqual(response.status_code, 200)
+
+    def test_ranked_pages_follow_relevance_order(self):
+        ids = [product.id for product in reversed(self.products)]
+        seen, after = [], None
+        while True:
+            page = pagination.ranked_page(ids, Product.objects.all(), after, size=3)
+            seen += [product.id for product in page.items]
+            if not page.has_next:
+                break
+            after = page.next_cursor
+        self.assertEqual(seen, ids)
+
+    def test_ranked_page_skips_filtered_out_ids(self):
+        ids = [product.id for product in self.products]
+        page = pagination.ranked_page(ids, Product.objects.exclude(id=ids[1]), size=3)
+        self.assertEqual([product.id for product in page.items], [ids[0], ids[2]])
+        self.assertEqual(pagination.decode_cursor(page.next_cursor), [3])
+
+    def test_ranked_page_invalid_cursor_starts_over(self):
+        ids = [product.id for product in self.products]
+        for token in ('not a cursor!', pagination.encode_cursor(-3), pagination.encode_cursor('2'),
+                      pagination.encode_cursor(True), pagination.encode_cursor(1.5)):
+            with self.subTest(token=token):
+                page = pagination.ranked_page(ids, Product.objects.all(), token, size=3)
+                self.assertEqual([product.id for product in page.items], ids[:3])
+
+    def test_ranked_page_past_the_end_is_empty(self):
+        ids = [product.id for product in self.products]
+        page = pagination.ranked_page(ids, Product.objects.all(), pagination.encode_cursor(50), size=3)
+        self.assertEqual((page.items, page.has_next), ([], False))
+
+
+class SearchBackendTestsMixin:
+    BACKEND = None
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes = Category.objects.create(name='Shoes', slug='shoes')
+        cls.outdoor = Category.objects.create(name='Outdoor', slug='outdoor')
+        cls.runners = Product.objects.create(category=cls.shoes, name='Running shoes', slug='runners', price=10,
+                                             description='Light trainers')
+        cls.sandals = Product.objects.create(category=cls.outdoor, name='Trail sandals', slug='sandals', price=10,
+                                             description='Good for running on trails')
+        cls.tent = Product.objects.create(category=cls.outdoor, name='Tent', slug='tent', price=10,
+                                          description='Sleeps two')
+
+    def setUp(self):
+        cache.clear()
+        search._backends.clear()
+        settings = override_settings(PRODUCTS_SEARCH_BACKEND=self.BACKEND)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(search._backends.clear)
+
+    def search(self, query, category=None):
+        return search.search_product_ids(query, category.id if category else None)
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(self.search('running'), [self.runners.id, self.sandals.id])
+
+    def test_words_match_as_prefixes_and_all_must_match(self):
+        self.assertEqual(self.search('runn sho'), [self.runners.id])
+        self.assertEqual(self.search('running tent'), [])
+        self.assertEqual(self.search('   '), [])
+
+    def test_category_filter(self):
+        self.assertEqual(self.search('running', self.outdoor), [self.sandals.id])
+
+    def test_product_changes_are_indexed(self):
+        self.search('warm up')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tent.description = 'Sleeps two after a long running day'
+            self.tent.save()
+            self.sandals.available = False
+            self.sandals.save()
+            self.runners.delete()
+        self.assertEqual(self.search('running'), [self.tent.id])
+        self.assertEqual(self.search('trail'), [])
+
+
+class FTS5SearchTests(SearchBackendTestsMixin, TestCase):
+    BACKEND = 'fts5'
+
+    def setUp(self):
+        if not search.fts5_table_exists():
+            self.skipTest('SQLite was built without FTS5')
+        super().setUp()
+
+
+class PythonSearchTests(SearchBackendTestsMixin, TestCase):
+    BACKEND = 'python'
+
+    def test_other_processes_replay_changes_instead_of_reloading(self):
+        this, other = search.PythonBackend(), search.PythonBackend()
+        this.search(['tent'])
+        other.search(['tent'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.tent.pk).update(name='Running tent')
+            self.tent.refresh_from_db()
+            other.update(self.tent)
+        with mock.patch.object(this, '_load', wraps=this._load) as load, self.assertNumQueries(1):
+            self.assertEqual(this.search(['running', 'tent']), [self.tent.id])
+        load.assert_not_called()
+
+        # Too far behind (or a change record gone): rebuilt from scratch
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(pk=self.sandals.pk).update(available=False)
+            self.sandals.refresh_from_db()
+            other.update(self.sandals)
+        cache.delete(other.CHANGE_KEY.format(other.version))
+        with mock.patch.object(this, '_load', wraps=this._load) as load:
+            self.assertEqual(this.search(['running']), [self.runners.id, self.tent.id])
+        load.assert_called_once()
+
+    def test_auto_looks_for_the_fts5_table_again(self):
+        search._auto.clear()
+        self.addCleanup(search._auto.clear)
+        with override_settings(PRODUCTS_SEARCH_BACKEND='auto'), \
+                mock.patch.object(search, 'fts5_table_exists', side_effect=[False, True]), \
+                mock.patch.object(search.time, 'monotonic', side_effect=[1000, 1001, 1000 + search.AUTO_RECHECK]):
+            self.assertEqual(search.get_backend().name, 'python')
+            self.assertEqual(search.get_backend().name, 'python')
+            self.assertEqual(search.get_backend().name, 'fts5')
+
+
+class SearchFacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = Category.objects.create(name='Books', slug='books')
+        cls.shoes = Category.objects.create(name='Shoes', slug='shoes')
+        for i in range(3):
+            Product.objects.create(category=cls.books, name=f'Leather journal {i}', slug=f'journal-{i}', price=200)
+        Product.objects.create(category=cls.shoes, name='Brogue', slug='brogue', price=3000,
+                               description='Polished leather upper')
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, **params):
+        return self.client.get(reverse('product_search'), {'query': 'leather', **params}, secure=True)
+
+    def counts(self, response):
+        sidebar = response.context['facets']
+        return ({c['name']: c['count'] for c in sidebar['categories']},
+                {p['label']: p['count'] for p in sidebar['prices']})
+
+    def test_facet_counts_cover_every_match(self):
+        response = self.search()
+        self.assertEqual(len(response.context['products']), 4)
+        self.assertEqual(self.counts(response), ({'Books': 3, 'Shoes': 1}, {'Under ₹500': 3, '₹2,500 – ₹5,000': 1}))
+
+        # Other categories keep their counts; prices are counted within the category
+        response = self.search(category='books')
+        self.assertEqual(len(response.context['products']), 3)
+        self.assertEqual(self.counts(response), ({'Books': 3, 'Shoes': 1}, {'Under ₹500': 3}))
+
+        response = self.search(price='3')
+        self.assertEqual([p.name for p in response.context['products']], ['Brogue'])
+        self.assertEqual(self.counts(response)[0], {'Shoes': 1})
+
+    def test_workers_stay_in_sync(self):
+        first, second = facets.FacetIndex(), facets.FacetIndex()
+        first.counts_for(), second.counts_for()
+        journal = Product.objects.get(slug='journal-0')
+        brogue = Product.objects.get(slug='brogue')
+        with self.captureOnCommitCallbacks(execute=True):
+            journal.price = 700
+            journal.save()
+        # Published while this process is current: applied in place
+        facets.index.counts_for()
+        with self.captureOnCommitCallbacks(execute=True):
+            first.update(journal)
+            second.update(brogue)
+        self.assertEqual(first.counts_for(), second.counts_for())
+        self.assertEqual(first.counts_for()[1], [2, 1, 0, 1, 0, 0])
+
+    def test_changes_are_published_on_commit(self):
+        facets.index.counts_for()
+        version = facets.index.current_version()
+        journal = Product.objects.get(slug='journal-0')
+        with self.captureOnCommitCallbacks() as callbacks:
+            journal.price = 700
+            journal.save()
+        self.assertEqual(facets.index.current_version(), version)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(facets.index.current_version(), version + 1)
+        self.assertEqual(facets.index.counts_for()[1], [2, 1, 0, 1, 0, 0])
+
+    def test_category_search_is_not_cut_from_the_overall_top_results(self):
+        with mock.patch.object(facets, 'MAX_MATCHES', 3):
+            # The brogue only mentions leather in its description, so it ranks last overall
+            response = self.search(category='shoes')
+        self.assertEqual([p.name for p in response.context['products']], ['Brogue'])
+
+
+class ProductCardCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Books', slug='books')
+        cls.products = [
+            Product.objects.create(category=category, name=f'Book {i}', slug=f'book-{i}', price=10)
+            for i in range(3)
+        ]
+        cls.user = User.objects.create_user('shopper', password='secret')
+        Wishlist.objects.create(user=cls.user, product=cls.products[0])
+
+    def setUp(self):
+        cache.clear()
+        card_stats.reset()
+
+    def get_list(self):
+        return self.client.get(reverse('product_list'), secure=True).content.decode()
+
+    def test_cards_are_reused_across_visitors(self):
+        anonymous = self.get_list()
+        self.assertNotIn('icon-button', anonymous)
+        self.assertEqual(card_stats.snapshot()['misses'], 3)
+
+        self.client.force_login(self.user)
+        signed_in = self.get_list()
+        self.assertEqual(card_stats.snapshot()['hits'], 3)
+        self.assertEqual(signed_in.count('aria-label="Remove from wishlist"'), 1)
+        self.assertEqual(signed_in.count('aria-label="Add to wishlist"'), 2)
+        self.assertIn(reverse('wishlist_remove', args=[self.products[0].id]), signed_in)
+
+    def test_saving_a_product_renders_a_new_card(self):
+        self.get_list()
+        product = self.products[1]
+        product.price = 25
+        product.save()
+        self.assertIn('₹25', self.get_list())
+        self.assertEqual(card_stats.snapshot()['misses'], 4)
+
+
+class ImageVariantsTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+
+    def upload(self, size=(1200, 900)):
+        buffer = io.BytesIO()
+        Image.new('RGBA', size, (200, 40, 40, 128)).save(buffer, 'PNG')
+        return SimpleUploadedFile('photo.png', buffer.getvalue(), content_type='image/png')
+
+    def test_upload_builds_variants_and_srcset(self):
+        category = Category.objects.create(name='Books', slug='books')
+        product = Product.objects.create(category=category, name='Book', slug='book', price=10, image=self.upload())
+        product.refresh_from_db()
+
+        variants = product.image_variants
+        self.assertEqual([width for width, _ in variants['webp']], [240, 480, 960])
+        for _, path in variants['webp'] + variants['jpeg']:
+            self.assertTrue(os.path.exists(os.path.join(self.media_root, path)))
+        with Image.open(os.path.join(self.media_root, variants['jpeg'][0][1])) as thumbnail:
+            self.assertEqual((thumbnail.format, thumbnail.size), ('JPEG', (240, 180)))
+
+        page = self.client.get(reverse('product_list'), secure=True).content.decode()
+        self.assertIn(product.webp_srcset, page)
+        self.assertIn(product.thumbnail_url, page)
+
+    def test_rebuild_skips_unchanged_images(self):
+        category = Category.objects.create(name='Books', slug='books')
+        Product.objects.create(category=category, name='Book', slug='book', price=10, image=self.upload())
+        self.assertEqual(images.build_variants(workers=1), (0, 1, 0))
+        self.assertEqual(images.build_variants(workers=1, force=True), (1, 0, 0))
+
+    def test_small_images_are_not_upscaled(self):
+        self.assertEqual(images.variant_widths(300), [240, 300])
+        self.assertEqual(images.variant_widths(100), [100])
+        self.assertEqual(images.variant_widths(2000), [240, 480, 960])
+
+
+class SuggestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.shoes = Category.objects.create(name='Running Shoes', slug='running-shoes')
+        cls.trail = Product.objects.create(category=cls.shoes, name='Trail Runner X', slug='trail-runner-x', price=10)
+        Product.objects.create(category=cls.shoes, name='Road Runner', slug='road-runner', price=10)
+        Product.objects.create(category=cls.shoes, name='Hidden Runner', slug='hidden-runner', price=10,
+                               available=False)
+
+    def setUp(self):
+        cache.clear()
+
+    def suggest(self, query):
+        return self.client.get(reverse('product_suggest'), {'q': query}, secure=True).json()
+
+    def test_word_prefixes_match_without_queries(self):
+        self.suggest('warm up')
+        with self.assertNumQueries(0):
+            data = self.suggest('runn')
+        self.assertEqual([p['name'] for p in data['products']], ['Road Runner', 'Trail Runner X'])
+        self.assertEqual(data['categories'], [{'name': 'Running Shoes', 'url': self.shoes.get_absolute_url()}])
+        self.assertEqual(self.suggest('trail run')['products'][0]['url'], self.trail.get_absolute_url())
+        self.assertEqual([p['name'] for p in self.suggest('x')['products']], ['Trail Runner X'])
+
+    def names(self, query):
+        return [p['name'] for p in self.suggest(query)['products']]
+
+    def test_changes_are_applied_incrementally(self):
+        self.suggest('warm up')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.trail.name = 'Mountain Boot'
+            self.trail.save()
+            # Not before the change commits
+            self.assertEqual(self.names('moun'), [])
+        self.assertEqual(self.names('trail'), [])
+        self.assertEqual(self.names('moun'), ['Mountain Boot'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shoes.delete()
+        self.assertEqual(self.suggest('run'), {'products': [], 'categories': []})
+
+    def test_unchanged_names_leave_other_processes_alone(self):
+        self.suggest('warm up')
+        version = cache.get(suggest.SuggestIndex.VERSION_KEY)
+        # A process that never served a suggestion, saving a price change
+        other = suggest.SuggestIndex()
+        self.trail.price = 12
+        other.update_product(self.trail)
+        self.assertEqual(cache.get(suggest.SuggestIndex.VERSION_KEY), version)
+
+        self.trail.name = 'Mountain Boot'
+        other.update_product(self.trail)
+        self.assertNotEqual(cache.get(suggest.SuggestIndex.VERSION_KEY), version)
+        self.assertEqual(self.names('moun'), ['Mountain Boot'])
+
+    def test_snapshot_is_shared_between_processes(self):
+        self.suggest('warm up')
+        other = suggest.SuggestIndex()
+        with self.assertNumQueries(0):
+            self.assertEqual(len(other.suggest('road')[0]), 1)
+
+
+class CatalogNavTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = Category.objects.create(name='Books', slug='books')
+        Category.objects.create(name='Shoes', slug='shoes')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_nav_renders_without_queries(self):
+        self.client.get(reverse('login'), secure=True)
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('login'), secure=True)
+        self.assertContains(response, f'href="{self.books.get_absolute_url()}"', count=2)
+        self.assertContains(response, 'Shoes')
+
+    def test_category_changes_refresh_the_nav(self):
+        self.client.get(reverse('login'), secure=True)
+        self.books.name = 'Novels'
+        self.books.slug = 'novels'
+        self.books.save()
+        # One query reloads the snapshot, then it is reused again
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('login'), secure=True)
+        self.assertContains(response, 'Novels')
+        self.assertContains(response, f'href="{self.books.get_absolute_url()}"', count=2)
+        self.assertNotContains(response, 'Books')
+        with self.assertNumQueries(0):
+            self.client.get(reverse('login'), secure=True)
+
+        Category.objects.create(name='Toys', slug='toys')
+        self.assertContains(self.client.get(reverse('login'), secure=True), 'Toys')
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = Category.objects.create(name='Books', slug='books')
+        cls.shoes = Category.objects.create(name='Shoes', slug='shoes')
+        cls.book = Product.objects.create(category=cls.books, name='Book', slug='book', price=10)
+        cls.shoe = Product.objects.create(category=cls.shoes, name='Shoe', slug='shoe', price=10)
+        cls.user = User.objects.create_user('shopper', password='secret')
+
+    def setUp(self):
+        cache.clear()
+
+    def revalidate(self, url):
+        self.client.get(url, secure=True)  # A returning visitor already has the CSRF cookie
+        first = self.client.get(url, secure=True)
+        self.assertEqual(first.status_code, 200)
+        return lambda: self.client.get(url, secure=True, HTTP_IF_NONE_MATCH=first['ETag'])
+
+    def test_unchanged_listing_is_not_rendered(self):
+        again = self.revalidate(self.books.get_absolute_url())
+        response = again()
+        self.assertEqual(response.status_code, 304)
+        self.assertTemplateNotUsed(response, 'products/product_list.html')
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+
+    def test_product_changes_invalidate_listings(self):
+        again = self.revalidate(self.books.get_absolute_url())
+        self.book.name = 'Another book'
+        self.book.save()
+        self.assertEqual(again().status_code, 200)
+
+        # A price change in another category leaves this one's page alone,
+        # unless the sidebar's facet counts change with it
+        again = self.revalidate(self.books.get_absolute_url())
+        self.shoe.price = 12
+        self.shoe.save()
+        self.assertEqual(again().status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shoe.price = 700
+            self.shoe.save()
+        self.assertEqual(again().status_code, 200)
+
+    def test_product_page(self):
+        again = self.revalidate(self.book.get_absolute_url())
+        self.assertEqual(again().status_code, 304)
+        self.book.price = 15
+        self.book.save()
+        self.assertEqual(again().status_code, 200)
+
+    def test_visitor_state_is_part_of_the_etag(self):
+        self.client.force_login(self.user)
+        again = self.revalidate(reverse('product_list'))
+        Wishlist.objects.create(user=self.user, product=self.book)
+        self.assertEqual(again().status_code, 200)
+
+        again = self.revalidate(reverse('product_list'))
+        self.client.post(reverse('cart_add', args=[self.book.id]), {'quantity': 1}, secure=True)
+        self.assertEqual(again().status_code, 200)
+
+        again = self.revalidate(reverse('product_list'))
+        self.client.logout()
+        self.assertEqual(again().status_code, 200)
+
+
+    def test_stamps_expire_so_changes_from_other_workers_show(self):
+        again = self.revalidate(self.books.get_absolute_url())
+        # Changed by another worker: no signal reaches this worker's stamps
+        Product.objects.filter(pk=self.book.pk).update(name='Changed elsewhere', updated=timezone.now())
+        self.assertEqual(again().status_code, 304)
+        # ... until they time out
+        cache.delete_many([conditional._stamp_key(None), conditional._stamp_key(self.books.id)])
+        self.assertContains(again(), 'Changed elsewhere')
+
+    def test_deletions_change_the_stamp(self):
+        Product.objects.create(category=self.books, name='Newer book', slug='newer-book', price=10)
+        modified, count = conditional.catalog_stamp(self.books.id)
+        self.book.delete()
+        self.assertEqual(conditional.catalog_stamp(self.books.id), (modified, count - 1))
+
+    def test_deploy_check_wants_a_shared_cache(self):
+        self.assertEqual([warning.id for warning in checks.shared_cache_check(None)], ['products.W001'])
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://'}}
+        with override_settings(CACHES=redis):
+            self.assertEqual(checks.shared_cache_check(None), [])
+
+
+class GuestPageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = Category.objects.create(name='Books', slug='books')
+        cls.book = Product.objects.create(category=cls.books, name='Book', slug='book', price=10)
+
+    def setUp(self):
+        cache.clear()
+        page_cache.stats.reset()
+
+    def test_browsing_creates_no_session(self):
+        for url in (reverse('product_list'), self.books.get_absolute_url(), self.book.get_absolute_url()):
+            response = self.client.get(url, secure=True)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertFalse(Session.objects.exists())
+
+    def test_guests_share_a_page_with_their_own_csrf_token(self):
+        self.client.get(self.book.get_absolute_url(), secure=True)
+        guest = Client(enforce_csrf_checks=True)
+        response = guest.get(self.book.get_absolute_url(), secure=True)
+        self.assertTemplateNotUsed(response, 'products/product_detail.html')
+        self.assertEqual(page_cache.stats.hits, 1)
+        self.assertContains(response, 'Book')
+        self.assertNotContains(response, page_cache.CSRF_MARKER)
+
+        token = response.content.decode().split('name="csrfmiddlewaretoken" value="')[1].split('"')[0]
+        response = guest.post(reverse('cart_add', args=[self.book.id]),
+                              {'quantity': 1, 'csrfmiddlewaretoken': token}, secure=True,
+                              HTTP_REFERER='https://testserver/')
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+        # With a session (and a cart) the page is rendered for them again
+        response = guest.get(self.book.get_absolute_url(), secure=True)
+        self.assertTemplateUsed(response, 'products/product_detail.html')
+
+    def test_product_changes_invalidate_shared_pages(self):
+        self.client.get(self.books.get_absolute_url(), secure=True)
+        self.book.name = 'Another book'
+        self.book.save()
+        response = self.client.get(self.books.get_absolute_url(), secure=True)
+        self.assertTemplateUsed(response, 'products/product_list.html')
+        self.assertContains(response, 'Another book')
+
+
+class GuestViewTrackingTests(TransactionTestCase):
+    # The similar products engine runs on its own thread and connection
+    def setUp(self):
+        cache.clear()
+        self.books = Category.objects.create(name='Books', slug='books')
+        self.book = Product.objects.create(category=self.books, name='Book', slug='book', price=10)
+
+    def test_similar_block_starts_the_session_and_tracks_the_view(self):
+        self.client.get(self.book.get_absolute_url(), secure=True)
+        self.assertFalse(ProductView.objects.exists())
+        response = self.client.get(reverse('similar_products', args=[self.book.id]), secure=True)
+        self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        view = ProductView.objects.get()
+        self.assertEqual(view.session_key, response.cookies[settings.SESSION_COOKIE_NAME].value)
+
+        # Views from then on are tracked by the product page, once each
+        self.client.get(self.book.get_absolute_url(), secure=True)
+        self.client.get(reverse('similar_products', args=[self.book.id]), secure=True)
+        view.refresh_from_db()
+        self.assertEqual(view.view_count, 2)
+
+
+class StockTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = Category.objects.create(name='Books', slug='books')
+
+    def product(self, slug, units):
+        return Product.objects.create(category=self.books, name=slug.title(), slug=slug, price=10, stock=units)
+
+    def test_reserve_takes_all_lines_or_none(self):
+        book, pen = self.product('book', 5), self.product('pen', 1)
+        stock.reserve([(book, 2), (pen, 1)])
+        self.assertEqual((stock.on_hand(book), stock.on_hand(pen)), (3, 0))
+
+        with self.assertRaises(stock.OutOfStock) as raised:
+            stock.reserve([(book, 2), (pen, 1)])
+        self.assertEqual(raised.exception.products, [pen])
+        self.assertEqual(stock.on_hand(book), 3)
+
+    def test_untracked_stock_is_never_short(self):
+        book = self.product('book', None)
+        stock.reserve([(book, 100)])
+        self.assertIsNone(stock.on_hand(book))
+
+    def test_sharded_stock(self):
+        book = self.product('book', 10)
+        stock.split(book, 4)
+        book.refresh_from_db()
+        shards = StockShard.objects.filter(product=book).order_by('shard')
+        self.assertEqual(list(shards.values_list('quantity', flat=True)), [3, 3, 2, 2])
+
+        # More than any one shard holds is taken across shards
+        stock.reserve([(book, 7)])
+        self.assertEqual(stock.on_hand(book), 3)
+        with self.assertRaises(stock.OutOfStock):
+            stock.reserve([(book, 4)])
+        stock.reserve([(book, 3)])
+        self.assertEqual(stock.on_hand(book), 0)
+
+        # A restock on the product row counts, and merging keeps every unit
+        Product.objects.filter(id=book.id).update(stock=5)
+        stock.split(book, 0)
+        book.refresh_from_db()
+        self.assertEqual((book.stock, book.stock_shards), (5, 0))
+        self.assertFalse(StockShard.objects.filter(product=book).exists())
+
+    def test_saving_a_stale_copy_keeps_units_sold_meanwhile(self):
+        book = self.product('book', 5)
+        stale = Product.objects.get(id=book.id)
+        stock.reserve([(book, 3)])
+        stale.price = 20
+        stale.save()
+        self.assertEqual(stock.on_hand(book), 2)
+        self.assertEqual(Product.objects.get(id=book.id).price, 20)
+
+    def test_selling_out_and_restocking(self):
+        book = self.product('book', 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            stock.reserve([(book, 2)])
+        book.refresh_from_db()
+        self.assertFalse(book.available)
+
+        book = stock.restock(book, 4)
+        self.assertEqual(stock.on_hand(book), 4)
+        self.assertTrue(book.available)
+
+    def test_cart_add_refuses_more_than_is_on_hand(self):
+        book = self.product('book', 2)
+        url = reverse('cart_add', args=[book.id])
+        self.client.post(url, {'quantity': 2}, secure=True)
+        response = self.client.post(url, {'quantity': 1}, secure=True, follow=True)
+        self.assertContains(response, 'not enough units of Book left')
+        self.assertEqual(self.client.session[settings.CART_SESSION_ID][str(book.id)]['quantity'], 2)
@@ -4,6 +4,8 @@ from . import views
 urlpatterns = [
     path('', views.product_list, name='product_list'),
     path('search/', views.product_search, name='product_search'),  # Must be before category slug
+    path('more/', views.product_page, name='product_page'),  # Must be before category slug
+    path('suggest/', views.product_suggest, name='product_suggest'),  # Must be before category slug
     path('<slug:category_slug>/', views.product_list, name='product_list_by_category'),
     path('<slug:category_slug>/<slug:product_slug>/', views.product_detail, name='product_detail'),
 ]
\ No newline at end of file
@@ -1,68 +1,199 @@
+from django.http import Http404, JsonResponse
 from django.shortcuts import render, get_object_or_404
-from .models import Category, Product
+from .models import Product
 from cart.forms import CartAddProductForm
-from django.db.models import Q  # For search
+from django.urls import reverse
 from wishlist.models import Wishlist
-from recommendations.utils import track_product_view, get_recommendations, get_homepage_recommendations
+from recommendations.utils import track_product_view
+from . import conditional, facets, suggest
+from .catalog import get_catalog
+from .facets import PRICE_BUCKETS, bucket_label, bucket_range
+from .pagination import DEFAULT_SORT, RELEVANCE, SORT_CHOICES, SORTS, keyset_page, ranked_page
+from .search import search_product_ids
 
-def product_list(request, category_slug=None):
-    category = None
-    categories = Category.objects.all()
-    products = Product.objects.filter(available=True)
-    if category_slug:
-        category = get_object_or_404(Category, slug=category_slug)
+def _category_or_404(slug):
+    category = get_catalog().by_slug.get(slug)
+    if category is None:
+        raise Http404('No Category matches the given query.')
+    return category
+
+def _price_bucket(request):
+    try:
+        bucket = int(request.GET.get('price', ''))
+    except ValueError:
+        return None
+    return bucket if 0 <= bucket < len(PRICE_BUCKETS) else None
+
+def _catalog_page(request, category=None, query=None):
+    """The requested page, the sort used, the total (if asked) and the unfiltered search matches"""
+    sort = request.GET.get('sort')
+    after = request.GET.get('after')
+    bucket = _price_bucket(request)
+    products = Product.objects.filter(available=True).for_listing()
+    if category:
         products = products.filter(category=category)
-    wishlist_product_ids = []
-    if request.user.is_authenticated:
-        wishlist_product_ids = list(Wishlist.objects.filter(user=request.user).values_list('product_id', flat=True))
-    
-    # Get personalized recommendations
-    recommendations = get_homepage_recommendations(request, limit=8)
-    
+    if bucket is not None:
+        low, high = bucket_range(bucket)
+        products = products.filter(price__gte=low)
+        if high is not None:
+            products = products.filter(price__lt=high)
+
+    matches = None
+    if query:
+        # Ranked full-text matches (see search.py). The sidebar counts every
+        # match, so they are fetched unfiltered; a selected category is
+        # searched on its own, as its matches may rank below everything
+        # returned for the whole catalog
+        matches = search_product_ids(query, limit=facets.MAX_MATCHES)
+        ids = search_product_ids(query, category.id) if category else matches
+        ids = facets.index.filter_ids(ids, None, bucket)
+        if sort not in SORTS:
+            total = len(ids) if request.GET.get('count') else None
+            return ranked_page(ids, products, after), RELEVANCE, total, matches
+        products = products.filter(id__in=ids)
+
+    if sort not in SORTS:
+        sort = DEFAULT_SORT
+    total = products.count() if request.GET.get('count') else None
+    return keyset_page(products, sort, after), sort, total, matches
+
+def _facet_sidebar(request, categories, category=None, query=None, matches=None):
+    """Category and price facet links with counts from the in-memory facet index"""
+    bucket = _price_bucket(request)
+    category_counts, bucket_counts = facets.index.counts_for(
+        category.id if category else None, bucket, matches
+    )
+    params = request.GET.copy()
+    params.pop('after', None)
+
+    def url(base, **changes):
+        query_params = params.copy()
+        for key, value in changes.items():
+            if value is None:
+                query_params.pop(key, None)
+            else:
+                query_params[key] = value
+        return f'{base}?{query_params.urlencode()}' if query_params else base
+
+    if query:
+        category_url = lambda c: url(request.path, category=c.slug if c else None)
+    else:
+        category_url = lambda c: url(c.get_absolute_url() if c else reverse('product_list'))
+
+    return {
+        'all_categories_url': category_url(None),
+        'category_total': sum(category_counts.values()),
+        'categories': [
+            {'name': c.name, 'url': category_url(c), 'count': category_counts[c.id],
+             'active': category is not None and c.id == category.id}
+            for c in categories
+            if category_counts[c.id] or (category is not None and c.id == category.id)
+        ],
+        'any_price_url': url(request.path, price=None),
+        'price_total': sum(bucket_counts),
+        'prices': [
+            {'label': bucket_label(b), 'url': url(request.path, price=str(b)), 'count': count,
+             'active': b == bucket}
+            for b, count in enumerate(bucket_counts)
+            if count or b == bucket
+        ],
+        'price_selected': bucket is not None,
+    }
+
+def _next_urls(request, page, category=None):
+    """Full-page and fragment URLs for the page after ``page``"""
+    if not page.has_next:
+        return None, None
+    params = request.GET.copy()
+    params['after'] = page.next_cursor
+    next_page_url = f'{request.path}?{params.urlencode()}'
+    params.pop('count', None)
+    if category:
+        params['category'] = category.slug
+    return next_page_url, f"{reverse('product_page')}?{params.urlencode()}"
+
+def _wishlist_product_ids(request):
+    if not request.user.is_authenticated:
+        return []
+    return list(Wishlist.objects.filter(user=request.user).values_list('product_id', flat=True))
+
+def _render_catalog(request, category=None, query=None):
+    page, sort, total, matches = _catalog_page(request, category, query)
+    next_page_url, next_fragment_url = _next_urls(request, page, category)
+    sort_choices = SORT_CHOICES if not query else [(RELEVANCE, 'Relevance')] + SORT_CHOICES
     return render(request, 'products/product_list.html', {
         'category': category,
-        'categories': categories,
-        'products': products,
-        'wishlist_product_ids': wishlist_product_ids,
-        'recommendations': recommendations,
+        'facets': _facet_sidebar(request, get_catalog().categories, category, query, matches),
+        'products': page.items,
+        'search_query': query,
+        'sort': sort,
+        'sort_choices': sort_choices,
+        'total': total,
+        'next_page_url': next_page_url,
+        'next_fragment_url': next_fragment_url,
+        'wishlist_product_ids': _wishlist_product_ids(request),
     })
 
+def product_list(request, category_slug=None):
+    category = None
+    if category_slug:
+        category = _category_or_404(category_slug)
+    return conditional.respond(request, conditional.catalog_validators(request, category),
+                               lambda: _render_catalog(request, category))
+
+def product_page(request):
+    """Cards for the next page of a listing or search (infinite scroll)"""
+    category = None
+    if request.GET.get('category'):
+        category = _category_or_404(request.GET['category'])
+
+    def render_page():
+        page, _, _, _ = _catalog_page(request, category, request.GET.get('query'))
+        next_page_url, next_fragment_url = _next_urls(request, page)
+        response = render(request, 'products/_product_cards.html', {
+            'products': page.items,
+            'wishlist_product_ids': _wishlist_product_ids(request),
+        })
+        if next_fragment_url:
+            response['X-Next-Fragment'] = next_fragment_url
+        return response
+
+    return conditional.respond(request, conditional.catalog_validators(request, category), render_page)
+
 def product_detail(request, category_slug, product_slug):
     product = get_object_or_404(Product, slug=product_slug, available=True)
-    cart_product_form = CartAddProductForm()
-    is_in_wishlist = False
-    if request.user.is_authenticated:
-        is_in_wishlist = Wishlist.objects.filter(user=request.user, product=product).exists()
-    
-    # Track this product view for recommendations
+
+    # Track this product view for recommendations (revalidated visits count
+    # too); a guest's first view is tracked by the similar products block
     track_product_view(request, product)
-    
-    # Get "You may also like" recommendations
-    similar_products = get_recommendations(request, product=product, limit=6)
-    
-    return render(request, 'products/product_detail.html', {
-        'product': product,
-        'cart_product_form': cart_product_form,
-        'is_in_wishlist': is_in_wishlist,
-        'similar_products': similar_products,
-    })
+
+    def render_page():
+        is_in_wishlist = False
+        if request.user.is_authenticated:
+            is_in_wishlist = Wishlist.objects.filter(user=request.user, product=product).exists()
+        # "You may also like" is loaded afterwards from recommendations.views
+        return render(request, 'products/product_detail.html', {
+            'product': product,
+            'cart_product_form': CartAddProductForm(),
+            'is_in_wishlist': is_in_wishlist,
+        })
+
+    return conditional.respond(request, conditional.product_validators(request, product), render_page)
 
 def product_search(request):
-    query = request.GET.get('query')
-    categories = Category.objects.all()
-    if query:
-        products = Product.objects.filter(
-            Q(name__icontains=query) | Q(description__icontains=query), available=True
-        )
-    else:
-        products = Product.objects.filter(available=True)
-    wishlist_product_ids = []
-    if request.user.is_authenticated:
-        wishlist_product_ids = list(Wishlist.objects.filter(user=request.user).values_list('product_id', flat=True))
-    return render(request, 'products/product_list.html', {
-        'category': None,
-        'categories': categories,
-        'products': products,
-        'search_query': query,
-        'wishlist_product_ids': wishlist_product_ids,
-    })
\ No newline at end of file
+    category = None
+    if request.GET.get('category'):
+        category = _category_or_404(request.GET['category'])
+    # Results come from every category (narrowed in memory), so any product change counts
+    return conditional.respond(request, conditional.catalog_validators(request),
+                               lambda: _render_catalog(request, category, request.GET.get('query')))
+
+def product_suggest(request):
+    """Typeahead suggestions for the search box, answered from memory (see suggest.py)"""
+    products, categories = suggest.index.suggest(request.GET.get('q', ''))
+    response = JsonResponse({
+        'products': [{'name': name, 'url': url} for name, url in products],
+        'categories': [{'name': name, 'url': url} for name, url in categories],
+    })
+    response['Cache-Control'] = 'public, max-age=60'
+    return response
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import ProductView
+from .models import ProductView, ProductSimilarity, ProductPopularity, ProductViewDaily
 
 
 @admin.register(ProductView)
@@ -8,3 +8,29 @@ class ProductViewAdmin(admin.ModelAdmin):
     list_filter = ['viewed_at']
     search_fields = ['product__name', 'user__username']
     ordering = ['-viewed_at']
+    list_select_related = ['product', 'user']
+    raw_id_fields = ['product', 'user']
+
+
+@admin.register(ProductSimilarity)
+class ProductSimilarityAdmin(admin.ModelAdmin):
+    list_display = ['product', 'similar_product', 'score', 'computed_at']
+    search_fields = ['product__name', 'similar_product__name']
+    raw_id_fields = ['product', 'similar_product']
+
+
+@admin.register(ProductPopularity)
+class ProductPopularityAdmin(admin.ModelAdmin):
+    list_display = ['product', 'category', 'score', 'updated']
+    list_filter = ['category']
+    raw_id_fields = ['product']
+
+
+@admin.register(ProductViewDaily)
+class ProductViewDailyAdmin(admin.ModelAdmin):
+    list_display = ['product', 'day', 'views', 'unique_visitors']
+    list_filter = ['day']
+    list_select_related = ['product']
+    search_fields = ['product__name']
+    date_hierarchy = 'day'
+    raw_id_fields = ['product']
@@ -0,0 +1,305 @@
+"""
+Approximate nearest-neighbour index over dense product embeddings.
+
+Embeddings are random projections of the TF-IDF rows from
+``content_index``: every term gets a fixed pseudo-random Gaussian vector
+derived from its hash, so new products embed consistently without
+storing a projection matrix, and the dot product of two embeddings
+estimates the cosine of their TF-IDF rows. Terms found in only one
+product cannot contribute to any cosine and would only add noise, so
+they are left out. Vectors are float32 rows, each stored
+next to its product id in a fixed-size record of ``vectors.dat``, which
+every worker maps read-only.
+
+Lookup is random-hyperplane LSH: ``tables`` independent hash tables of
+``bits``-bit signatures, stored as sorted code arrays searched with
+``searchsorted``. A query probes its own bucket (plus the buckets one
+bit-flip away when ``probes`` > 0) in each table and reranks the
+candidates by their exact embedding dot product. Tuning:
+
+- more ``tables`` or ``probes``: higher recall, slower queries
+- more ``bits``: smaller buckets, faster queries, lower recall
+- larger ``dim``: better fidelity to TF-IDF cosine, more memory
+
+``insert`` appends one record with a single ``write`` to the file opened
+in append mode, so inserts from several workers never interleave. Rows
+past the last build are scanned exhaustively until ``build_ann_index``
+runs again. A product inserted twice is served from its newest row.
+Deleting a product appends an all-zero row for it, which queries skip
+(a product that embeds to zero could never score anyway).
+"""
+import json
+import os
+import shutil
+import threading
+import zlib
+
+import numpy as np
+from django.conf import settings
+
+from . import content_index
+
+DEFAULT_DIM = 64
+DEFAULT_TABLES = 8
+DEFAULT_BITS = 12
+BUILD_CHUNK = 10000
+
+
+def index_dir():
+    return os.path.join(settings.RECOMMENDATIONS_INDEX_DIR, 'ann')
+
+
+def term_vector(term, dim):
+    """Fixed Gaussian projection vector for a term, scaled to preserve dot products"""
+    rng = np.random.default_rng(zlib.crc32(term.encode()))
+    return (rng.standard_normal(dim) / np.sqrt(dim)).astype(np.float32)
+
+
+def shared_terms(index):
+    """Vocabulary terms that occur in more than one indexed product"""
+    df = np.diff(index.term_indptr)
+    return {term for term, count in zip(index.vocabulary, df) if count > 1}
+
+
+def embed(weights, dim, terms):
+    """Project a {term: weight} TF-IDF row onto ``dim`` dimensions"""
+    vector = np.zeros(dim, dtype=np.float32)
+    for term, weight in weights.items():
+        if term in terms:
+            vector += weight * term_vector(term, dim)
+    return vector
+
+
+def _record_dtype(dim):
+    return np.dtype([('id', '<i8'), ('vector', '<f4', (dim,))])
+
+
+def _hyperplanes(seed, tables, bits, dim):
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((tables, bits, dim)).astype(np.float32)
+
+
+def _signatures(vectors, planes):
+    """(tables, n) integer codes for each vector"""
+    powers = 1 << np.arange(planes.shape[1], dtype=np.int64)
+    bits = np.einsum('tbd,nd->tnb', planes, vectors) > 0
+    return (bits * powers).sum(axis=2)
+
+
+def _write_json(path, payload):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump(payload, fh)
+    os.replace(tmp, path)
+
+
+def _content_embeddings(index, dim):
+    """Embed every row of the content index, chunk by chunk"""
+    terms = shared_terms(index)
+    projection = np.zeros((len(index.vocabulary), dim), dtype=np.float32)
+    for col, term in enumerate(index.vocabulary):
+        if term in terms:
+            projection[col] = term_vector(term, dim)
+    vectors = np.zeros((index.n_docs, dim), dtype=np.float32)
+    for start in range(0, index.n_docs, BUILD_CHUNK):
+        end = min(start + BUILD_CHUNK, index.n_docs)
+        bounds = np.asarray(index.indptr[start:end + 1])
+        lo, hi = bounds[0], bounds[-1]
+        if hi == lo:
+            continue
+        contributions = projection[index.indices[lo:hi]] * index.data[lo:hi, None]
+        filled = np.flatnonzero(np.diff(bounds))
+        vectors[start + filled] = np.add.reduceat(contributions, bounds[filled] - lo, axis=0)
+
+    ids = np.array(index.doc_ids, dtype=np.int64)
+    for product_id, weights in index.delta.items():
+        position = index._position(product_id)
+        vector = embed(weights or {}, dim, terms)
+        if position is not None:
+            vectors[position] = vector
+        else:
+            ids = np.append(ids, product_id)
+            vectors = np.vstack([vectors, vector])
+    return ids, vectors
+
+
+def build_ann_index(dim=DEFAULT_DIM, tables=DEFAULT_TABLES, bits=DEFAULT_BITS, seed=0):
+    """Embed the content index and build the LSH tables; returns row count"""
+    index = content_index.ContentIndex.get()
+    if index is None:
+        raise RuntimeError('Build the content index first (manage.py build_content_index)')
+
+    ids, vectors = _content_embeddings(index, dim)
+    planes = _hyperplanes(seed, tables, bits, dim)
+    codes = _signatures(vectors, planes) if len(ids) else np.zeros((tables, 0), dtype=np.int64)
+
+    target = index_dir()
+    staging = f'{target}.new'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    records = np.zeros(len(ids), dtype=_record_dtype(dim))
+    records['id'], records['vector'] = ids, vectors
+    records.tofile(os.path.join(staging, 'vectors.dat'))
+    for table in range(tables):
+        order = np.argsort(codes[table], kind='stable')
+        np.save(os.path.join(staging, f'codes_{table}.npy'), codes[table][order])
+        np.save(os.path.join(staging, f'rows_{table}.npy'), order.astype(np.int64))
+    _write_json(os.path.join(staging, 'meta.json'), {
+        'dim': dim, 'tables': tables, 'bits': bits, 'seed': seed,
+        'indexed': len(ids),
+    })
+
+    retired = f'{target}.old'
+    shutil.rmtree(retired, ignore_errors=True)
+    if os.path.isdir(target):
+        os.rename(target, retired)
+    os.rename(staging, target)
+    shutil.rmtree(retired, ignore_errors=True)
+    AnnIndex.reset()
+    return len(ids)
+
+
+class AnnIndex:
+    """Memory-mapped vectors plus LSH tables for one built index"""
+
+    _lock = threading.Lock()
+    _instance = None
+
+    def __init__(self, path, meta, size):
+        self.path = path
+        self.meta = meta
+        self.size = size
+        self.dim = meta['dim']
+        self.indexed = meta['indexed']
+        self.dtype = _record_dtype(self.dim)
+        self.count = size // self.dtype.itemsize
+        self.planes = _hyperplanes(meta['seed'], meta['tables'], meta['bits'], self.dim)
+        self.codes = [np.load(os.path.join(path, f'codes_{t}.npy'), mmap_mode='r') for t in range(meta['tables'])]
+        self.rows = [np.load(os.path.join(path, f'rows_{t}.npy'), mmap_mode='r') for t in range(meta['tables'])]
+        if self.count:
+            records = np.memmap(os.path.join(path, 'vectors.dat'), dtype=self.dtype,
+                                mode='r', shape=(self.count,))
+        else:
+            records = np.zeros(0, dtype=self.dtype)
+        self.vectors, self.ids = records['vector'], records['id']
+
+        # Newest row per product wins; older rows are skipped
+        reversed_ids = self.ids[::-1]
+        unique_ids, last = np.unique(reversed_ids, return_index=True)
+        self.current = np.zeros(self.count, dtype=bool)
+        self.current[self.count - 1 - last] = True
+        self.row_of = dict(zip(unique_ids.tolist(), (self.count - 1 - last).tolist()))
+
+    @classmethod
+    def get(cls):
+        """Shared per-process instance, reloaded after a build or an insert"""
+        path = index_dir()
+        try:
+            with open(os.path.join(path, 'meta.json')) as fh:
+                meta = json.load(fh)
+            size = os.stat(os.path.join(path, 'vectors.dat')).st_size
+        except FileNotFoundError:
+            return None
+        with cls._lock:
+            instance = cls._instance
+            if instance is None or instance.meta != meta or instance.size != size:
+                cls._instance = cls(path, meta, size)
+            return cls._instance
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._instance = None
+
+    def _probe_codes(self, code, probes):
+        if probes is None:
+            probes = settings.RECOMMENDATIONS_ANN_PROBES
+        codes = [code]
+        if probes:
+            codes.extend(code ^ (1 << bit) for bit in range(self.planes.shape[1]))
+        return codes
+
+    def candidates(self, vector, probes=None):
+        """Row indices sharing an LSH bucket with ``vector``, plus unindexed rows"""
+        signatures = _signatures(vector[None, :], self.planes)[:, 0]
+        found = [np.arange(self.indexed, self.count)]
+        for table, code in enumerate(signatures):
+            for probe in self._probe_codes(int(code), probes):
+                lo = np.searchsorted(self.codes[table], probe, side='left')
+                hi = np.searchsorted(self.codes[table], probe, side='right')
+                if hi > lo:
+                    found.append(np.asarray(self.rows[table][lo:hi]))
+        return np.unique(np.concatenate(found))
+
+    def query(self, vector, k=10, probes=None, exclude=()):
+        """Approximate top-K (product_id, score) pairs for a vector"""
+        rows = self.candidates(vector, probes)
+        rows = rows[self.current[rows]]
+        # Deleted products' newest rows are all zero
+        rows = rows[np.any(self.vectors[rows] != 0, axis=1)]
+        if exclude:
+            rows = rows[~np.isin(self.ids[rows], list(exclude))]
+        if not len(rows):
+            return []
+        scores = self.vectors[rows] @ vector
+        if len(rows) > k:
+            best = np.argpartition(-scores, k - 1)[:k]
+            rows, scores = rows[best], scores[best]
+        order = np.argsort(-scores, kind='stable')
+        return [(int(self.ids[rows[i]]), float(scores[i])) for i in order]
+
+    def terms(self, content):
+        """Shared terms of the content index, cached per content index build"""
+        if getattr(self, '_terms_identity', None) != content.identity:
+            self._terms, self._terms_identity = shared_terms(content), content.identity
+        return self._terms
+
+    def vector_for(self, product_id):
+        row = self.row_of.get(product_id)
+        return None if row is None else np.asarray(self.vectors[row])
+
+    def similar(self, product_ids, k=10, probes=None):
+        """Batched approximate neighbours: {product_id: [(id, score), ...]}"""
+        results = {}
+        for product_id in product_ids:
+            vector = self.vector_for(product_id)
+            if vector is not None and vector.any():
+                results[product_id] = self.query(vector, k, probes, exclude={product_id})
+        return results
+
+    def insert(self, product_id, vector):
+        """Append a vector; it is searched exhaustively until the next build"""
+        record = np.zeros(1, dtype=self.dtype)
+        record['id'], record['vector'] = product_id, vector
+        with open(os.path.join(self.path, 'vectors.dat'), 'ab') as fh:
+            fh.write(record.tobytes())
+
+    def remove(self, product_id):
+        """Append an all-zero row so ``product_id`` is no longer found"""
+        if product_id in self.row_of:
+            self.insert(product_id, np.zeros(self.dim, dtype=np.float32))
+
+
+def insert_product(product):
+    index = AnnIndex.get()
+    if index is None:
+        return
+    content = content_index.ContentIndex.get()
+    weights = content.vector(product.id) if content is not None else None
+    if weights is None:
+        return
+    index.insert(product.id, embed(weights, index.dim, index.terms(content)))
+
+
+def remove_product(product_id):
+    index = AnnIndex.get()
+    if index is not None:
+        index.remove(product_id)
+
+
+def similar_product_ids(product_ids, k=10):
+    """Approximate content neighbours per product id; empty when no index exists"""
+    index = AnnIndex.get()
+    if index is None:
+        return {}
+    return {pid: [other for other, _ in hits] for pid, hits in index.similar(product_ids, k).items()}
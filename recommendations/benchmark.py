@@ -0,0 +1,249 @@
+"""
+Latency/query benchmarks and offline evaluation for the engine.
+
+``run_benchmark`` times each engine entry point over a sample of users,
+guest sessions and products and reports p50/p99 latency, SQL queries per
+call and peak Python memory, plus the mean time and queries of every
+pipeline stage. ``evaluate`` hides every sampled user's
+most recent view, asks the engine for recommendations and scores how
+often (hit rate) and how high (NDCG) the hidden product comes back.
+The hidden rows are deleted inside a transaction that is rolled back.
+``evaluate_ann`` reports the ANN index's recall@k against an exhaustive
+scan of the same embeddings and against the exact TF-IDF neighbours.
+The precomputed similarity and content indexes are not rebuilt for the
+split, so "similar" scores are optimistic if they were built from the
+full history.
+"""
+import math
+import random
+import time
+import tracemalloc
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+import numpy as np
+
+from products.models import Product
+from . import ann, content_index, pipeline, profiles
+from .engine import RecommendationEngine
+from .models import ProductView
+
+
+def make_request(user=None, session_key=None):
+    """A bare GET request carrying the given visitor identity"""
+    request = RequestFactory().get('/')
+    request.user = user or AnonymousUser()
+    request.session = SessionStore(session_key=session_key)
+    return request
+
+
+def _percentile(values, percentile):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(percentile / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def measure(calls):
+    """Run each zero-argument callable once; return latency and query stats"""
+    timings, queries = [], []
+    for call in calls:
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            call()
+            timings.append(1000 * (time.perf_counter() - started))
+        queries.append(len(captured))
+
+    tracemalloc.start()
+    for call in calls[:20]:
+        call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'calls': len(calls),
+        'p50_ms': _percentile(timings, 50),
+        'p99_ms': _percentile(timings, 99),
+        'mean_ms': sum(timings) / len(timings),
+        'queries_mean': sum(queries) / len(queries),
+        'queries_max': max(queries),
+        'peak_kib': peak / 1024,
+    }
+
+
+class StageStats:
+    """Aggregates ``pipeline_finished`` traces per pipeline stage"""
+
+    def __init__(self):
+        self.totals = {}
+
+    def __call__(self, sender, name, trace, **kwargs):
+        for entry in trace:
+            totals = self.totals.setdefault(f"{name}.{entry['stage']}", [0, 0, 0.0, 0])
+            totals[0] += 1
+            if entry['status'] != 'skipped':
+                totals[1] += 1
+                totals[2] += entry['ms']
+                totals[3] += entry['queries']
+
+    def summary(self):
+        return {
+            stage: {
+                'runs': runs,
+                'ran': ran,
+                'mean_ms': ms / ran if ran else 0.0,
+                'queries_mean': queries / ran if ran else 0.0,
+            }
+            for stage, (runs, ran, ms, queries) in self.totals.items()
+        }
+
+
+def _sample_visitors(sample_size, rng):
+    user_ids = list(ProductView.objects.filter(user__isnull=False).order_by('user_id')
+                    .values_list('user_id', flat=True).distinct()[:sample_size * 10])
+    users = list(get_user_model().objects.filter(id__in=rng.sample(user_ids, min(sample_size, len(user_ids)))))
+    session_keys = list(ProductView.objects.filter(user__isnull=True).order_by('session_key')
+                        .values_list('session_key', flat=True).distinct()[:sample_size * 10])
+    sessions = rng.sample(session_keys, min(sample_size, len(session_keys)))
+    return users, sessions
+
+
+def run_benchmark(iterations=200, sample_size=50, seed=0):
+    """Benchmark every engine entry point; returns {name: stats}"""
+    rng = random.Random(seed)
+    users, sessions = _sample_visitors(sample_size, rng)
+    product_ids = list(Product.objects.filter(available=True).values_list('id', flat=True)[:sample_size * 20])
+    products = list(Product.objects.filter(id__in=rng.sample(product_ids, min(sample_size, len(product_ids)))))
+    engines = (
+        [RecommendationEngine(make_request(user=user)) for user in users] +
+        [RecommendationEngine(make_request(session_key=key)) for key in sessions]
+    ) or [RecommendationEngine(make_request())]
+
+    def picks(factory):
+        return [factory(rng.choice(engines), rng.choice(products) if products else None)
+                for _ in range(iterations)]
+
+    def cold_preferences(engine, product):
+        def call():
+            profiles.invalidate(user_id=engine.user.id if engine.user else None,
+                                session_key=engine.session_key)
+            engine.get_user_preferences()
+        return call
+
+    entry_points = {
+        'get_user_preferences (cold)': cold_preferences,
+        'get_user_preferences (warm)': lambda e, p: e.get_user_preferences,
+        'get_personalized_recommendations': lambda e, p: lambda: e.get_personalized_recommendations(limit=8),
+        'get_popular_products': lambda e, p: lambda: e.get_popular_products(limit=8),
+    }
+    if products:
+        entry_points.update({
+            'get_similar_products': lambda e, p: lambda: e.get_similar_products(p, limit=6),
+            'get_recommendations_for_product': lambda e, p: lambda: e.get_recommendations_for_product(p, limit=6),
+        })
+
+    stages = StageStats()
+    pipeline.pipeline_finished.connect(stages)
+    try:
+        results = {name: measure(picks(factory)) for name, factory in entry_points.items()}
+    finally:
+        pipeline.pipeline_finished.disconnect(stages)
+    return results, stages.summary()
+
+
+def _ndcg(rank):
+    return 1 / math.log2(rank + 2) if rank is not None else 0.0
+
+
+def evaluate(k=10, sample_size=200, seed=0):
+    """Leave-last-view-out hit rate@k and NDCG@k over sampled users"""
+    rng = random.Random(seed)
+    user_ids = list(ProductView.objects.filter(user__isnull=False).order_by('user_id')
+                    .values_list('user_id', flat=True).distinct())
+    user_ids = rng.sample(user_ids, min(sample_size, len(user_ids)))
+    users = get_user_model().objects.in_bulk(user_ids)
+
+    totals = {'personalized': [0, 0.0], 'similar': [0, 0.0]}
+    evaluated = 0
+    with transaction.atomic():
+        for user_id in user_ids:
+            history = list(ProductView.objects.filter(user_id=user_id)
+                           .select_related('product__category').order_by('-viewed_at')[:2])
+            if len(history) < 2:
+                continue
+            held_out, anchor = history
+            held_out.delete()
+            evaluated += 1
+
+            engine = RecommendationEngine(make_request(user=users[user_id]))
+            ranked = {
+                'personalized': engine.get_personalized_recommendations(limit=k),
+                'similar': engine.get_recommendations_for_product(anchor.product, limit=k),
+            }
+            for name, products in ranked.items():
+                ids = [p.id for p in products]
+                rank = ids.index(held_out.product_id) if held_out.product_id in ids else None
+                totals[name][0] += rank is not None
+                totals[name][1] += _ndcg(rank)
+        transaction.set_rollback(True)
+
+    for user_id in user_ids:
+        profiles.invalidate(user_id=user_id)
+
+    return {
+        'users': evaluated,
+        'k': k,
+        **{
+            name: {
+                'hit_rate': hits / evaluated if evaluated else 0.0,
+                'ndcg': gain / evaluated if evaluated else 0.0,
+            }
+            for name, (hits, gain) in totals.items()
+        },
+    }
+
+
+def evaluate_ann(k=10, sample_size=200, seed=0):
+    """Recall@k and latency of the ANN index; None when it is not built"""
+    index, exact_index = ann.AnnIndex.get(), content_index.ContentIndex.get()
+    if index is None or not index.count:
+        return None
+    rng = random.Random(seed)
+    vectors = np.asarray(index.vectors)
+    # Deleted products and text made only of unique terms embed to zero
+    # and have no neighbours to recall
+    searchable = index.ids[index.current & np.any(vectors != 0, axis=1)].tolist()
+    if not searchable:
+        return None
+    product_ids = rng.sample(searchable, min(sample_size, len(searchable)))
+
+    def recall(found, expected):
+        return len(set(found) & set(expected)) / len(expected) if expected else 1.0
+
+    timings, scan_recall, exact_recall = [], [], []
+    for product_id in product_ids:
+        started = time.perf_counter()
+        found = [pid for pid, _ in index.similar([product_id], k)[product_id]]
+        timings.append(1000 * (time.perf_counter() - started))
+
+        scores = vectors @ index.vector_for(product_id)
+        scores[~index.current] = -np.inf
+        scores[index.row_of[product_id]] = -np.inf
+        top = np.argsort(-scores)[:k]
+        scan_recall.append(recall(found, [int(index.ids[row]) for row in top]))
+        if exact_index is not None:
+            exact = exact_index.similar([product_id], k).get(product_id, [])
+            exact_recall.append(recall(found, [pid for pid, _ in exact]))
+
+    return {
+        'products': len(product_ids),
+        'k': k,
+        'p50_ms': _percentile(timings, 50),
+        'p99_ms': _percentile(timings, 99),
+        'recall_vs_scan': sum(scan_recall) / len(scan_recall),
+        'recall_vs_tfidf': sum(exact_recall) / len(exact_recall) if exact_recall else None,
+    }
@@ -0,0 +1,89 @@
+"""
+Retention for ProductView.
+
+``ProductView`` is the hot tier: one row per visitor and product, which
+the engine needs for preferences and co-view baskets. Guest rows whose
+last view is older than the retention window, or whose session has
+expired, are rolled up into ``ProductViewDaily`` (product, day, views,
+unique visitors) and deleted. Registered users' rows are kept: they are
+bounded by users times products, and profiles, similarity and the
+personalized pipeline read a user's whole history from them. Work is
+done in small id batches, each in its own short transaction, so SQLite
+never holds the write lock for long. Aggregate consumers such as
+``popularity.rebuild_popularity`` read both tiers.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import transaction
+from django.db.models import Case, Count, F, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import ProductView, ProductViewDaily
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def _roll_up(view_ids):
+    """Add the given ProductView rows to the daily tier and delete them"""
+    with transaction.atomic():
+        views = ProductView.objects.filter(id__in=view_ids).order_by()
+        totals = list(
+            views.annotate(day=TruncDate('viewed_at'))
+            .values('product_id', 'day')
+            .annotate(views=Sum('view_count'), visitors=Count('id'))
+        )
+
+        ProductViewDaily.objects.bulk_create(
+            [ProductViewDaily(product_id=t['product_id'], day=t['day']) for t in totals],
+            ignore_conflicts=True,
+        )
+        ids = {
+            (product_id, day): daily_id
+            for daily_id, product_id, day in ProductViewDaily.objects.filter(
+                product_id__in={t['product_id'] for t in totals},
+                day__in={t['day'] for t in totals},
+            ).values_list('id', 'product_id', 'day')
+        }
+        added_views, added_visitors = [], []
+        for t in totals:
+            daily_id = ids[(t['product_id'], t['day'])]
+            added_views.append(When(id=daily_id, then=Value(t['views'])))
+            added_visitors.append(When(id=daily_id, then=Value(t['visitors'])))
+        ProductViewDaily.objects.filter(id__in=ids.values()).update(
+            views=F('views') + Case(*added_views, default=Value(0)),
+            unique_visitors=F('unique_visitors') + Case(*added_visitors, default=Value(0)),
+        )
+
+        views.delete()
+    return len(view_ids)
+
+
+def _drain(queryset, batch_size):
+    moved = 0
+    while True:
+        batch = list(queryset.order_by('id').values_list('id', flat=True)[:batch_size])
+        if not batch:
+            return moved
+        moved += _roll_up(batch)
+
+
+def compact_views(days=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Roll up guest views last seen more than ``days`` ago; returns rows moved"""
+    if days is None:
+        days = settings.RECOMMENDATIONS_VIEW_RETENTION_DAYS
+    cutoff = timezone.now() - timedelta(days=days)
+    return _drain(ProductView.objects.filter(user__isnull=True, viewed_at__lt=cutoff), batch_size)
+
+
+def purge_expired_guest_views(batch_size=DEFAULT_BATCH_SIZE):
+    """Roll up guest rows whose session no longer exists or has expired"""
+    if settings.SESSION_ENGINE != 'django.contrib.sessions.backends.db':
+        return 0
+    live = Session.objects.filter(expire_date__gt=timezone.now()).values('session_key')
+    return _drain(
+        ProductView.objects.filter(user__isnull=True).exclude(session_key__in=live),
+        batch_size,
+    )
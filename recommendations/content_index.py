@@ -0,0 +1,366 @@
+"""
+TF-IDF content index over product names and descriptions.
+
+The index is a set of ``.npy`` arrays in ``settings.RECOMMENDATIONS_INDEX_DIR``
+that every worker opens with ``mmap_mode='r'``, so the matrix is shared
+through the page cache instead of being copied into each process:
+
+- ``doc_ids``: product ids in row order (sorted)
+- ``indptr``/``indices``/``data``: L2-normalised TF-IDF rows (CSR)
+- ``term_indptr``/``postings``/``weights``: the same matrix by term (CSC),
+  used to score a query against every product in one ``bincount``
+- ``idf`` and ``vocabulary.json``
+
+Saving a product writes its new row to a small JSON delta file instead of
+rebuilding the matrix; delta rows shadow the matching main rows until the
+next ``build_content_index`` folds them in. Terms first seen in a delta
+row are weighted as if they occurred in a single document. Delta rows are
+scored in Python, so ``manage.py build_content_index --if-needed`` (run
+from cron) rebuilds once the delta holds ``MAX_DELTA_ROWS`` products;
+saves themselves only ever append.
+
+Delta writes and rebuilds take an exclusive ``flock`` on ``content.lock``
+beside the index directory, so workers never overwrite each other's delta
+rows or write into an index that is being swapped out. (Without ``fcntl``,
+i.e. on Windows, only threads of one process are serialised.)
+"""
+import json
+import math
+import os
+import re
+import shutil
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+STOP_WORDS = frozenset(
+    'a an and are as at be by for from has in is it its of on or that the '
+    'this to was were will with you your'.split()
+)
+NAME_WEIGHT = 2
+QUERY_BATCH_SIZE = 32
+MAX_DELTA_ROWS = 200
+
+ARRAYS = ('doc_ids', 'indptr', 'indices', 'data', 'term_indptr', 'postings', 'weights', 'idf')
+
+
+def index_dir():
+    return os.path.join(settings.RECOMMENDATIONS_INDEX_DIR, 'content')
+
+
+_thread_lock = threading.Lock()
+
+
+@contextmanager
+def _index_lock():
+    """Exclusive lock on the index for delta writes and rebuilds"""
+    with _thread_lock:
+        os.makedirs(settings.RECOMMENDATIONS_INDEX_DIR, exist_ok=True)
+        with open(f'{index_dir()}.lock', 'a') as fh:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            # Closing the file releases the flock
+            yield
+
+
+def tokenize(text):
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOP_WORDS and len(t) > 1]
+
+
+def product_terms(name, description):
+    """Term frequencies for a product, with the name counted extra"""
+    counts = Counter(tokenize(description or ''))
+    for term in tokenize(name or ''):
+        counts[term] += NAME_WEIGHT
+    return counts
+
+
+def _weigh(counts, idf_for):
+    """Sublinear TF * IDF, L2-normalised, as a {term: weight} dict"""
+    row = {term: (1 + math.log(tf)) * idf_for(term) for term, tf in counts.items()}
+    norm = math.sqrt(sum(w * w for w in row.values()))
+    return {term: w / norm for term, w in row.items()} if norm else {}
+
+
+def _write_json(path, payload):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump(payload, fh)
+    os.replace(tmp, path)
+
+
+def build_content_index(products=None):
+    """
+    Build the index from ``(id, name, description)`` rows and swap it in.
+    Returns the number of indexed products.
+    """
+    with _index_lock():
+        return _build(products)
+
+
+def fold_delta():
+    """
+    Rebuild the index if its delta has reached ``MAX_DELTA_ROWS``.
+    Returns the number of indexed products, or None when nothing was done.
+    """
+    with _index_lock():
+        index = ContentIndex.get()
+        if index is not None and len(index.delta) >= MAX_DELTA_ROWS:
+            return _build()
+    return None
+
+
+def _build(products=None):
+    if products is None:
+        from products.models import Product
+        products = Product.objects.order_by('id').values_list('id', 'name', 'description').iterator()
+
+    doc_ids, doc_counts, df = [], [], Counter()
+    for product_id, name, description in products:
+        counts = product_terms(name, description)
+        doc_ids.append(product_id)
+        doc_counts.append(counts)
+        df.update(counts.keys())
+
+    n_docs = len(doc_ids)
+    vocabulary = sorted(df)
+    term_index = {term: i for i, term in enumerate(vocabulary)}
+    idf = np.array(
+        [math.log((1 + n_docs) / (1 + df[term])) + 1 for term in vocabulary],
+        dtype=np.float32,
+    )
+
+    indptr = np.zeros(n_docs + 1, dtype=np.int64)
+    indices, data = [], []
+    for i, counts in enumerate(doc_counts):
+        row = _weigh(counts, lambda term: idf[term_index[term]])
+        cols = sorted(term_index[term] for term in row)
+        indices.extend(cols)
+        data.extend(row[vocabulary[c]] for c in cols)
+        indptr[i + 1] = len(indices)
+
+    indices = np.array(indices, dtype=np.int32)
+    data = np.array(data, dtype=np.float32)
+    rows = np.repeat(np.arange(n_docs, dtype=np.int32), np.diff(indptr))
+    by_term = np.argsort(indices, kind='stable')
+    term_indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(indices, minlength=len(vocabulary)), out=term_indptr[1:])
+
+    arrays = {
+        'doc_ids': np.array(doc_ids, dtype=np.int64),
+        'indptr': indptr,
+        'indices': indices,
+        'data': data,
+        'term_indptr': term_indptr,
+        'postings': rows[by_term],
+        'weights': data[by_term],
+        'idf': idf,
+    }
+
+    target = index_dir()
+    staging = f'{target}.new'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    for name, array in arrays.items():
+        np.save(os.path.join(staging, f'{name}.npy'), array)
+    _write_json(os.path.join(staging, 'vocabulary.json'), vocabulary)
+    _write_json(os.path.join(staging, 'delta.json'), {})
+
+    retired = f'{target}.old'
+    shutil.rmtree(retired, ignore_errors=True)
+    if os.path.isdir(target):
+        os.rename(target, retired)
+    os.rename(staging, target)
+    shutil.rmtree(retired, ignore_errors=True)
+    ContentIndex.reset()
+    return n_docs
+
+
+class ContentIndex:
+    """Read-only view over the memory-mapped index plus its delta rows"""
+
+    _lock = threading.Lock()
+    _instance = None
+
+    def __init__(self, path):
+        self.path = path
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r'))
+        with open(os.path.join(path, 'vocabulary.json')) as fh:
+            self.vocabulary = json.load(fh)
+        self.term_index = {term: i for i, term in enumerate(self.vocabulary)}
+        self.n_docs = len(self.doc_ids)
+        self.identity = os.stat(os.path.join(path, 'doc_ids.npy')).st_ino
+        self._delta_mtime = None
+        self.delta, self.shadowed = {}, []
+        self._load_delta()
+
+    @classmethod
+    def get(cls):
+        """Shared per-process instance, or None when no index was built"""
+        path = index_dir()
+        try:
+            identity = os.stat(os.path.join(path, 'doc_ids.npy')).st_ino
+        except FileNotFoundError:
+            return None
+        with cls._lock:
+            if cls._instance is None or cls._instance.identity != identity:
+                cls._instance = cls(path)
+            cls._instance._load_delta()
+            return cls._instance
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._instance = None
+
+    # Delta rows
+
+    def _delta_path(self):
+        return os.path.join(self.path, 'delta.json')
+
+    def _load_delta(self):
+        try:
+            mtime = os.stat(self._delta_path()).st_mtime_ns
+        except FileNotFoundError:
+            self.delta, self.shadowed, self._delta_mtime = {}, [], None
+            return
+        if mtime != self._delta_mtime:
+            with open(self._delta_path()) as fh:
+                self.delta = {int(pid): row for pid, row in json.load(fh).items()}
+            # Main rows replaced by a delta row (or removed) never match
+            self.shadowed = [p for p in map(self._position, self.delta) if p is not None]
+            self._delta_mtime = mtime
+
+    def _idf(self, term):
+        index = self.term_index.get(term)
+        if index is None:
+            return math.log((1 + self.n_docs) / 2) + 1
+        return float(self.idf[index])
+
+    def save_delta(self, product_id, row):
+        """
+        Store ``row`` (None for a removed product) in the delta file and
+        return how many rows it holds. Callers hold ``_index_lock``.
+        """
+        self._load_delta()
+        delta = dict(self.delta)
+        delta[product_id] = row
+        _write_json(self._delta_path(), {str(pid): r for pid, r in delta.items()})
+        self._load_delta()
+        return len(self.delta)
+
+    # Queries
+
+    def _position(self, product_id):
+        position = int(np.searchsorted(self.doc_ids, product_id))
+        if position < self.n_docs and self.doc_ids[position] == product_id:
+            return position
+        return None
+
+    def vector(self, product_id):
+        """A product's row as a {term: weight} dict, or None if unknown"""
+        if product_id in self.delta:
+            return self.delta[product_id]
+        position = self._position(product_id)
+        if position is None:
+            return None
+        start, end = self.indptr[position], self.indptr[position + 1]
+        return {
+            self.vocabulary[col]: float(weight)
+            for col, weight in zip(self.indices[start:end], self.data[start:end])
+        }
+
+    def _score_main(self, vectors):
+        """Cosine scores of each query vector against every main row"""
+        query_ids, postings, weights = [], [], []
+        for q, vector in enumerate(vectors):
+            for term, weight in vector.items():
+                col = self.term_index.get(term)
+                if col is None:
+                    continue
+                start, end = self.term_indptr[col], self.term_indptr[col + 1]
+                postings.append(self.postings[start:end])
+                weights.append(self.weights[start:end] * weight)
+                query_ids.append(np.full(end - start, q, dtype=np.int64))
+
+        if not postings:
+            return np.zeros((len(vectors), self.n_docs), dtype=np.float64)
+        flat = np.concatenate(query_ids) * self.n_docs + np.concatenate(postings)
+        scores = np.bincount(
+            flat,
+            weights=np.concatenate(weights),
+            minlength=len(vectors) * self.n_docs,
+        )
+        return scores.reshape(len(vectors), self.n_docs)
+
+    def similar(self, product_ids, k=10):
+        """
+        Batched top-K cosine neighbours.
+        Returns {product_id: [(neighbour_id, score), ...]} for known products.
+        """
+        queries = [(pid, self.vector(pid)) for pid in product_ids]
+        queries = [(pid, vector) for pid, vector in queries if vector]
+        shadowed = self.shadowed
+        results = {}
+
+        for batch_start in range(0, len(queries), QUERY_BATCH_SIZE):
+            batch = queries[batch_start:batch_start + QUERY_BATCH_SIZE]
+            scores = self._score_main([vector for _, vector in batch])
+            if shadowed:
+                scores[:, shadowed] = 0
+
+            for row, (product_id, vector) in enumerate(batch):
+                own = self._position(product_id)
+                if own is not None:
+                    scores[row, own] = 0
+                top = np.flatnonzero(scores[row])
+                if len(top) > k:
+                    top = top[np.argpartition(-scores[row, top], k - 1)[:k]]
+                hits = [(int(self.doc_ids[i]), float(scores[row, i])) for i in top]
+
+                for other_id, other in self.delta.items():
+                    if other and other_id != product_id:
+                        score = sum(w * other.get(term, 0.0) for term, w in vector.items())
+                        if score > 0:
+                            hits.append((other_id, score))
+
+                hits.sort(key=lambda hit: (-hit[1], hit[0]))
+                results[product_id] = hits[:k]
+
+        return results
+
+
+def _save_delta(product_id, row_for):
+    with _index_lock():
+        index = ContentIndex.get()
+        if index is None:
+            return
+        index.save_delta(product_id, row_for(index))
+
+
+def update_product(product):
+    """Recompute one product's row and store it in the delta file"""
+    counts = product_terms(product.name, product.description)
+    _save_delta(product.id, lambda index: _weigh(counts, index._idf))
+
+
+def remove_product(product_id):
+    _save_delta(product_id, lambda index: None)
+
+
+def similar_product_ids(product_ids, k=10):
+    """Top-K content neighbours per product id; empty when no index exists"""
+    index = ContentIndex.get()
+    if index is None:
+        return {}
+    return {pid: [other for other, _ in hits] for pid, hits in index.similar(product_ids, k).items()}
@@ -2,9 +2,9 @@
 AI/ML Recommendation Engine
 Uses content-based filtering with TF-IDF and cosine similarity
 """
-from collections import Counter
-from django.db.models import Count, Q
-from products.models import Product, Category
+from products.models import Product
+from . import ann, content_index, pipeline, profiles
+from .models import ProductPopularity
 
 
 class RecommendationEngine:
@@ -21,189 +21,93 @@ class RecommendationEngine:
         self.session_key = request.session.session_key
 
     def get_user_preferences(self):
-        """Gather user interaction data"""
-        from .models import ProductView
-        from wishlist.models import Wishlist
-        from orders.models import OrderItem
-
-        preferences = {
-            'viewed_products': [],
-            'wishlist_products': [],
-            'purchased_products': [],
-            'favorite_categories': [],
-        }
-
-        # Get viewed products
-        if self.user:
-            views = ProductView.objects.filter(user=self.user)
-        elif self.session_key:
-            views = ProductView.objects.filter(session_key=self.session_key)
-        else:
-            views = ProductView.objects.none()
-
-        preferences['viewed_products'] = list(
-            views.order_by('-viewed_at', '-view_count')
-            .values_list('product_id', flat=True)[:20]
+        """Gather user interaction data (cached, see profiles.py)"""
+        return profiles.get_profile(
+            user_id=self.user.id if self.user else None,
+            session_key=self.session_key
         )
 
-        if self.user:
-            # Wishlist items
-            preferences['wishlist_products'] = list(
-                Wishlist.objects.filter(user=self.user)
-                .values_list('product_id', flat=True)
-            )
-
-            # Purchased products
-            preferences['purchased_products'] = list(
-                OrderItem.objects.filter(order__user=self.user)
-                .values_list('product_id', flat=True)
-            )
-
-        # Calculate favorite categories
-        all_product_ids = (
-            preferences['viewed_products'] +
-            preferences['wishlist_products'] +
-            preferences['purchased_products']
-        )
-
-        if all_product_ids:
-            category_counts = Counter(
-                Product.objects.filter(id__in=all_product_ids)
-                .values_list('category_id', flat=True)
-            )
-            preferences['favorite_categories'] = [
-                cat_id for cat_id, _ in category_counts.most_common(5)
-            ]
-
-        return preferences
-
     def get_similar_products(self, product, limit=6):
-        """Get products similar to a given product"""
-        similar = Product.objects.filter(
-            available=True,
-            category=product.category
-        ).exclude(id=product.id)
-
-        # Prioritize by category match
-        return list(similar[:limit])
-
-    def get_personalized_recommendations(self, limit=8, exclude_ids=None):
-        """Get personalized recommendations based on user preferences"""
-        exclude_ids = exclude_ids or []
-        preferences = self.get_user_preferences()
-
-        recommended_ids = []
-        scores = {}
-
-        # Score based on favorite categories
-        if preferences['favorite_categories']:
-            category_products = Product.objects.filter(
-                available=True,
-                category_id__in=preferences['favorite_categories']
-            ).exclude(id__in=exclude_ids)
-
-            for product in category_products[:30]:
-                if product.id not in recommended_ids:
-                    scores[product.id] = scores.get(product.id, 0) + 10
-                    recommended_ids.append(product.id)
-
-        # Boost products similar to wishlist items
-        if preferences['wishlist_products']:
-            wishlist_categories = Product.objects.filter(
-                id__in=preferences['wishlist_products']
-            ).values_list('category_id', flat=True)
-
-            related_products = Product.objects.filter(
-                available=True,
-                category_id__in=wishlist_categories
-            ).exclude(
-                id__in=exclude_ids + preferences['wishlist_products']
-            )
-
-            for product in related_products[:20]:
-                if product.id not in recommended_ids:
-                    recommended_ids.append(product.id)
-                scores[product.id] = scores.get(product.id, 0) + 15
+        """Get products similar to a given product (see pipeline.py)"""
+        return pipeline.run('similar', self, limit, product=product)
 
-        # Boost products similar to purchases
-        if preferences['purchased_products']:
-            purchased_categories = Product.objects.filter(
-                id__in=preferences['purchased_products']
-            ).values_list('category_id', flat=True)
-
-            related_products = Product.objects.filter(
+    def get_neighbour_products(self, product, limit=6):
+        """Precomputed co-view/co-purchase neighbours (see similarity.py)"""
+        return list(
+            Product.objects.filter(
                 available=True,
-                category_id__in=purchased_categories
-            ).exclude(
-                id__in=exclude_ids + preferences['purchased_products']
-            )
-
-            for product in related_products[:20]:
-                if product.id not in recommended_ids:
-                    recommended_ids.append(product.id)
-                scores[product.id] = scores.get(product.id, 0) + 20
+                similar_to__product=product
+            ).for_listing().order_by('-similar_to__score')[:limit]
+        )
 
-        # Sort by score and get top recommendations
-        sorted_ids = sorted(
-            recommended_ids,
-            key=lambda x: scores.get(x, 0),
-            reverse=True
-        )[:limit]
+    def get_content_similar_products(self, product, limit=6, exclude_ids=None):
+        """Get products whose name/description is closest by cosine similarity"""
+        exclude_ids = set(exclude_ids or [product.id])
+        # Approximate neighbours when the ANN index is built, exact TF-IDF otherwise
+        k = limit + len(exclude_ids)
+        neighbours = ann.similar_product_ids([product.id], k=k).get(product.id)
+        if neighbours is None:
+            neighbours = content_index.similar_product_ids([product.id], k=k).get(product.id, [])
+        ranked_ids = [pid for pid in neighbours if pid not in exclude_ids]
+        if not ranked_ids:
+            return []
+
+        rank = {pid: i for i, pid in enumerate(ranked_ids)}
+        products = list(Product.objects.filter(id__in=ranked_ids, available=True).for_listing())
+        products.sort(key=lambda p: rank[p.id])
+        return products[:limit]
 
-        if sorted_ids:
-            # Preserve order
-            products = list(Product.objects.filter(id__in=sorted_ids, available=True))
-            products.sort(key=lambda p: sorted_ids.index(p.id))
-            return products
-
-        # Fallback to popular products
-        return self.get_popular_products(limit, exclude_ids)
+    def get_personalized_recommendations(self, limit=8, exclude_ids=None):
+        """Get personalized recommendations based on user preferences (see pipeline.py)"""
+        return pipeline.run('personalized', self, limit, exclude_ids=exclude_ids)
 
     def get_popular_products(self, limit=8, exclude_ids=None):
         """Get popular/trending products as fallback"""
-        from .models import ProductView
-
         exclude_ids = exclude_ids or []
 
-        # Most viewed products
-        popular_ids = (
-            ProductView.objects.values('product_id')
-            .annotate(total_views=Count('id'))
-            .order_by('-total_views')
-            .exclude(product_id__in=exclude_ids)[:limit]
+        # Highest time-decayed view scores (see popularity.py)
+        products = list(
+            Product.objects.filter(available=True, popularity__isnull=False)
+            .exclude(id__in=exclude_ids)
+            .for_listing()
+            .order_by('-popularity__score')[:limit]
         )
-
-        product_ids = [item['product_id'] for item in popular_ids]
-
-        if product_ids:
-            products = list(Product.objects.filter(
-                id__in=product_ids,
-                available=True
-            ))
+        if products:
             return products
 
         # Ultimate fallback: newest products
         return list(
             Product.objects.filter(available=True)
             .exclude(id__in=exclude_ids)
+            .for_listing()
             .order_by('-created')[:limit]
         )
 
-    def get_recommendations_for_product(self, product, limit=6):
-        """Get 'You may also like' recommendations for a product page"""
-        recommendations = []
-
-        # First: Same category products
-        same_category = self.get_similar_products(product, limit=limit)
-        recommendations.extend(same_category)
+    def get_trending_in_category(self, category_id, limit=8, exclude_ids=None):
+        """Get a category's products, trending ones first"""
+        exclude_ids = exclude_ids or []
 
-        if len(recommendations) < limit:
-            # Add from user preferences
-            exclude_ids = [product.id] + [p.id for p in recommendations]
-            more = self.get_personalized_recommendations(
-                limit=limit - len(recommendations),
-                exclude_ids=exclude_ids
+        # Ranked on the leaderboard's (category, -score) index, then loaded
+        trending_ids = list(
+            ProductPopularity.objects.filter(category_id=category_id, product__available=True)
+            .exclude(product_id__in=exclude_ids)
+            .order_by('-score')
+            .values_list('product_id', flat=True)[:limit]
+        )
+        products = []
+        if trending_ids:
+            rank = {pid: i for i, pid in enumerate(trending_ids)}
+            products = sorted(Product.objects.filter(id__in=trending_ids).for_listing(), key=lambda p: rank[p.id])
+        if len(products) < limit:
+            # Then the ones nobody has viewed yet
+            products += list(
+                Product.objects.filter(available=True, category_id=category_id, popularity__isnull=True)
+                .exclude(id__in=exclude_ids)
+                .for_listing()
+                .order_by('name')[:limit - len(products)]
             )
-            recommendations.extend(more)
+        return products
 
-        return recommendations[:limit]
+    def get_recommendations_for_product(self, product, limit=6):
+        """Get 'You may also like' recommendations for a product page"""
+        return pipeline.run('product', self, limit, product=product)
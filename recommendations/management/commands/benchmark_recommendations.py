@@ -0,0 +1,66 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from recommendations.benchmark import evaluate, evaluate_ann, run_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Report latency, query counts and memory per engine entry point, plus offline hit rate/NDCG'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200, help='Calls per entry point')
+        parser.add_argument('--sample', type=int, default=50, help='Visitors and products to sample')
+        parser.add_argument('--k', type=int, default=10, help='Cut-off for hit rate and NDCG')
+        parser.add_argument('--eval-users', type=int, default=200, help='Users in the offline evaluation')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--skip-eval', action='store_true')
+        parser.add_argument('--json', metavar='PATH', help='Also write the results to a JSON file')
+
+    def handle(self, *args, **options):
+        latency, stages = run_benchmark(
+            iterations=options['iterations'], sample_size=options['sample'], seed=options['seed']
+        )
+        results = {'latency': latency, 'stages': stages}
+
+        self.stdout.write(
+            f"{'entry point':<36}{'p50 ms':>9}{'p99 ms':>9}{'queries':>9}{'max q':>7}{'peak KiB':>10}"
+        )
+        for name, stats in results['latency'].items():
+            self.stdout.write(
+                f"{name:<36}{stats['p50_ms']:>9.2f}{stats['p99_ms']:>9.2f}"
+                f"{stats['queries_mean']:>9.1f}{stats['queries_max']:>7}{stats['peak_kib']:>10.1f}"
+            )
+
+        self.stdout.write(f"\n{'pipeline stage':<42}{'ran':>12}{'mean ms':>9}{'queries':>9}")
+        for name, stats in results['stages'].items():
+            self.stdout.write(
+                f"{name:<42}{stats['ran']:>6}/{stats['runs']:<5}{stats['mean_ms']:>9.2f}{stats['queries_mean']:>9.1f}"
+            )
+
+        if not options['skip_eval']:
+            results['evaluation'] = evaluate(
+                k=options['k'], sample_size=options['eval_users'], seed=options['seed']
+            )
+            evaluation = results['evaluation']
+            self.stdout.write(f"\nOffline evaluation over {evaluation['users']} users (k={evaluation['k']})")
+            for name in ('personalized', 'similar'):
+                self.stdout.write(
+                    f"{name:<14} hit rate {evaluation[name]['hit_rate']:.3f}"
+                    f"   NDCG {evaluation[name]['ndcg']:.3f}"
+                )
+
+            results['ann'] = evaluate_ann(k=options['k'], sample_size=options['eval_users'], seed=options['seed'])
+            if results['ann']:
+                stats = results['ann']
+                self.stdout.write(
+                    f"\nANN index over {stats['products']} products (k={stats['k']}): "
+                    f"p50 {stats['p50_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms, "
+                    f"recall vs scan {stats['recall_vs_scan']:.3f}"
+                    + (f", vs TF-IDF {stats['recall_vs_tfidf']:.3f}" if stats['recall_vs_tfidf'] is not None else '')
+                )
+
+        if options['json']:
+            with open(options['json'], 'w') as fh:
+                json.dump(results, fh, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['json']}"))
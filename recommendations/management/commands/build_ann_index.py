@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recommendations.ann import DEFAULT_BITS, DEFAULT_DIM, DEFAULT_TABLES, build_ann_index, index_dir
+
+
+class Command(BaseCommand):
+    help = 'Build the approximate nearest-neighbour index over product embeddings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dim', type=int, default=DEFAULT_DIM, help='Embedding dimensions')
+        parser.add_argument('--tables', type=int, default=DEFAULT_TABLES, help='Number of LSH hash tables')
+        parser.add_argument('--bits', type=int, default=DEFAULT_BITS, help='Signature bits per table')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the random hyperplanes')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            indexed = build_ann_index(
+                dim=options['dim'], tables=options['tables'], bits=options['bits'], seed=options['seed'],
+            )
+        except RuntimeError as exc:
+            raise CommandError(exc)
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {indexed} products into {index_dir()} in {time.perf_counter() - started:.1f}s'
+        ))
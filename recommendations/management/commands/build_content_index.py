@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from recommendations.content_index import MAX_DELTA_ROWS, build_content_index, fold_delta, index_dir
+
+
+class Command(BaseCommand):
+    help = 'Build the TF-IDF content index over product names and descriptions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--if-needed', action='store_true',
+            help=f'Only rebuild once {MAX_DELTA_ROWS} saved products are waiting in the delta file',
+        )
+
+    def handle(self, *args, **options):
+        indexed = fold_delta() if options['if_needed'] else build_content_index()
+        if indexed is None:
+            self.stdout.write('Delta is small, nothing to do')
+            return
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} products into {index_dir()}'))
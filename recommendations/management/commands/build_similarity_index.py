@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from recommendations.similarity import DEFAULT_TOP_K, build_similarity_index, last_build_time
+
+
+class Command(BaseCommand):
+    help = 'Build the item-to-item similarity index from product views and orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top-k', type=int, default=DEFAULT_TOP_K,
+            help='Number of neighbours stored per product',
+        )
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Recompute every product instead of only those with new interactions',
+        )
+
+    def handle(self, *args, **options):
+        since = None if options['full'] else last_build_time()
+        if since is None:
+            self.stdout.write('Building full similarity index...')
+        else:
+            self.stdout.write(f'Updating products with interactions since {since:%Y-%m-%d %H:%M:%S}...')
+
+        updated = build_similarity_index(top_k=options['top_k'], since=since)
+        self.stdout.write(self.style.SUCCESS(f'Updated neighbours for {updated} products'))
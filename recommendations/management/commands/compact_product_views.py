@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from recommendations.compaction import DEFAULT_BATCH_SIZE, compact_views, purge_expired_guest_views
+
+
+class Command(BaseCommand):
+    help = 'Roll up old and expired-session guest product views into daily totals'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.RECOMMENDATIONS_VIEW_RETENTION_DAYS,
+            help='Keep individual guest view rows for this many days',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help='Rows moved per transaction',
+        )
+        parser.add_argument(
+            '--skip-guests', action='store_true',
+            help='Do not purge views from expired guest sessions',
+        )
+
+    def handle(self, *args, **options):
+        moved = compact_views(days=options['days'], batch_size=options['batch_size'])
+        self.stdout.write(f"Rolled up {moved} guest views older than {options['days']} days")
+        if not options['skip_guests']:
+            purged = purge_expired_guest_views(batch_size=options['batch_size'])
+            self.stdout.write(f'Rolled up {purged} views from expired guest sessions')
+        self.stdout.write(self.style.SUCCESS('Done'))
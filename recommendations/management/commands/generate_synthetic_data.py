@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recommendations.popularity import rebuild_popularity
+from recommendations.synthetic import check_counts, clear_synthetic_data, generate_synthetic_data
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic catalog and interaction history for benchmarking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1000)
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--sessions', type=int, default=2000, help='Guest sessions')
+        parser.add_argument('--views', type=int, default=50000, help='Product page views')
+        parser.add_argument('--wishlist', type=int, default=1000, help='Wishlist entries')
+        parser.add_argument('--orders', type=int, default=500)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Delete previously generated synthetic data first',
+        )
+
+    def handle(self, *args, **options):
+        counts = {name: options[name] for name in
+                  ('products', 'categories', 'users', 'sessions', 'views', 'wishlist', 'orders')}
+        try:
+            check_counts(**counts)
+        except ValueError as error:
+            raise CommandError(error)
+
+        if options['clear']:
+            clear_synthetic_data()
+            self.stdout.write('Removed existing synthetic data')
+
+        generate_synthetic_data(**counts, seed=options['seed'], log=self.stdout.write)
+        rebuild_popularity()
+        self.stdout.write(self.style.SUCCESS(
+            'Done. Run build_similarity_index --full and build_content_index to refresh the indexes.'
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from recommendations.popularity import rebuild_popularity
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the time-decayed trending leaderboard from stored product views'
+
+    def handle(self, *args, **options):
+        ranked = rebuild_popularity()
+        self.stdout.write(self.style.SUCCESS(f'Ranked {ranked} products'))
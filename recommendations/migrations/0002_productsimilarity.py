@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+        ('recommendations', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSimilarity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('computed_at', models.DateTimeField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similarities', to='products.product')),
+                ('similar_product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='similar_to', to='products.product')),
+            ],
+            options={
+                'verbose_name_plural': 'product similarities',
+                'ordering': ['product', '-score'],
+                'indexes': [models.Index(fields=['product', '-score'], name='recommendat_product_3094c2_idx')],
+                'unique_together': {('product', 'similar_product')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+        ('recommendations', '0002_productsimilarity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductPopularity',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='popularity', serialize=False, to='products.product')),
+                ('score', models.FloatField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='products.category')),
+            ],
+            options={
+                'verbose_name_plural': 'product popularity',
+                'ordering': ['-score'],
+                'indexes': [models.Index(fields=['-score'], name='recommendat_score_965b49_idx'), models.Index(fields=['category', '-score'], name='recommendat_categor_ad8ac6_idx')],
+            },
+        ),
+    ]
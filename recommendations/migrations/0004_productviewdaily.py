@@ -0,0 +1,47 @@
+# Generated by Django 5.2.6 on 2026-10-18 13:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+        ('recommendations', '0003_productpopularity'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductViewDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('unique_visitors', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'product view dailies',
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='productview',
+            index=models.Index(fields=['viewed_at'], name='recommendat_viewed__92c90f_idx'),
+        ),
+        migrations.AddField(
+            model_name='productviewdaily',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_views', to='products.product'),
+        ),
+        migrations.AddIndex(
+            model_name='productviewdaily',
+            index=models.Index(fields=['day'], name='recommendat_day_b30116_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='productviewdaily',
+            unique_together={('product', 'day')},
+        ),
+    ]
@@ -0,0 +1,32 @@
+import math
+
+from django.db import migrations
+
+
+def to_log_scores(apps, schema_editor):
+    ProductPopularity = apps.get_model('recommendations', 'ProductPopularity')
+    # A row without positive weight has no views to rank (and no logarithm)
+    ProductPopularity.objects.filter(score__lte=0).delete()
+    rows = list(ProductPopularity.objects.all())
+    for row in rows:
+        row.score = math.log2(row.score)
+    ProductPopularity.objects.bulk_update(rows, ['score'], batch_size=1000)
+
+
+def to_linear_scores(apps, schema_editor):
+    ProductPopularity = apps.get_model('recommendations', 'ProductPopularity')
+    rows = list(ProductPopularity.objects.all())
+    for row in rows:
+        row.score = 2 ** min(row.score, 1000)
+    ProductPopularity.objects.bulk_update(rows, ['score'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recommendations', '0004_productviewdaily'),
+    ]
+
+    operations = [
+        migrations.RunPython(to_log_scores, to_linear_scores),
+    ]
@@ -1,6 +1,6 @@
 from django.db import models
 from django.conf import settings
-from products.models import Product
+from products.models import Category, Product
 
 
 class ProductView(models.Model):
@@ -22,8 +22,83 @@ class ProductView(models.Model):
             ('user', 'product'),
             ('session_key', 'product'),
         ]
+        indexes = [
+            models.Index(fields=['viewed_at']),
+        ]
         ordering = ['-viewed_at']
 
     def __str__(self):
         identifier = self.user.username if self.user else f"Guest:{self.session_key[:8]}"
         return f"{identifier} viewed {self.product.name}"
+
+
+class ProductSimilarity(models.Model):
+    """Precomputed item-to-item neighbours from co-view/co-purchase data"""
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='similarities'
+    )
+    similar_product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='similar_to'
+    )
+    score = models.FloatField()
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = [('product', 'similar_product')]
+        indexes = [
+            models.Index(fields=['product', '-score']),
+        ]
+        ordering = ['product', '-score']
+        verbose_name_plural = 'product similarities'
+
+    def __str__(self):
+        return f"{self.product_id} ~ {self.similar_product_id} ({self.score:.3f})"
+
+
+class ProductPopularity(models.Model):
+    """Time-decayed view leaderboard, one row per viewed product"""
+    product = models.OneToOneField(
+        Product,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='popularity'
+    )
+    # Denormalised so "trending in category" is a single index scan
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    # log2 of the forward-decayed view weight (see popularity.py)
+    score = models.FloatField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score']),
+            models.Index(fields=['category', '-score']),
+        ]
+        ordering = ['-score']
+        verbose_name_plural = 'product popularity'
+
+    def __str__(self):
+        return f"{self.product_id}: {self.score:.3g}"
+
+
+class ProductViewDaily(models.Model):
+    """Daily per-product rollup of ProductView rows removed by compaction"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_views')
+    day = models.DateField()
+    views = models.PositiveIntegerField(default=0)
+    unique_visitors = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = [('product', 'day')]
+        indexes = [
+            models.Index(fields=['day']),
+        ]
+        ordering = ['-day']
+        verbose_name_plural = 'product view dailies'
+
+    def __str__(self):
+        return f"{self.product_id} on {self.day}: {self.views} views"
@@ -0,0 +1,314 @@
+"""
+Staged recommendation pipelines.
+
+A ``Pipeline`` runs an ordered list of ``Stage`` objects over a shared
+``Context``: candidate generators add products to ``ctx.candidates``,
+scorers boost them in ``ctx.scores``, rankers and fillers append to
+``ctx.results``. Every stage is timed and its SQL queries counted; the
+breakdown is logged at DEBUG level on the ``recommendations.pipeline``
+logger and sent with the ``pipeline_finished`` signal so it can be
+exported elsewhere (the benchmark command aggregates it per stage).
+
+Stages may declare a ``budget`` in seconds and the pipeline has an
+overall one (``RECOMMENDATIONS_PIPELINE_BUDGET``). Once the overall
+budget is spent, remaining stages are skipped except ``required`` ones,
+which keep the block from coming back empty. A stage whose
+``should_run`` returns False (typically because the results are already
+full) is skipped as an early exit.
+
+New stages are added with ``PIPELINES[name].register(stage, before=...)``.
+"""
+import logging
+import time
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.dispatch import Signal
+
+from products.models import Product
+
+logger = logging.getLogger(__name__)
+
+# Sent after every pipeline run with ``name``, ``trace`` and ``request``
+pipeline_finished = Signal()
+
+
+class Context:
+    """Shared state for one pipeline run"""
+
+    def __init__(self, engine, limit, product=None, exclude_ids=None):
+        self.engine = engine
+        self.request = engine.request
+        self.product = product
+        self.limit = limit
+        self.exclude_ids = set(exclude_ids or [])
+        if product is not None:
+            self.exclude_ids.add(product.id)
+        self.preferences = None
+        self.candidates = {}
+        self.scores = {}
+        self.results = []
+
+    @property
+    def remaining(self):
+        return self.limit - len(self.results)
+
+    @property
+    def seen_ids(self):
+        return self.exclude_ids | {p.id for p in self.results}
+
+    def add_candidates(self, products):
+        for product in products:
+            if product.id not in self.exclude_ids:
+                self.candidates.setdefault(product.id, product)
+                self.scores.setdefault(product.id, 0)
+
+    def boost(self, product_id, amount):
+        self.scores[product_id] += amount
+
+    def extend(self, products):
+        """Append products to the results, skipping excluded and duplicate ones"""
+        seen = self.seen_ids
+        for product in products:
+            if self.remaining <= 0:
+                break
+            if product.id not in seen:
+                self.results.append(product)
+                seen.add(product.id)
+
+
+class Stage(ABC):
+    """One step of a pipeline; subclasses implement ``run``"""
+
+    name = None
+    budget = None  # Seconds; exceeding it is logged
+    required = False  # Still runs once the pipeline budget is spent
+
+    def should_run(self, ctx):
+        return ctx.remaining > 0
+
+    @abstractmethod
+    def run(self, ctx):
+        """Do the stage's work on ``ctx``"""
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Pipeline:
+    def __init__(self, name, stages, budget=None):
+        self.name = name
+        self.stages = list(stages)
+        self.budget = budget
+
+    def register(self, stage, before=None):
+        """Add a stage, optionally in front of the stage called ``before``"""
+        names = [s.name for s in self.stages]
+        self.stages.insert(names.index(before) if before else len(self.stages), stage)
+
+    def run(self, ctx):
+        budget = self.budget if self.budget is not None else settings.RECOMMENDATIONS_PIPELINE_BUDGET
+        started = time.perf_counter()
+        trace = []
+        for stage in self.stages:
+            entry = {'stage': stage.name, 'ms': 0.0, 'queries': 0}
+            trace.append(entry)
+            if not stage.should_run(ctx):
+                entry['status'] = 'skipped'
+                continue
+            if time.perf_counter() - started > budget and not stage.required:
+                entry['status'] = 'skipped (budget)'
+                continue
+
+            counter = _QueryCounter()
+            stage_started = time.perf_counter()
+            with connection.execute_wrapper(counter):
+                stage.run(ctx)
+            elapsed = time.perf_counter() - stage_started
+            entry.update(ms=1000 * elapsed, queries=counter.count, results=len(ctx.results),
+                         status='ok')
+            if stage.budget is not None and elapsed > stage.budget:
+                entry['status'] = 'over budget'
+                logger.warning('Stage %s.%s took %.1f ms (budget %.1f ms)',
+                               self.name, stage.name, 1000 * elapsed, 1000 * stage.budget)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Pipeline %s: %s', self.name, ', '.join(
+                f"{e['stage']} {e['ms']:.1f}ms/{e['queries']}q" for e in trace if e['status'] != 'skipped'
+            ))
+        pipeline_finished.send(sender=self.__class__, name=self.name, trace=trace, request=ctx.request)
+        return ctx.results[:ctx.limit]
+
+
+# Personalized ("Recommended for you") stages
+
+FAVORITE_CATEGORY_BOOST = 10
+WISHLIST_CATEGORY_BOOST = 15
+PURCHASE_CATEGORY_BOOST = 20
+
+
+class Preferences(Stage):
+    name = 'preferences'
+    required = True
+
+    def run(self, ctx):
+        ctx.preferences = ctx.engine.get_user_preferences()
+
+
+class CategoryCandidates(Stage):
+    """Products from every category the visitor has shown interest in"""
+
+    name = 'category_candidates'
+
+    def should_run(self, ctx):
+        return ctx.remaining > 0 and ctx.preferences is not None
+
+    def run(self, ctx):
+        prefs = ctx.preferences
+        category_ids = set(
+            prefs['favorite_categories'] + prefs['wishlist_categories'] + prefs['purchased_categories']
+        )
+        if not category_ids:
+            return
+        # Boosts are per category, so only the first few products of each
+        # category by name (plus the ones a boost skips) can make the cut
+        per_category = ctx.limit + len(prefs['wishlist_products']) + len(prefs['purchased_products'])
+        ctx.add_candidates(
+            Product.objects.filter(available=True, category_id__in=category_ids)
+            .exclude(id__in=ctx.exclude_ids)
+            .annotate(position=Window(RowNumber(), partition_by=F('category_id'), order_by=F('name').asc()))
+            .filter(position__lte=per_category)
+            .for_listing()
+        )
+
+
+class CategoryBoost(Stage):
+    """Boost candidates in ``categories`` that are not in ``products``"""
+
+    def __init__(self, name, amount, categories, products=None):
+        self.name = name
+        self.amount = amount
+        self.categories = categories
+        self.products = products
+
+    def should_run(self, ctx):
+        return bool(ctx.candidates) and (
+            bool(ctx.preferences[self.products]) if self.products else bool(ctx.preferences[self.categories])
+        )
+
+    def run(self, ctx):
+        categories = set(ctx.preferences[self.categories])
+        skipped = set(ctx.preferences[self.products]) if self.products else set()
+        for product in ctx.candidates.values():
+            if product.category_id in categories and product.id not in skipped:
+                ctx.boost(product.id, self.amount)
+
+
+class RankByScore(Stage):
+    name = 'rank'
+
+    def should_run(self, ctx):
+        return bool(ctx.candidates)
+
+    def run(self, ctx):
+        ranked = sorted(
+            (p for p in ctx.candidates.values() if ctx.scores[p.id] > 0),
+            key=lambda p: (-ctx.scores[p.id], p.name),
+        )
+        ctx.extend(ranked)
+
+
+class PopularFallback(Stage):
+    name = 'popular_fallback'
+    required = True
+
+    def should_run(self, ctx):
+        # Only when nothing was personalised, as before
+        return not ctx.results
+
+    def run(self, ctx):
+        ctx.extend(ctx.engine.get_popular_products(ctx.limit, list(ctx.exclude_ids)))
+
+
+# Product page ("You may also like") stages
+
+
+class CoOccurrenceNeighbours(Stage):
+    """Precomputed co-view/co-purchase neighbours (see similarity.py)"""
+
+    name = 'co_occurrence'
+
+    def run(self, ctx):
+        ctx.extend(ctx.engine.get_neighbour_products(ctx.product, limit=ctx.remaining))
+
+
+class ContentNeighbours(Stage):
+    """Closest products by name/description (see content_index.py and ann.py)"""
+
+    name = 'content'
+
+    def run(self, ctx):
+        ctx.extend(ctx.engine.get_content_similar_products(
+            ctx.product, limit=ctx.remaining, exclude_ids=ctx.seen_ids
+        ))
+
+
+class CategoryTrending(Stage):
+    """Cold start: trending products from the same category"""
+
+    name = 'category_trending'
+
+    def run(self, ctx):
+        ctx.extend(ctx.engine.get_trending_in_category(
+            ctx.product.category_id, limit=ctx.remaining, exclude_ids=ctx.seen_ids
+        ))
+
+
+class PersonalizedFill(Stage):
+    """Top up with the visitor's personalised recommendations"""
+
+    name = 'personalized_fill'
+    required = True
+
+    def run(self, ctx):
+        ctx.extend(ctx.engine.get_personalized_recommendations(
+            limit=ctx.remaining, exclude_ids=list(ctx.seen_ids)
+        ))
+
+
+PIPELINES = {
+    'personalized': Pipeline('personalized', [
+        Preferences(),
+        CategoryCandidates(),
+        CategoryBoost('favorite_category_boost', FAVORITE_CATEGORY_BOOST, 'favorite_categories'),
+        CategoryBoost('wishlist_boost', WISHLIST_CATEGORY_BOOST, 'wishlist_categories', 'wishlist_products'),
+        CategoryBoost('purchase_boost', PURCHASE_CATEGORY_BOOST, 'purchased_categories', 'purchased_products'),
+        RankByScore(),
+        PopularFallback(),
+    ]),
+    'similar': Pipeline('similar', [
+        CoOccurrenceNeighbours(),
+        ContentNeighbours(),
+        CategoryTrending(),
+    ]),
+    'product': Pipeline('product', [
+        CoOccurrenceNeighbours(),
+        ContentNeighbours(),
+        CategoryTrending(),
+        PersonalizedFill(),
+    ]),
+}
+
+
+def run(name, engine, limit, product=None, exclude_ids=None):
+    """Run a registered pipeline and return its products"""
+    return PIPELINES[name].run(Context(engine, limit, product=product, exclude_ids=exclude_ids))
@@ -0,0 +1,126 @@
+"""
+Time-decayed trending scores.
+
+Uses forward decay: a view at time ``t`` weighs ``2 ** ((t - EPOCH) /
+half_life)``, and a product's score is the sum of its views' weights.
+Every row is implicitly divided by the same factor at read time, so
+ordering by the stored score equals ordering by exponentially decayed
+view counts without ever rewriting old rows.
+
+Weights grow without bound (with a one-hour half-life they pass the
+float range six weeks after ``EPOCH``), so scores are stored as the
+``log2`` of that sum: a view adds ``(t - EPOCH) / half_life`` in log
+space, which stays small for any age and half-life, and a new view is
+a single "log-add" update, ``max(a, b) + log2(1 + 2 ** -|a - b|)``.
+"""
+import math
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Abs, Greatest, Log, Power
+from django.utils import timezone
+
+from .models import ProductPopularity, ProductView, ProductViewDaily
+
+EPOCH = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def half_life():
+    days = settings.RECOMMENDATIONS_TRENDING_HALF_LIFE_DAYS
+    if not days > 0:
+        raise ImproperlyConfigured('RECOMMENDATIONS_TRENDING_HALF_LIFE_DAYS must be positive')
+    return timedelta(days=days)
+
+
+def log_weight_at(when):
+    """``log2`` of the weight of a view at ``when``"""
+    return (when - EPOCH) / half_life()
+
+
+def log_add(a, b):
+    """``log2(2 ** a + 2 ** b)`` without leaving float range"""
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def decayed_score(score, now=None):
+    """Stored score expressed as decayed views as of ``now``"""
+    return 2 ** (score - log_weight_at(now or timezone.now()))
+
+
+def _log_add_expression(increment):
+    return Greatest(F('score'), Value(increment)) + Log(
+        Value(2.0), Value(1.0) + Power(Value(2.0), -Abs(F('score') - Value(increment)))
+    )
+
+
+def record_views(counts, when=None):
+    """Add ``{product_id: views}`` seen at ``when`` to the leaderboard"""
+    from products.models import Product
+
+    weight = log_weight_at(when or timezone.now())
+    increments = {product_id: weight + math.log2(views) for product_id, views in counts.items() if views > 0}
+    missing = [
+        product_id for product_id, increment in increments.items()
+        if not ProductPopularity.objects.filter(product_id=product_id)
+        .update(score=_log_add_expression(increment))
+    ]
+    if not missing:
+        return
+
+    categories = dict(Product.objects.filter(id__in=missing).values_list('id', 'category_id'))
+    for product_id, category_id in categories.items():
+        increment = increments[product_id]
+        try:
+            with transaction.atomic():
+                ProductPopularity.objects.create(
+                    product_id=product_id, category_id=category_id, score=increment
+                )
+        except IntegrityError:
+            # Another worker created the row first
+            ProductPopularity.objects.filter(product_id=product_id).update(
+                score=_log_add_expression(increment)
+            )
+
+
+def record_view(product, when=None):
+    record_views({product.id: 1}, when)
+
+
+def rebuild_popularity(batch_size=1000):
+    """
+    Recompute every score from both view tiers. Each ProductView row only
+    keeps its last view time, so its whole ``view_count`` is weighted at
+    ``viewed_at``; daily rollups are weighted at midday.
+    """
+    scores, categories = {}, {}
+    views = ProductView.objects.values_list('product_id', 'product__category_id', 'viewed_at', 'view_count')
+    for product_id, category_id, viewed_at, view_count in views.iterator(chunk_size=5000):
+        if view_count > 0:
+            scores[product_id] = log_add(
+                scores.get(product_id, -math.inf), math.log2(view_count) + log_weight_at(viewed_at)
+            )
+            categories[product_id] = category_id
+
+    daily = ProductViewDaily.objects.values_list('product_id', 'product__category_id', 'day', 'views')
+    for product_id, category_id, day, count in daily.iterator(chunk_size=5000):
+        midday = datetime.combine(day, time(12), tzinfo=dt_timezone.utc)
+        if count > 0:
+            scores[product_id] = log_add(
+                scores.get(product_id, -math.inf), math.log2(count) + log_weight_at(midday)
+            )
+            categories[product_id] = category_id
+
+    with transaction.atomic():
+        ProductPopularity.objects.all().delete()
+        ProductPopularity.objects.bulk_create(
+            [
+                ProductPopularity(product_id=pid, category_id=categories[pid], score=score)
+                for pid, score in scores.items()
+            ],
+            batch_size=batch_size,
+        )
+    return len(scores)
@@ -0,0 +1,112 @@
+"""
+Cached per-user / per-session preference profiles.
+
+A profile is everything the engine needs to know about a visitor's
+history. It is stored in Django's cache and dropped by the signal
+handlers in ``signals.py`` whenever a view, wishlist entry or order
+item changes, so repeat visitors cost one cache read.
+"""
+import time
+from collections import Counter
+
+from django.core.cache import cache
+
+from .stats import CacheStats
+
+PROFILE_TIMEOUT = 60 * 60
+RECENT_VIEWS = 20
+FAVORITE_CATEGORIES = 5
+
+stats = CacheStats('preferences')
+
+
+def profile_key(user_id=None, session_key=None):
+    if user_id:
+        return f'recs:profile:user:{user_id}'
+    if session_key:
+        return f'recs:profile:session:{session_key}'
+    return None
+
+
+def empty_profile():
+    return {
+        'viewed_products': [],
+        'wishlist_products': [],
+        'purchased_products': [],
+        'favorite_categories': [],
+        'wishlist_categories': [],
+        'purchased_categories': [],
+    }
+
+
+def build_profile(user_id=None, session_key=None):
+    """Gather user interaction data from the database"""
+    from .models import ProductView
+    from wishlist.models import Wishlist
+    from orders.models import OrderItem
+
+    profile = empty_profile()
+    if user_id:
+        views = ProductView.objects.filter(user_id=user_id)
+    elif session_key:
+        views = ProductView.objects.filter(session_key=session_key)
+    else:
+        return profile
+
+    categories = {}
+    viewed = views.order_by('-viewed_at', '-view_count').values_list(
+        'product_id', 'product__category_id'
+    )[:RECENT_VIEWS]
+    for product_id, category_id in viewed:
+        profile['viewed_products'].append(product_id)
+        categories[product_id] = category_id
+
+    if user_id:
+        wishlist = Wishlist.objects.filter(user_id=user_id).values_list(
+            'product_id', 'product__category_id'
+        )
+        for product_id, category_id in wishlist:
+            profile['wishlist_products'].append(product_id)
+            categories[product_id] = category_id
+
+        purchased = OrderItem.objects.filter(order__user_id=user_id).values_list(
+            'product_id', 'product__category_id'
+        )
+        for product_id, category_id in purchased:
+            profile['purchased_products'].append(product_id)
+            categories[product_id] = category_id
+
+    profile['favorite_categories'] = [
+        cat_id for cat_id, _ in Counter(categories.values()).most_common(FAVORITE_CATEGORIES)
+    ]
+    profile['wishlist_categories'] = sorted(
+        {categories[pid] for pid in profile['wishlist_products']}
+    )
+    profile['purchased_categories'] = sorted(
+        {categories[pid] for pid in profile['purchased_products']}
+    )
+    return profile
+
+
+def get_profile(user_id=None, session_key=None):
+    """Cached preference profile for a user or guest session"""
+    key = profile_key(user_id, session_key)
+    if key is None:
+        return empty_profile()
+
+    profile = cache.get(key)
+    if profile is not None:
+        stats.hit()
+        return profile
+
+    stats.miss()
+    started = time.perf_counter()
+    profile = build_profile(user_id, session_key)
+    stats.computed(time.perf_counter() - started)
+    cache.set(key, profile, PROFILE_TIMEOUT)
+    return profile
+
+
+def invalidate(user_id=None, session_key=None):
+    keys = [profile_key(user_id=user_id), profile_key(session_key=session_key)]
+    cache.delete_many([key for key in keys if key])
@@ -0,0 +1,121 @@
+"""
+Cached "You may also like" results with stampede protection.
+
+The product-only part of the list (neighbours, content matches, category
+trending) is the same for every visitor and is cached once per product
+under the ``anon`` segment. Only when it cannot fill the block is the
+visitor's personalised fill added, cached per segment: ``anon`` for
+visitors without history, ``user:<id>`` or ``session:<key>`` otherwise.
+
+Entries hold product ids and are re-read with one query, so prices and
+availability are always current. Each entry is fresh for
+``RESULT_TIMEOUT`` seconds and may then be served stale for another
+``STALE_TIMEOUT`` while a single worker, holding a ``cache.add`` lock,
+recomputes it (single flight). On a cold miss other workers wait up to
+``LOCK_WAIT`` seconds for that worker instead of piling on. Keys carry a
+version that ``signals.py`` bumps whenever a product is added, removed or
+changes availability.
+"""
+import time
+
+from django.core.cache import cache
+
+from products.models import Product
+from . import pipeline
+from .engine import RecommendationEngine
+from .stats import CacheStats
+
+RESULT_TIMEOUT = 5 * 60
+STALE_TIMEOUT = 10 * 60
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 0.2
+POLL_INTERVAL = 0.02
+VERSION_KEY = 'recs:results:version'
+
+stats = CacheStats('results')
+
+
+def version():
+    current = cache.get(VERSION_KEY)
+    if current is None:
+        cache.add(VERSION_KEY, 1, None)
+        current = cache.get(VERSION_KEY, 1)
+    return current
+
+
+def bump_version():
+    """Invalidate every cached result"""
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, None)
+
+
+def segment(engine):
+    preferences = engine.get_user_preferences()
+    if not any(preferences[key] for key in ('viewed_products', 'wishlist_products', 'purchased_products')):
+        return 'anon'
+    if engine.user:
+        return f'user:{engine.user.id}'
+    return f'session:{engine.session_key}'
+
+
+def cached(key, compute):
+    """
+    Return ``compute()`` through the cache: fresh hits are served as is,
+    stale ones while one caller refreshes them, misses computed once.
+    """
+    entry = cache.get(key)
+    now = time.time()
+    if entry is not None and entry['fresh_until'] > now:
+        stats.hit()
+        return entry['value']
+
+    lock_key = f'{key}:lock'
+    locked = cache.add(lock_key, 1, LOCK_TIMEOUT)
+    if not locked:
+        if entry is not None:
+            stats.stale()
+            return entry['value']
+        deadline = now + LOCK_WAIT
+        while time.time() < deadline:
+            time.sleep(POLL_INTERVAL)
+            entry = cache.get(key)
+            if entry is not None:
+                stats.hit()
+                return entry['value']
+
+    stats.miss()
+    try:
+        started = time.perf_counter()
+        value = compute()
+        stats.computed(time.perf_counter() - started)
+        cache.set(key, {'value': value, 'fresh_until': time.time() + RESULT_TIMEOUT},
+                  RESULT_TIMEOUT + STALE_TIMEOUT)
+    finally:
+        # A waiter that gave up leaves the computing caller's lock alone
+        if locked:
+            cache.delete(lock_key)
+    return value
+
+
+def _ids(products):
+    return [p.id for p in products]
+
+
+def get_recommendations_for_product(request, product, limit=6):
+    """Cached equivalent of ``RecommendationEngine.get_recommendations_for_product``"""
+    engine = RecommendationEngine(request)
+    prefix = f'recs:results:v{version()}:{product.id}:{limit}'
+
+    ids = cached(f'{prefix}:anon', lambda: _ids(pipeline.run('similar', engine, limit, product=product)))
+    if len(ids) < limit:
+        exclude_ids = [product.id] + ids
+        ids = ids + cached(f'{prefix}:fill:{segment(engine)}', lambda: _ids(
+            engine.get_personalized_recommendations(limit=limit - len(ids), exclude_ids=exclude_ids)
+        ))
+
+    rank = {pid: i for i, pid in enumerate(ids)}
+    products = list(Product.objects.filter(id__in=ids, available=True).for_listing())
+    products.sort(key=lambda p: rank[p.id])
+    return products
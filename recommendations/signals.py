@@ -0,0 +1,75 @@
+"""
+Signal handlers keeping recommendation indexes and caches in sync
+"""
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from orders.models import OrderItem
+from products.models import Product
+from wishlist.models import Wishlist
+from . import ann, content_index, profiles, result_cache
+from .models import ProductPopularity, ProductView
+from .utils import GUEST_HISTORY_KEY, merge_guest_views
+
+
+@receiver(post_save, sender=Product)
+def update_content_index(sender, instance, created, **kwargs):
+    # Only the name and description are indexed; _previous_text is looked
+    # up by products.signals.remember_previous_state
+    if not created and instance._previous_text == (instance.name, instance.description):
+        return
+    content_index.update_product(instance)
+    ann.insert_product(instance)
+
+
+@receiver(post_save, sender=Product)
+def sync_popularity_category(sender, instance, created, **kwargs):
+    if not created:
+        ProductPopularity.objects.filter(product_id=instance.id).exclude(
+            category_id=instance.category_id
+        ).update(category_id=instance.category_id)
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_content_index(sender, instance, **kwargs):
+    content_index.remove_product(instance.id)
+    ann.remove_product(instance.id)
+
+
+@receiver(post_save, sender=Product)
+def invalidate_results_on_availability(sender, instance, created, **kwargs):
+    # _previous_available is looked up by products.signals.remember_previous_state
+    if created or instance._previous_available != instance.available:
+        result_cache.bump_version()
+
+
+@receiver(post_delete, sender=Product)
+def invalidate_results_on_delete(sender, instance, **kwargs):
+    result_cache.bump_version()
+
+
+@receiver(post_save, sender=ProductView)
+@receiver(post_delete, sender=ProductView)
+def invalidate_viewer_profile(sender, instance, **kwargs):
+    profiles.invalidate(user_id=instance.user_id, session_key=instance.session_key)
+
+
+@receiver(post_save, sender=Wishlist)
+@receiver(post_delete, sender=Wishlist)
+def invalidate_wishlist_profile(sender, instance, **kwargs):
+    profiles.invalidate(user_id=instance.user_id)
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def invalidate_buyer_profile(sender, instance, **kwargs):
+    profiles.invalidate(user_id=instance.order.user_id)
+
+
+@receiver(user_logged_in)
+def merge_guest_history(sender, request, user, **kwargs):
+    # login() has already cycled the session key, but kept the session's data
+    session_key = request.session.pop(GUEST_HISTORY_KEY, None) if request else None
+    if session_key:
+        merge_guest_views(user, session_key)
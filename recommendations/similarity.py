@@ -0,0 +1,183 @@
+"""
+Item-to-item similarity index built from co-view and co-purchase data.
+
+Every guest session, user and order is treated as a "basket" of products.
+Two products are similar when they keep showing up in the same baskets;
+the score is the cosine of their basket incidence vectors, with order
+baskets weighted above view baskets. Only the top-K neighbours of each
+product are stored in ``ProductSimilarity``.
+"""
+import numpy as np
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import ProductSimilarity, ProductView
+
+DEFAULT_TOP_K = 20
+VIEW_WEIGHT = 1.0
+PURCHASE_WEIGHT = 3.0
+
+
+def _gather(indptr, indices, rows):
+    """Concatenate the CSR slices of ``rows`` without a Python loop"""
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    total = int(lengths.sum())
+    if not total:
+        return np.empty(0, dtype=indices.dtype), np.empty(0, dtype=rows.dtype)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return indices[offsets + np.arange(total)], np.repeat(rows, lengths)
+
+
+def _compress(major, minor, size):
+    """Sort (major, minor) pairs into CSR form: (indptr, indices)"""
+    order = np.argsort(major, kind='stable')
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(major, minlength=size), out=indptr[1:])
+    return indptr, minor[order]
+
+
+class InteractionMatrix:
+    """Sparse basket x product incidence matrix kept in both orientations"""
+
+    def __init__(self, basket_keys, product_ids, weights):
+        baskets, basket_idx = np.unique(basket_keys, return_inverse=True)
+        self.product_ids, product_idx = np.unique(product_ids, return_inverse=True)
+        self.basket_keys = baskets
+        self.basket_weights = np.zeros(len(baskets), dtype=np.float64)
+        np.maximum.at(self.basket_weights, basket_idx, weights)
+
+        n_baskets, n_products = len(baskets), len(self.product_ids)
+        self.basket_indptr, self.basket_products = _compress(basket_idx, product_idx, n_baskets)
+        self.product_indptr, self.product_baskets = _compress(product_idx, basket_idx, n_products)
+
+        # Weighted number of baskets each product appears in
+        self.norms = np.bincount(
+            product_idx,
+            weights=self.basket_weights[basket_idx],
+            minlength=n_products,
+        )
+
+    def __len__(self):
+        return len(self.product_ids)
+
+    def products_in_baskets(self, basket_keys):
+        """Product indices appearing in any of the given baskets"""
+        positions = np.searchsorted(self.basket_keys, basket_keys)
+        positions = np.clip(positions, 0, max(len(self.basket_keys) - 1, 0))
+        rows = positions[self.basket_keys[positions] == basket_keys]
+        members, _ = _gather(self.basket_indptr, self.basket_products, rows)
+        return np.unique(members)
+
+    def neighbours(self, index, top_k):
+        """Top-K (product index, cosine score) pairs for one product"""
+        baskets, _ = _gather(self.product_indptr, self.product_baskets, np.array([index]))
+        members, owners = _gather(self.basket_indptr, self.basket_products, baskets)
+        co_counts = np.bincount(
+            members,
+            weights=self.basket_weights[owners],
+            minlength=len(self.product_ids),
+        )
+        co_counts[index] = 0
+        candidates = np.flatnonzero(co_counts)
+        if not len(candidates):
+            return candidates, co_counts[candidates]
+
+        scores = co_counts[candidates] / np.sqrt(self.norms[index] * self.norms[candidates])
+        if len(candidates) > top_k:
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            candidates, scores = candidates[best], scores[best]
+        order = np.argsort(-scores, kind='stable')
+        return candidates[order], scores[order]
+
+
+def load_interactions():
+    """Read view and order baskets into an ``InteractionMatrix``"""
+    from orders.models import OrderItem
+
+    keys, products, weights = [], [], []
+
+    views = ProductView.objects.values_list('user_id', 'session_key', 'product_id')
+    for user_id, session_key, product_id in views.iterator(chunk_size=5000):
+        keys.append(f'u:{user_id}' if user_id else f's:{session_key}')
+        products.append(product_id)
+        weights.append(VIEW_WEIGHT)
+
+    items = OrderItem.objects.values_list('order_id', 'product_id')
+    for order_id, product_id in items.iterator(chunk_size=5000):
+        keys.append(f'o:{order_id}')
+        products.append(product_id)
+        weights.append(PURCHASE_WEIGHT)
+
+    return InteractionMatrix(
+        np.array(keys, dtype=str),
+        np.array(products, dtype=np.int64),
+        np.array(weights, dtype=np.float64),
+    )
+
+
+def touched_baskets(since):
+    """Basket keys that received new interactions after ``since``"""
+    from orders.models import OrderItem
+
+    keys = []
+    views = ProductView.objects.filter(viewed_at__gte=since)
+    for user_id, session_key in views.values_list('user_id', 'session_key').distinct():
+        keys.append(f'u:{user_id}' if user_id else f's:{session_key}')
+    orders = OrderItem.objects.filter(order__created__gte=since)
+    for order_id in orders.values_list('order_id', flat=True).distinct():
+        keys.append(f'o:{order_id}')
+    return np.array(sorted(set(keys)), dtype=str)
+
+
+def last_build_time():
+    return ProductSimilarity.objects.aggregate(latest=Max('computed_at'))['latest']
+
+
+def build_similarity_index(top_k=DEFAULT_TOP_K, since=None, batch_size=1000):
+    """
+    Rebuild stored neighbours.
+
+    With ``since`` only products sharing a basket with an interaction
+    newer than that timestamp are recomputed; otherwise every product is,
+    and neighbours of products left without interactions are dropped.
+    Returns the number of products whose neighbours were rewritten.
+    """
+    started = timezone.now()
+    matrix = load_interactions()
+    if not len(matrix):
+        if since is None:
+            ProductSimilarity.objects.all().delete()
+        return 0
+
+    if since is None:
+        targets = np.arange(len(matrix))
+    else:
+        targets = matrix.products_in_baskets(touched_baskets(since))
+
+    rows = []
+    for index in targets:
+        neighbours, scores = matrix.neighbours(index, top_k)
+        product_id = int(matrix.product_ids[index])
+        rows.extend(
+            ProductSimilarity(
+                product_id=product_id,
+                similar_product_id=int(matrix.product_ids[neighbour]),
+                score=float(score),
+                computed_at=started,
+            )
+            for neighbour, score in zip(neighbours, scores)
+        )
+
+    target_ids = [int(pid) for pid in matrix.product_ids[targets]]
+    with transaction.atomic():
+        if since is None:
+            ProductSimilarity.objects.all().delete()
+        for start in range(0, len(target_ids) if since else 0, batch_size):
+            ProductSimilarity.objects.filter(
+                product_id__in=target_ids[start:start + batch_size]
+            ).delete()
+        ProductSimilarity.objects.bulk_create(rows, batch_size=batch_size)
+
+    return len(target_ids)
@@ -0,0 +1,62 @@
+"""
+Process-local counters for the recommendation caches
+"""
+import threading
+
+
+class CacheStats:
+    """Hit/miss and recompute-time counters for one cache layer"""
+
+    registry = {}
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.reset()
+        CacheStats.registry[name] = self
+
+    def reset(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+            self.stale_hits = 0
+            self.computes = 0
+            self.compute_seconds = 0.0
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def stale(self):
+        """A hit served from an expired entry while it is being refreshed"""
+        with self._lock:
+            self.hits += 1
+            self.stale_hits += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def computed(self, seconds):
+        with self._lock:
+            self.computes += 1
+            self.compute_seconds += seconds
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale_hits': self.stale_hits,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'computes': self.computes,
+                'avg_compute_ms': (
+                    1000 * self.compute_seconds / self.computes if self.computes else 0.0
+                ),
+            }
+
+
+def get_cache_stats():
+    """Counters for every registered cache layer, keyed by name"""
+    return {name: stats.snapshot() for name, stats in CacheStats.registry.items()}
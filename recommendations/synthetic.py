@@ -0,0 +1,214 @@
+"""
+Synthetic catalog and interaction generator for benchmarking.
+
+Every visitor gets a preferred category; most of their views, wishlist
+entries and purchases come from it, and products within a category
+follow a Zipf-like popularity curve. That gives the offline evaluation
+in ``benchmark.py`` a signal to recover. Everything created here is
+tagged with ``PREFIX`` so ``clear_synthetic_data`` can remove it.
+"""
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from orders.models import Order, OrderItem
+from products.models import Category, Product
+from wishlist.models import Wishlist
+from .models import ProductView
+
+PREFIX = 'synthetic'
+BATCH_SIZE = 5000
+IN_CATEGORY_SHARE = 0.7
+HISTORY_DAYS = 90
+WORDS = (
+    'classic modern compact premium eco wireless cotton leather steel wooden smart '
+    'portable vintage deluxe organic handmade slim heavy light pro mini ultra soft '
+    'waterproof foldable'
+).split()
+
+
+def clear_synthetic_data():
+    """Delete synthetic categories (cascading to products) and users"""
+    Category.objects.filter(slug__startswith=f'{PREFIX}-').delete()
+    get_user_model().objects.filter(username__startswith=f'{PREFIX}-').delete()
+
+
+@contextmanager
+def _explicit_timestamps(model, field_name):
+    """Let bulk_create keep our own values for an auto_now field"""
+    field = model._meta.get_field(field_name)
+    auto_now = field.auto_now
+    field.auto_now = False
+    try:
+        yield
+    finally:
+        field.auto_now = auto_now
+
+
+def _zipf_weights(size, exponent=1.1):
+    weights = 1.0 / np.arange(1, size + 1) ** exponent
+    return weights / weights.sum()
+
+
+class SyntheticDataGenerator:
+    def __init__(self, seed=0, log=None):
+        self.rng = np.random.default_rng(seed)
+        self.log = log or (lambda message: None)
+        self.now = timezone.now()
+
+    def _timestamps(self, size):
+        seconds = self.rng.integers(0, HISTORY_DAYS * 86400, size)
+        return [self.now - timedelta(seconds=int(s)) for s in seconds]
+
+    def _pick(self, preferred, size):
+        """Draw ``size`` product indices per visitor, mostly from ``preferred`` categories"""
+        picks = np.empty(len(preferred), dtype=np.int64)
+        has_members = np.array([len(members) > 0 for members in self.category_members])
+        in_category = (self.rng.random(len(preferred)) < IN_CATEGORY_SHARE) & has_members[preferred]
+        for category, members in enumerate(self.category_members):
+            rows = np.flatnonzero(in_category & (preferred == category))
+            if len(rows):
+                picks[rows] = self.rng.choice(members, len(rows), p=self.category_weights[category])
+        rows = np.flatnonzero(~in_category)
+        picks[rows] = self.rng.choice(size, len(rows), p=self.global_weights)
+        return picks
+
+    def create_catalog(self, n_products, n_categories):
+        categories = Category.objects.bulk_create([
+            Category(name=f'Synthetic {i}', slug=f'{PREFIX}-{i}') for i in range(n_categories)
+        ])
+        assignment = self.rng.integers(0, n_categories, n_products)
+        prices = self.rng.integers(100, 20000, n_products)
+        products = []
+        for i in range(n_products):
+            words = self.rng.choice(WORDS, 3)
+            description = ' '.join(self.rng.choice(WORDS, 12))
+            products.append(Product(
+                category=categories[assignment[i]],
+                name=f'{words[0].title()} {words[1]} {words[2]} {i}',
+                slug=f'{PREFIX}-{i}',
+                description=f'{categories[assignment[i]].name} {description}',
+                price=Decimal(int(prices[i])) / 100,
+            ))
+        products = Product.objects.bulk_create(products, batch_size=BATCH_SIZE)
+        self.log(f'Created {n_products} products in {n_categories} categories')
+
+        self.product_ids = np.array([p.id for p in products], dtype=np.int64)
+        popularity = self.rng.permutation(n_products)
+        self.global_weights = _zipf_weights(n_products)[popularity]
+        self.category_members, self.category_weights = [], []
+        for category in range(n_categories):
+            members = np.flatnonzero(assignment == category)
+            weights = self.global_weights[members]
+            self.category_members.append(members)
+            self.category_weights.append(weights / weights.sum() if len(members) else weights)
+
+    def create_users(self, n_users):
+        User = get_user_model()
+        users = User.objects.bulk_create([
+            User(username=f'{PREFIX}-{i}', password='!') for i in range(n_users)
+        ], batch_size=BATCH_SIZE)
+        self.user_ids = np.array([u.id for u in users], dtype=np.int64)
+        self.log(f'Created {n_users} users')
+
+    def create_views(self, n_views, n_sessions):
+        n_categories = len(self.category_members)
+        n_visitors = len(self.user_ids) + n_sessions
+        preferences = self.rng.integers(0, n_categories, n_visitors)
+        self.user_preferences = preferences[:len(self.user_ids)]
+
+        visitors = self.rng.integers(0, n_visitors, n_views)
+        products = self._pick(preferences[visitors], len(self.product_ids))
+        pairs, counts = np.unique(
+            visitors * len(self.product_ids) + products, return_counts=True
+        )
+        visitors, products = np.divmod(pairs, len(self.product_ids))
+        timestamps = self._timestamps(len(pairs))
+
+        with _explicit_timestamps(ProductView, 'viewed_at'):
+            for start in range(0, len(pairs), BATCH_SIZE):
+                rows = []
+                for i in range(start, min(start + BATCH_SIZE, len(pairs))):
+                    visitor = int(visitors[i])
+                    is_user = visitor < len(self.user_ids)
+                    rows.append(ProductView(
+                        user_id=int(self.user_ids[visitor]) if is_user else None,
+                        session_key=None if is_user else f'{PREFIX}-{visitor}',
+                        product_id=int(self.product_ids[products[i]]),
+                        view_count=int(counts[i]),
+                        viewed_at=timestamps[i],
+                    ))
+                ProductView.objects.bulk_create(rows)
+        self.log(f'Created {len(pairs)} view rows from {n_views} views')
+
+    def create_wishlists(self, n_entries):
+        owners = self.rng.integers(0, len(self.user_ids), n_entries)
+        products = self._pick(self.user_preferences[owners], len(self.product_ids))
+        pairs = np.unique(owners * len(self.product_ids) + products)
+        owners, products = np.divmod(pairs, len(self.product_ids))
+        Wishlist.objects.bulk_create([
+            Wishlist(user_id=int(self.user_ids[o]), product_id=int(self.product_ids[p]))
+            for o, p in zip(owners, products)
+        ], batch_size=BATCH_SIZE)
+        self.log(f'Created {len(pairs)} wishlist entries')
+
+    def create_orders(self, n_orders):
+        buyers = self.rng.integers(0, len(self.user_ids), n_orders)
+        orders = Order.objects.bulk_create([
+            Order(
+                user_id=int(self.user_ids[b]), first_name='Synthetic', last_name='Buyer',
+                email='buyer@example.com', address='1 Test Street', postal_code='000000',
+                city='Testville', phone='0000000000', paid=True,
+            )
+            for b in buyers
+        ], batch_size=BATCH_SIZE)
+
+        sizes = self.rng.integers(1, 4, n_orders)
+        owners = np.repeat(np.arange(n_orders), sizes)
+        products = self._pick(self.user_preferences[buyers[owners]], len(self.product_ids))
+        prices = dict(Product.objects.filter(
+            id__in=[int(self.product_ids[p]) for p in np.unique(products)]
+        ).values_list('id', 'price'))
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=orders[o],
+                product_id=int(self.product_ids[p]),
+                price=prices[int(self.product_ids[p])],
+                quantity=int(self.rng.integers(1, 3)),
+            )
+            for o, p in zip(owners, products)
+        ], batch_size=BATCH_SIZE)
+        self.log(f'Created {n_orders} orders with {len(owners)} items')
+
+
+def check_counts(products, categories, users, sessions, views, wishlist, orders):
+    """Raise ValueError for counts ``generate_synthetic_data`` can't generate from"""
+    counts = {'products': products, 'categories': categories, 'users': users, 'sessions': sessions,
+              'views': views, 'wishlist': wishlist, 'orders': orders}
+    negative = [name for name, count in counts.items() if count < 0]
+    if negative:
+        raise ValueError(f"Counts can't be negative: {', '.join(negative)}")
+    if not products or not categories:
+        raise ValueError('Need at least one product and one category')
+    if not users + sessions:
+        raise ValueError('Need at least one user or guest session to view products')
+
+
+def generate_synthetic_data(products=1000, categories=20, users=200, sessions=2000,
+                            views=50000, wishlist=1000, orders=500, seed=0, log=None):
+    """Create the catalog and history in one transaction (see ``check_counts``)"""
+    check_counts(products, categories, users, sessions, views, wishlist, orders)
+    generator = SyntheticDataGenerator(seed=seed, log=log)
+    with transaction.atomic():
+        generator.create_catalog(products, categories)
+        generator.create_users(users)
+        generator.create_views(views, sessions)
+        if users:
+            generator.create_wishlists(wishlist)
+            generator.create_orders(orders)
+    return generator
@@ -1,3 +1,889 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, OperationalError, connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from orders.models import Order, OrderItem
+from products.models import Category, Product
+from products.testing import QueryCountMixin
+from wishlist.models import Wishlist
+from . import ann, benchmark, compaction, content_index, pipeline, popularity, profiles, result_cache, similarity, synthetic, tracking
+from .engine import RecommendationEngine
+from .models import ProductPopularity, ProductSimilarity, ProductView, ProductViewDaily
+from .popularity import rebuild_popularity
+from .utils import merge_guest_views, track_product_view
+
+
+class PersonalizedRecommendationsTests(TestCase):
+    MAX_QUERIES = 2
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = Category.objects.create(name='Books', slug='books')
+        cls.shoes = Category.objects.create(name='Shoes', slug='shoes')
+        cls.toys = Category.objects.create(name='Toys', slug='toys')
+        cls.products = {}
+        for category in (cls.books, cls.shoes, cls.toys):
+            for i in range(4):
+                product = Product.objects.create(
+                    category=category,
+                    name=f'{category.name} {i}',
+                    slug=f'{category.slug}-{i}',
+                    price=10,
+                )
+                cls.products[product.slug] = product
+
+        cls.user = User.objects.create_user('shopper', password='secret')
+        ProductView.objects.create(user=cls.user, product=cls.products['books-0'])
+        Wishlist.objects.create(user=cls.user, product=cls.products['shoes-0'])
+        order = Order.objects.create(
+            user=cls.user, first_name='A', last_name='B', email='a@example.com',
+            address='1 Street', postal_code='000', city='City', phone='123',
+        )
+        OrderItem.objects.create(order=order, product=cls.products['toys-0'], price=10)
+
+    def setUp(self):
+        cache.clear()
+
+    def make_engine(self, user=None):
+        request = RequestFactory().get('/')
+        request.user = user or AnonymousUser()
+        request.session = SessionStore()
+        return RecommendationEngine(request)
+
+    def test_purchase_and_wishlist_boosts_order_results(self):
+        products = self.make_engine(self.user).get_personalized_recommendations(limit=12)
+        slugs = [p.slug for p in products]
+
+        # Purchase boost (20) > wishlist boost (15) > favorite category (10)
+        self.assertEqual(slugs[:3], ['toys-1', 'toys-2', 'toys-3'])
+        self.assertEqual(slugs[3:6], ['shoes-1', 'shoes-2', 'shoes-3'])
+        self.assertNotIn('toys-0', slugs[:3])
+
+    def test_exclude_ids_are_respected(self):
+        excluded = [self.products['toys-1'].id, self.products['shoes-1'].id]
+        products = self.make_engine(self.user).get_personalized_recommendations(
+            limit=12, exclude_ids=excluded
+        )
+        self.assertFalse({p.id for p in products} & set(excluded))
+
+    def test_query_budget_for_repeat_visitor(self):
+        engine = self.make_engine(self.user)
+        engine.get_personalized_recommendations(limit=8)
+
+        with CaptureQueriesContext(connection) as queries:
+            products = engine.get_personalized_recommendations(limit=8)
+            for product in products:
+                product.get_absolute_url()
+        self.assertLessEqual(len(queries), self.MAX_QUERIES)
+
+    def test_query_budget_for_guest_fallback(self):
+        for session_key in ('guest-1', 'guest-2'):
+            ProductView.objects.create(session_key=session_key, product=self.products['books-2'])
+        rebuild_popularity()
+        engine = self.make_engine()
+
+        with CaptureQueriesContext(connection) as queries:
+            products = engine.get_personalized_recommendations(limit=8)
+            for product in products:
+                product.get_absolute_url()
+        self.assertLessEqual(len(queries), self.MAX_QUERIES)
+        self.assertEqual(products[0], self.products['books-2'])
+
+
+class ProductGridQueryCountTests(QueryCountMixin, TransactionTestCase):
+    """Recommendation grids cost the same number of queries however many cards they show"""
+
+    # The engine runs on its own thread and connection, which must see committed rows
+
+    def setUp(self):
+        cache.clear()
+        self.add_products(100, [
+            Category.objects.create(name='Books', slug='books'),
+            Category.objects.create(name='Shoes', slug='shoes'),
+        ])
+
+    def warm_up(self, url):
+        # Recompute the block itself rather than serve it from the result cache
+        result_cache.bump_version()
+
+    def assertConstantQueries(self, url):
+        super().assertConstantQueries(f'{url}?limit=24', few_url=f'{url}?limit=4')
+
+    def test_recommended_for_you(self):
+        self.assertConstantQueries(reverse('recommended_for_you'))
+
+    def test_similar_products(self):
+        anchor = Product.objects.get(slug='widget-0')
+        self.assertConstantQueries(reverse('similar_products', args=[anchor.id]))
+
+
+@override_settings(RECOMMENDATIONS_BLOCK_TIMEOUT=0.2)
+class BlockTimeoutTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        books = Category.objects.create(name='Books', slug='books')
+        self.anchor = Product.objects.create(category=books, name='Anchor', slug='anchor', price=10)
+        Product.objects.create(category=books, name='Popular pick', slug='popular-pick', price=10)
+
+    def test_slow_engine_falls_back_to_popular_products_promptly(self):
+        def slow_engine(*args, **kwargs):
+            time.sleep(1.5)
+            return []
+
+        url = reverse('similar_products', args=[self.anchor.id])
+        self.client.force_login(User.objects.create_user('shopper'))
+        self.client.get(reverse('product_list'), secure=True)  # Catalog warm-up
+        with mock.patch('recommendations.views.get_recommendations', slow_engine):
+            started = time.perf_counter()
+            response = self.client.get(url, secure=True)
+            elapsed = time.perf_counter() - started
+        self.assertContains(response, 'Popular pick')
+        self.assertLess(elapsed, 1.0)
+
+
+@override_settings(RECOMMENDATIONS_VIEW_TRACKING='buffered')
+class BufferedTrackingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        books = Category.objects.create(name='Books', slug='books')
+        cls.book = Product.objects.create(category=books, name='Book', slug='book', price=10)
+        cls.pen = Product.objects.create(category=books, name='Pen', slug='pen', price=10)
+        cls.user = User.objects.create_user('reader')
+
+    def setUp(self):
+        cache.clear()
+        self.buffer = tracking.ViewBuffer()
+        # Flushed by hand here, not from the background thread
+        patcher = mock.patch.object(tracking.ViewBuffer, '_ensure_flusher')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_flush_inserts_then_increments(self):
+        self.buffer.add(self.user.id, None, self.book.id)
+        self.buffer.add(self.user.id, None, self.book.id)
+        self.buffer.add(None, 'guest', self.book.id)
+        self.assertFalse(ProductView.objects.exists())
+        self.assertEqual(self.buffer.flush(), 2)
+
+        self.buffer.add(self.user.id, None, self.book.id)
+        self.buffer.flush()
+        self.assertEqual(ProductView.objects.get(user=self.user).view_count, 3)
+        self.assertEqual(ProductView.objects.get(session_key='guest').view_count, 1)
+        self.assertEqual(len(self.buffer), 0)
+
+    def test_views_of_deleted_products_and_users_are_dropped(self):
+        gone = User.objects.create_user('gone')
+        self.buffer.add(self.user.id, None, self.book.id)
+        self.buffer.add(self.user.id, None, self.pen.id)
+        self.buffer.add(gone.id, None, self.book.id)
+        self.pen.delete()
+        gone.delete()
+        self.assertEqual(self.buffer.flush(), 1)
+        self.assertEqual(list(ProductView.objects.values_list('product_id', flat=True)), [self.book.id])
+        self.assertEqual(len(self.buffer), 0)
+
+    def test_only_transient_errors_are_retried(self):
+        self.buffer.add(self.user.id, None, self.book.id)
+        with mock.patch.object(tracking, 'write_views', side_effect=OperationalError('database is locked')), \
+                self.assertLogs('recommendations.tracking', 'ERROR'):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(len(self.buffer), 1)
+
+        with mock.patch.object(tracking, 'write_views', side_effect=IntegrityError('bad row')), \
+                self.assertLogs('recommendations.tracking', 'ERROR'):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertEqual(len(self.buffer), 0)
+
+    def test_failed_flush_is_retried_without_double_counting(self):
+        products = [self.book, self.pen, Product.objects.create(category=self.book.category, name='Ink', slug='ink',
+                                                                price=10)]
+        for product in products:
+            self.buffer.add(self.user.id, None, product.id)
+        with mock.patch.object(tracking, 'CHUNK_SIZE', 1), \
+                mock.patch.object(popularity, 'record_views', side_effect=OperationalError('database is locked')), \
+                self.assertLogs('recommendations.tracking', 'ERROR'):
+            self.assertEqual(self.buffer.flush(), 0)
+        self.assertFalse(ProductView.objects.exists())
+        self.assertEqual(self.buffer.flush(), 3)
+        self.assertEqual(list(ProductView.objects.values_list('view_count', flat=True)), [1, 1, 1])
+
+    def test_track_product_view_buffers(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        request.session = SessionStore()
+        with mock.patch.object(tracking, 'buffer', self.buffer):
+            track_product_view(request, self.book)
+        self.assertEqual(len(self.buffer), 1)
+        self.assertFalse(ProductView.objects.exists())
+
+
+class ProfileCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        books = Category.objects.create(name='Books', slug='books')
+        shoes = Category.objects.create(name='Shoes', slug='shoes')
+        cls.book = Product.objects.create(category=books, name='Book', slug='book', price=10)
+        cls.shoe = Product.objects.create(category=shoes, name='Shoe', slug='shoe', price=10)
+        cls.user = User.objects.create_user('shopper')
+        ProductView.objects.create(user=cls.user, product=cls.book)
+
+    def setUp(self):
+        cache.clear()
+
+    def profile(self, **kwargs):
+        return profiles.get_profile(**kwargs or {'user_id': self.user.id})
+
+    def test_profile_is_built_once(self):
+        with self.assertNumQueries(3):
+            built = self.profile()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.profile(), built)
+        self.assertEqual(built['viewed_products'], [self.book.id])
+        self.assertEqual(built['favorite_categories'], [self.book.category_id])
+
+    def test_anonymous_visitor_has_an_empty_profile(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(profiles.get_profile(), profiles.empty_profile())
+
+    def test_views_invalidate_the_profile(self):
+        self.profile()
+        view = ProductView.objects.create(user=self.user, product=self.shoe)
+        self.assertIn(self.shoe.id, self.profile()['viewed_products'])
+        view.delete()
+        self.assertNotIn(self.shoe.id, self.profile()['viewed_products'])
+
+    def test_guest_views_invalidate_the_session_profile(self):
+        self.assertEqual(self.profile(session_key='guest')['viewed_products'], [])
+        ProductView.objects.create(session_key='guest', product=self.shoe)
+        self.assertEqual(self.profile(session_key='guest')['viewed_products'], [self.shoe.id])
+
+    def test_wishlist_invalidates_the_profile(self):
+        self.profile()
+        entry = Wishlist.objects.create(user=self.user, product=self.shoe)
+        self.assertEqual(self.profile()['wishlist_categories'], [self.shoe.category_id])
+        entry.delete()
+        self.assertEqual(self.profile()['wishlist_products'], [])
+
+    def test_orders_invalidate_the_profile(self):
+        self.profile()
+        order = Order.objects.create(
+            user=self.user, first_name='A', last_name='B', email='a@example.com',
+            address='1 Street', postal_code='000', city='City', phone='123',
+        )
+        item = OrderItem.objects.create(order=order, product=self.shoe, price=10)
+        self.assertEqual(self.profile()['purchased_products'], [self.shoe.id])
+        item.delete()
+        self.assertEqual(self.profile()['purchased_products'], [])
+
+    def test_unrelated_changes_keep_the_profile(self):
+        self.profile()
+        other = User.objects.create_user('other')
+        ProductView.objects.create(user=other, product=self.shoe)
+        with self.assertNumQueries(0):
+            self.profile()
+
+
+class SyntheticDataTests(TestCase):
+    COUNTS = {'products': 40, 'categories': 4, 'users': 6, 'sessions': 6, 'views': 300, 'wishlist': 12, 'orders': 8}
+
+    def test_generates_the_requested_history(self):
+        synthetic.generate_synthetic_data(**self.COUNTS)
+        self.assertEqual(Product.objects.filter(slug__startswith='synthetic-').count(), 40)
+        self.assertEqual(Category.objects.filter(slug__startswith='synthetic-').count(), 4)
+        self.assertEqual(ProductView.objects.values('user_id').exclude(user_id=None).distinct().count(), 6)
+        self.assertEqual(sum(ProductView.objects.values_list('view_count', flat=True)), 300)
+        self.assertEqual(Order.objects.count(), 8)
+        self.assertTrue(Wishlist.objects.exists())
+        # Timestamps are spread over the history instead of all being "now"
+        self.assertLess(ProductView.objects.earliest('viewed_at').viewed_at, timezone.now() - timedelta(days=1))
+
+    def test_same_seed_same_history(self):
+        def history():
+            synthetic.clear_synthetic_data()
+            synthetic.generate_synthetic_data(**self.COUNTS, seed=3)
+            return sorted(ProductView.objects.values_list('product__slug', 'view_count', 'session_key'), key=str)
+        self.assertEqual(history(), history())
+
+    def test_guests_only(self):
+        synthetic.generate_synthetic_data(**{**self.COUNTS, 'users': 0})
+        self.assertFalse(ProductView.objects.filter(user__isnull=False).exists())
+        self.assertFalse(Order.objects.exists())
+
+    def test_clear_removes_everything_generated(self):
+        synthetic.generate_synthetic_data(**self.COUNTS)
+        synthetic.clear_synthetic_data()
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(ProductView.objects.exists())
+
+    def test_counts_it_cannot_generate_from_are_rejected(self):
+        for changes in ({'users': 0, 'sessions': 0}, {'products': 0}, {'categories': 0}, {'views': -1}):
+            with self.subTest(**changes), self.assertRaises(ValueError):
+                synthetic.generate_synthetic_data(**{**self.COUNTS, **changes})
+        self.assertFalse(Product.objects.exists())
+
+    def test_command_rejects_bad_counts_before_clearing(self):
+        synthetic.generate_synthetic_data(**self.COUNTS)
+        with self.assertRaisesMessage(CommandError, 'user or guest session'):
+            call_command('generate_synthetic_data', '--users=0', '--sessions=0', '--clear', stdout=StringIO())
+        self.assertEqual(Product.objects.count(), 40)
+
+
+class BenchmarkTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        synthetic.generate_synthetic_data(
+            products=40, categories=4, users=8, sessions=8, views=400, wishlist=10, orders=6,
+        )
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        settings = override_settings(RECOMMENDATIONS_INDEX_DIR=directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(content_index.ContentIndex.reset)
+        self.addCleanup(ann.AnnIndex.reset)
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(benchmark._percentile(values, 50), 50)
+        self.assertEqual(benchmark._percentile(values, 99), 99)
+        self.assertEqual(benchmark._percentile([7], 99), 7)
+
+    def test_measure_counts_queries(self):
+        stats = benchmark.measure([lambda: Product.objects.count(), lambda: list(Product.objects.all()[:2])])
+        self.assertEqual((stats['calls'], stats['queries_mean'], stats['queries_max']), (2, 1, 1))
+        self.assertGreaterEqual(stats['p99_ms'], stats['p50_ms'])
+
+    def test_run_benchmark_times_every_entry_point(self):
+        latency, stages = benchmark.run_benchmark(iterations=5, sample_size=3)
+        self.assertEqual(set(latency), {
+            'get_user_preferences (cold)', 'get_user_preferences (warm)', 'get_personalized_recommendations',
+            'get_popular_products', 'get_similar_products', 'get_recommendations_for_product',
+        })
+        self.assertTrue(all(stats['calls'] == 5 for stats in latency.values()))
+        self.assertTrue(stages)
+        self.assertTrue(all(stats['ran'] <= stats['runs'] for stats in stages.values()))
+
+    def test_evaluate_rolls_back_the_held_out_views(self):
+        views = ProductView.objects.count()
+        results = benchmark.evaluate(k=5, sample_size=8)
+        self.assertEqual(ProductView.objects.count(), views)
+        self.assertGreater(results['users'], 0)
+        for name in ('personalized', 'similar'):
+            self.assertTrue(0 <= results[name]['ndcg'] <= results[name]['hit_rate'] <= 1)
+
+    def test_evaluate_ann(self):
+        self.assertIsNone(benchmark.evaluate_ann())
+        content_index.build_content_index()
+        ann.build_ann_index(tables=4, bits=4)
+        results = benchmark.evaluate_ann(k=5, sample_size=10)
+        self.assertEqual(results['products'], 10)
+        self.assertTrue(0 <= results['recall_vs_scan'] <= 1)
+        self.assertTrue(0 <= results['recall_vs_tfidf'] <= 1)
+
+    def test_command_writes_json(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, 'results.json')
+        call_command('benchmark_recommendations', '--iterations=3', '--sample=2', f'--json={path}', stdout=StringIO())
+        with open(path) as fh:
+            results = json.load(fh)
+        self.assertEqual(set(results), {'latency', 'stages', 'evaluation', 'ann'})
+
+
+class SimilarityIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        books = Category.objects.create(name='Books', slug='books')
+        cls.a, cls.b, cls.c = [
+            Product.objects.create(category=books, name=name, slug=name.lower(), price=10)
+            for name in ('A', 'B', 'C')
+        ]
+
+    def pairs(self):
+        return set(ProductSimilarity.objects.values_list('product_id', 'similar_product_id'))
+
+    def stale_pair(self):
+        ProductSimilarity.objects.create(
+            product=self.c, similar_product=self.a, score=1, computed_at=timezone.now() - timedelta(days=1)
+        )
+
+    def test_neighbours_come_from_shared_baskets(self):
+        for product in (self.a, self.b):
+            ProductView.objects.create(session_key='guest', product=product)
+        self.assertEqual(similarity.build_similarity_index(), 2)
+        self.assertEqual(self.pairs(), {(self.a.id, self.b.id), (self.b.id, self.a.id)})
+
+    def test_full_rebuild_drops_products_without_interactions(self):
+        self.stale_pair()
+        for product in (self.a, self.b):
+            ProductView.objects.create(session_key='guest', product=product)
+        similarity.build_similarity_index()
+        self.assertNotIn((self.c.id, self.a.id), self.pairs())
+
+    def test_full_rebuild_without_interactions_empties_the_index(self):
+        self.stale_pair()
+        self.assertEqual(similarity.build_similarity_index(), 0)
+        self.assertFalse(ProductSimilarity.objects.exists())
+
+    def test_incremental_rebuild_keeps_untouched_products(self):
+        self.stale_pair()
+        for product in (self.a, self.b):
+            ProductView.objects.create(session_key='guest', product=product)
+        similarity.build_similarity_index(since=timezone.now() - timedelta(hours=1))
+        self.assertIn((self.c.id, self.a.id), self.pairs())
+
+    def test_command_full_flag_rebuilds_everything(self):
+        self.stale_pair()
+        call_command('build_similarity_index', '--full', stdout=StringIO())
+        self.assertFalse(ProductSimilarity.objects.exists())
+
+
+class PopularityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        books = Category.objects.create(name='Books', slug='books')
+        cls.old, cls.new, cls.busy = [
+            Product.objects.create(category=books, name=name, slug=name.lower(), price=10)
+            for name in ('Old', 'New', 'Busy')
+        ]
+
+    def scores(self):
+        return dict(ProductPopularity.objects.values_list('product_id', 'score'))
+
+    def test_recent_and_frequent_views_rank_higher(self):
+        day = popularity.EPOCH + timedelta(days=30)
+        popularity.record_view(self.old, day)
+        popularity.record_view(self.new, day + timedelta(days=1))
+        popularity.record_views({self.busy.id: 3}, day)
+        scores = self.scores()
+        self.assertLess(scores[self.old.id], scores[self.new.id])
+        self.assertLess(scores[self.old.id], scores[self.busy.id])
+        # One half-life later a single view is worth half as much
+        self.assertAlmostEqual(popularity.decayed_score(scores[self.old.id], day + popularity.half_life()), 0.5)
+
+    @override_settings(RECOMMENDATIONS_TRENDING_HALF_LIFE_DAYS=1 / 24)
+    def test_large_ages_do_not_overflow(self):
+        later = popularity.EPOCH + timedelta(days=3650)
+        popularity.record_views({self.old.id: 5}, later)
+        popularity.record_view(self.old, later)
+        popularity.record_view(self.new, later + timedelta(hours=1))
+        scores = self.scores()
+        self.assertAlmostEqual(popularity.decayed_score(scores[self.old.id], later), 6)
+        self.assertGreater(scores[self.old.id], scores[self.new.id])
+
+    def test_rebuild_matches_incremental_scores(self):
+        when = popularity.EPOCH + timedelta(days=400)
+        user = User.objects.create_user('reader')
+        ProductView.objects.create(user=user, product=self.old, view_count=4)
+        ProductView.objects.create(session_key='guest', product=self.old, view_count=1)
+        ProductView.objects.update(viewed_at=when)
+        popularity.record_views({self.old.id: 5}, when)
+        incremental = self.scores()[self.old.id]
+        self.assertEqual(rebuild_popularity(), 1)
+        self.assertAlmostEqual(self.scores()[self.old.id], incremental)
+
+    def test_trending_in_category_ranks_viewed_products_first(self):
+        popularity.record_views({self.busy.id: 3, self.new.id: 1})
+        unviewed = Product.objects.create(category=self.old.category, name='Alpha', slug='alpha', price=10)
+        Product.objects.create(category=self.old.category, name='Hidden', slug='hidden', price=10, available=False)
+        engine = RecommendationEngine(benchmark.make_request())
+        trending = engine.get_trending_in_category(self.old.category_id, limit=3, exclude_ids=[self.new.id])
+        self.assertEqual(trending, [self.busy, unviewed, self.old])
+        with CaptureQueriesContext(connection) as queries:
+            engine.get_trending_in_category(self.old.category_id, limit=1)
+        self.assertIn('recommendations_productpopularity', queries[0]['sql'].split('FROM')[1])
+        self.assertEqual(len(queries), 2)
+
+    @override_settings(RECOMMENDATIONS_TRENDING_HALF_LIFE_DAYS=0)
+    def test_half_life_must_be_positive(self):
+        with self.assertRaises(ImproperlyConfigured):
+            popularity.record_view(self.old)
+
+
+class ContentIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = Category.objects.create(name='Books', slug='books')
+        cls.novel = Product.objects.create(
+            category=cls.books, name='Mystery novel', slug='novel', price=10,
+            description='A detective story set in a lighthouse',
+        )
+        cls.thriller = Product.objects.create(
+            category=cls.books, name='Mystery thriller', slug='thriller', price=10,
+            description='A detective chases a smuggler',
+        )
+        cls.atlas = Product.objects.create(
+            category=cls.books, name='Road atlas', slug='atlas', price=10, description='Maps of every motorway',
+        )
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        settings = override_settings(RECOMMENDATIONS_INDEX_DIR=directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(content_index.ContentIndex.reset)
+        content_index.build_content_index()
+
+    def similar(self, product):
+        return content_index.similar_product_ids([product.id])[product.id]
+
+    def test_saved_products_are_found_through_the_delta(self):
+        self.assertEqual(self.similar(self.novel), [self.thriller.id])
+        guide = Product.objects.create(
+            category=self.books, name='Lighthouse guide', slug='guide', price=10,
+            description='Every lighthouse on the coast',
+        )
+        self.atlas.description = 'A detective map of every lighthouse'
+        self.atlas.save()
+        self.assertEqual(set(content_index.ContentIndex.get().delta), {guide.id, self.atlas.id})
+        self.assertEqual(set(self.similar(self.novel)), {self.thriller.id, guide.id, self.atlas.id})
+
+        self.thriller.delete()
+        self.assertNotIn(self.thriller.id, self.similar(self.novel))
+
+    def test_saves_without_text_changes_are_not_indexed(self):
+        self.atlas.price = 12
+        self.atlas.save()
+        self.assertEqual(content_index.ContentIndex.get().delta, {})
+
+    def test_delta_is_shared_through_the_file(self):
+        self.atlas.description = 'A detective map'
+        self.atlas.save()
+        # A fresh instance, as another worker would open it
+        content_index.ContentIndex.reset()
+        index = content_index.ContentIndex.get()
+        self.assertIn('detective', index.vector(self.atlas.id))
+        self.assertIn(self.atlas.id, self.similar(self.novel))
+
+    def test_saves_only_append_to_the_delta(self):
+        with mock.patch.object(content_index, 'MAX_DELTA_ROWS', 1), \
+                mock.patch.object(content_index, '_build') as build:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.atlas.description = 'A detective map'
+                self.atlas.save()
+        build.assert_not_called()
+        self.assertEqual(set(content_index.ContentIndex.get().delta), {self.atlas.id})
+
+    def test_delta_is_folded_into_the_main_index(self):
+        with mock.patch.object(content_index, 'MAX_DELTA_ROWS', 2):
+            self.atlas.description = 'A detective map'
+            self.atlas.save()
+            out = StringIO()
+            call_command('build_content_index', '--if-needed', stdout=out)
+            self.assertEqual(len(content_index.ContentIndex.get().delta), 1)
+            self.assertIn('nothing to do', out.getvalue())
+            self.novel.name = 'Mystery novel, abridged'
+            self.novel.save()
+            self.assertEqual(content_index.fold_delta(), 3)
+        index = content_index.ContentIndex.get()
+        self.assertEqual(index.delta, {})
+        self.assertIn('detective', index.vector(self.atlas.id))
+        self.assertIn(self.atlas.id, self.similar(self.novel))
+
+
+class AnnIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        books = Category.objects.create(name='Books', slug='books')
+        cls.novel, cls.thriller, cls.mystery = [
+            Product.objects.create(category=books, name=name, slug=name.lower().replace(' ', '-'), price=10,
+                                   description='A detective story in a lighthouse')
+            for name in ('Mystery novel', 'Mystery thriller', 'Mystery box set')
+        ]
+        cls.atlas = Product.objects.create(category=books, name='Road atlas', slug='atlas', price=10,
+                                           description='Maps of every motorway')
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        settings = override_settings(RECOMMENDATIONS_INDEX_DIR=directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(content_index.ContentIndex.reset)
+        self.addCleanup(ann.AnnIndex.reset)
+        content_index.build_content_index()
+        # One bit per table: every product with shared terms is a candidate
+        ann.build_ann_index(tables=2, bits=1)
+
+    def similar(self, product):
+        return ann.similar_product_ids([product.id]).get(product.id)
+
+    def test_deleted_products_are_not_returned(self):
+        self.assertEqual(set(self.similar(self.novel)), {self.thriller.id, self.mystery.id})
+        self.thriller.delete()
+        self.assertEqual(self.similar(self.novel), [self.mystery.id])
+        self.assertIsNone(self.similar(self.thriller))
+        # Another worker opening the index sees the same
+        ann.AnnIndex.reset()
+        self.assertEqual(self.similar(self.novel), [self.mystery.id])
+
+    def vectors_size(self):
+        return os.path.getsize(os.path.join(ann.index_dir(), 'vectors.dat'))
+
+    def test_only_text_changes_are_embedded_again(self):
+        size = self.vectors_size()
+        self.novel.price = 12
+        self.novel.save()
+        self.assertEqual(self.vectors_size(), size)
+        self.novel.description = 'A detective story on a moor'
+        self.novel.save()
+        self.assertGreater(self.vectors_size(), size)
+
+    def test_benchmark_samples_only_searchable_products(self):
+        self.thriller.delete()
+        results = benchmark.evaluate_ann(k=2, sample_size=10)
+        # The atlas shares no terms and the thriller is gone
+        self.assertEqual(results['products'], 2)
+
+    def test_rebuild_drops_deleted_rows(self):
+        self.mystery.delete()
+        content_index.build_content_index()
+        self.assertEqual(ann.build_ann_index(tables=2, bits=1), 3)
+        self.assertEqual(self.similar(self.novel), [self.thriller.id])
+
+
+class GuestHistoryMergeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        books = Category.objects.create(name='Books', slug='books')
+        cls.products = [
+            Product.objects.create(category=books, name=f'Book {i}', slug=f'book-{i}', price=10)
+            for i in range(250)
+        ]
+        cls.user = User.objects.create_user('reader', password='secret')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_login_merges_the_guest_history(self):
+        book, other = self.products[:2]
+        ProductView.objects.create(user=self.user, product=book, view_count=2)
+        # Adding to the cart starts the guest's session, so views are tracked from then on
+        self.client.post(reverse('cart_add', args=[book.id]), {'quantity': 1}, secure=True)
+        for product in (book, other, other):
+            self.client.get(product.get_absolute_url(), secure=True)
+        self.assertEqual(ProductView.objects.filter(user__isnull=True).count(), 2)
+
+        self.client.post(reverse('login'), {'username': 'reader', 'password': 'secret'}, secure=True)
+        self.assertFalse(ProductView.objects.filter(user__isnull=True).exists())
+        self.assertEqual(
+            dict(ProductView.objects.filter(user=self.user).values_list('product_id', 'view_count')),
+            {book.id: 3, other.id: 2},
+        )
+
+    def test_session_cookie_is_not_trusted(self):
+        ProductView.objects.create(session_key='someone-else', product=self.products[0])
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = 'someone-else'
+        self.client.post(reverse('login'), {'username': 'reader', 'password': 'secret'}, secure=True)
+        self.assertEqual(ProductView.objects.get().session_key, 'someone-else')
+        self.assertFalse(ProductView.objects.filter(user=self.user).exists())
+
+    def assertMergeQueries(self, count, queries):
+        for product in self.products[:count]:
+            ProductView.objects.create(user=self.user, product=product)
+            ProductView.objects.create(session_key='guest', product=product)
+        ProductView.objects.create(session_key='guest', product=self.products[-1])
+        with self.assertNumQueries(queries):
+            merge_guest_views(self.user, 'guest')
+        self.assertFalse(ProductView.objects.filter(session_key='guest').exists())
+        self.assertEqual(ProductView.objects.filter(user=self.user).count(), count + 1)
+
+    def test_small_history_merges_in_a_fixed_number_of_queries(self):
+        # Savepoint, two UPDATEs, one DELETE of the summed rows, release
+        self.assertMergeQueries(3, 5)
+
+    def test_large_history_merges_in_the_same_number_of_queries(self):
+        self.assertMergeQueries(240, 5)
+
+
+class CompactionTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        books = Category.objects.create(name='Books', slug='books')
+        cls.book = Product.objects.create(category=books, name='Book', slug='book', price=10)
+        cls.user = User.objects.create_user('reader')
+
+    def view(self, days_ago, user=None, session_key=None, count=1):
+        view = ProductView.objects.create(user=user, session_key=session_key, product=self.book, view_count=count)
+        ProductView.objects.filter(id=view.id).update(viewed_at=timezone.now() - timedelta(days=days_ago))
+
+    def test_old_guest_views_are_rolled_up(self):
+        self.view(40, session_key='old-1', count=2)
+        self.view(40, session_key='old-2')
+        self.view(1, session_key='recent')
+        self.assertEqual(compaction.compact_views(days=30, batch_size=1), 2)
+        self.assertEqual(list(ProductView.objects.values_list('session_key', flat=True)), ['recent'])
+        daily = ProductViewDaily.objects.get()
+        self.assertEqual((daily.views, daily.unique_visitors), (3, 2))
+
+    def test_user_history_is_kept(self):
+        self.view(400, user=self.user, count=5)
+        self.assertEqual(compaction.compact_views(days=30), 0)
+        self.assertEqual(ProductView.objects.get(user=self.user).view_count, 5)
+        self.assertFalse(ProductViewDaily.objects.exists())
+
+    def test_expired_guest_sessions_are_purged(self):
+        live = SessionStore()
+        live.create()
+        self.view(1, session_key=live.session_key)
+        self.view(1, session_key='expired')
+        self.view(1, user=self.user)
+        self.assertEqual(compaction.purge_expired_guest_views(), 1)
+        self.assertEqual(
+            set(ProductView.objects.values_list('session_key', flat=True)), {live.session_key, None}
+        )
+
+
+class PipelineTests(TestCase):
+    class Sleep(pipeline.Stage):
+        def __init__(self, name, seconds, required=False, budget=None):
+            self.name, self.seconds, self.required, self.budget = name, seconds, required, budget
+
+        def run(self, ctx):
+            time.sleep(self.seconds)
+
+    class Query(pipeline.Stage):
+        name = 'query'
+
+        def run(self, ctx):
+            ctx.extend(Product.objects.all())
+
+    @classmethod
+    def setUpTestData(cls):
+        books = Category.objects.create(name='Books', slug='books')
+        Product.objects.create(category=books, name='Book', slug='book', price=10)
+
+    def run_pipeline(self, stages, budget=1.0):
+        traces = []
+
+        def receiver(trace, **kwargs):
+            traces.append(trace)
+
+        pipeline.pipeline_finished.connect(receiver)
+        self.addCleanup(pipeline.pipeline_finished.disconnect, receiver)
+        results = pipeline.Pipeline('test', stages, budget=budget).run(pipeline.Context(mock.Mock(), limit=3))
+        return results, {entry['stage']: entry for entry in traces[0]}
+
+    def test_stages_are_timed_and_their_queries_counted(self):
+        results, trace = self.run_pipeline([self.Sleep('sleep', 0.01), self.Query()])
+        self.assertEqual([p.name for p in results], ['Book'])
+        self.assertGreaterEqual(trace['sleep']['ms'], 10)
+        self.assertEqual((trace['sleep']['queries'], trace['query']['queries']), (0, 1))
+        self.assertEqual(trace['query']['results'], 1)
+        self.assertEqual({entry['status'] for entry in trace.values()}, {'ok'})
+
+    def test_spent_budget_skips_optional_stages_only(self):
+        _, trace = self.run_pipeline([
+            self.Sleep('slow', 0.02),
+            self.Sleep('optional', 0),
+            self.Sleep('required', 0, required=True),
+        ], budget=0.01)
+        self.assertEqual(trace['optional']['status'], 'skipped (budget)')
+        self.assertEqual(trace['required']['status'], 'ok')
+
+    def test_stage_over_its_own_budget_is_logged(self):
+        with self.assertLogs('recommendations.pipeline', 'WARNING'):
+            _, trace = self.run_pipeline([self.Sleep('slow', 0.02, budget=0.001)])
+        self.assertEqual(trace['slow']['status'], 'over budget')
+
+    def test_stages_must_implement_run(self):
+        class Incomplete(pipeline.Stage):
+            name = 'incomplete'
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+
+class ResultCacheTests(TestCase):
+    KEY = 'recs:results:test'
+
+    @classmethod
+    def setUpTestData(cls):
+        books = Category.objects.create(name='Books', slug='books')
+        cls.book = Product.objects.create(category=books, name='Book', slug='book', price=10)
+
+    def setUp(self):
+        cache.clear()
+        result_cache.stats.reset()
+        self.compute = mock.Mock(return_value=[1, 2])
+
+    def store(self, value, fresh):
+        cache.set(self.KEY, {'value': value, 'fresh_until': time.time() + (60 if fresh else -1)}, 600)
+
+    def test_fresh_entries_are_computed_once(self):
+        self.assertEqual(result_cache.cached(self.KEY, self.compute), [1, 2])
+        self.assertEqual(result_cache.cached(self.KEY, self.compute), [1, 2])
+        self.compute.assert_called_once()
+        self.assertEqual((result_cache.stats.misses, result_cache.stats.hits), (1, 1))
+
+    def test_stale_entry_is_served_while_another_worker_refreshes_it(self):
+        self.store([3], fresh=False)
+        cache.add(f'{self.KEY}:lock', 1)
+        self.assertEqual(result_cache.cached(self.KEY, self.compute), [3])
+        self.compute.assert_not_called()
+        self.assertEqual(result_cache.stats.stale_hits, 1)
+
+    def test_stale_entry_is_refreshed_by_one_worker(self):
+        self.store([3], fresh=False)
+        self.assertEqual(result_cache.cached(self.KEY, self.compute), [1, 2])
+        self.assertEqual(result_cache.cached(self.KEY, self.compute), [1, 2])
+        self.compute.assert_called_once()
+        self.assertIsNone(cache.get(f'{self.KEY}:lock'))
+
+    def test_cold_miss_waits_for_the_computing_worker(self):
+        cache.add(f'{self.KEY}:lock', 1)
+        # The other worker finishes while this one polls
+        with mock.patch.object(result_cache.time, 'sleep', side_effect=lambda _: self.store([4], fresh=True)):
+            self.assertEqual(result_cache.cached(self.KEY, self.compute), [4])
+        self.compute.assert_not_called()
+
+    def test_cold_miss_computes_after_waiting_too_long(self):
+        cache.add(f'{self.KEY}:lock', 1)
+        with mock.patch.object(result_cache, 'LOCK_WAIT', 0.05):
+            self.assertEqual(result_cache.cached(self.KEY, self.compute), [1, 2])
+        self.compute.assert_called_once()
+        # The computing worker still holds its lock
+        self.assertEqual(cache.get(f'{self.KEY}:lock'), 1)
+
+    def test_lock_is_released_when_computing_fails(self):
+        self.compute.side_effect = RuntimeError
+        with self.assertRaises(RuntimeError):
+            result_cache.cached(self.KEY, self.compute)
+        self.assertIsNone(cache.get(f'{self.KEY}:lock'))
+
+    def test_availability_changes_invalidate_results_with_one_lookup(self):
+        version = result_cache.version()
+        self.book.price = 12
+        with CaptureQueriesContext(connection) as queries:
+            self.book.save()
+        self.assertEqual(result_cache.version(), version)
+        # Category and availability come from the same pre-save lookup
+        selects = [q['sql'] for q in queries if q['sql'].startswith('SELECT')]
+        self.assertEqual(len(selects), 1)
+        self.assertIn('"products_product"."available"', selects[0])
+
+        self.book.available = False
+        self.book.save()
+        self.assertEqual(result_cache.version(), version + 1)
@@ -0,0 +1,198 @@
+"""
+Write-behind buffering for product view tracking.
+
+In ``buffered`` mode ``track_product_view`` only bumps an in-memory
+counter; a daemon thread flushes the aggregated (viewer, product)
+increments every ``RECOMMENDATIONS_VIEW_FLUSH_INTERVAL`` seconds with a
+few bulk statements, instead of a read and a write per page hit. The
+buffer is also flushed when it grows past ``MAX_PENDING`` keys and at
+interpreter exit, so a graceful worker shutdown loses nothing.
+
+Views of products or by users deleted in the meantime are dropped at
+flush time. A flush is written in one transaction; one that fails on a
+transient database error (e.g. a locked database) is put back for the
+next one, up to ``MAX_REQUEUED`` keys; any other failure drops the
+batch, so one bad row can't stall tracking and grow the buffer for ever.
+"""
+import atexit
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import OperationalError, close_old_connections, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.utils import timezone
+
+from products.models import Product
+from . import popularity, profiles
+from .models import ProductView
+
+logger = logging.getLogger(__name__)
+
+MAX_PENDING = 5000
+MAX_REQUEUED = 4 * MAX_PENDING
+CHUNK_SIZE = 200
+
+
+def _write_chunk(chunk, pending):
+    ProductView.objects.bulk_create(
+        [
+            ProductView(user_id=user_id, session_key=session_key, product_id=product_id, view_count=0)
+            for user_id, session_key, product_id in chunk
+        ],
+        ignore_conflicts=True,
+    )
+
+    match = Q()
+    for user_id, session_key, product_id in chunk:
+        if user_id:
+            match |= Q(user_id=user_id, product_id=product_id)
+        else:
+            match |= Q(user__isnull=True, session_key=session_key, product_id=product_id)
+    rows = ProductView.objects.filter(match).values_list('id', 'user_id', 'session_key', 'product_id')
+    ids = {
+        (user_id, None if user_id else session_key, product_id): row_id
+        for row_id, user_id, session_key, product_id in rows
+    }
+
+    counts, seen = [], []
+    for key in chunk:
+        if key not in ids:
+            continue  # Deleted since the insert (its product or viewer went)
+        count, last_seen = pending[key]
+        counts.append(When(id=ids[key], then=Value(count)))
+        seen.append(When(id=ids[key], then=Value(last_seen)))
+    if not counts:
+        return
+    ProductView.objects.filter(id__in=[ids[key] for key in chunk if key in ids]).update(
+        view_count=F('view_count') + Case(*counts, default=Value(0)),
+        viewed_at=Case(*seen, default=F('viewed_at')),
+    )
+
+
+def write_views(pending):
+    """
+    Apply ``{(user_id, session_key, product_id): [count, last_seen]}``.
+
+    Missing rows are inserted with ``view_count=0`` (conflicts ignored),
+    then every row gets its increment through one ``F()`` update per
+    chunk, so counts from concurrent writers are never overwritten. Keys
+    whose product or user no longer exists are skipped. The chunks and
+    the popularity update commit together, so a failed write can be
+    retried whole without counting anything twice. Returns the number
+    of keys written.
+    """
+    products = set(Product.objects.filter(id__in={key[2] for key in pending}).values_list('id', flat=True))
+    users = set(get_user_model().objects.filter(
+        id__in={key[0] for key in pending if key[0]}
+    ).values_list('id', flat=True))
+    pending = {
+        key: value for key, value in pending.items()
+        if key[2] in products and (not key[0] or key[0] in users)
+    }
+
+    keys = list(pending)
+    per_product = Counter()
+    for (_, _, product_id), (count, _) in pending.items():
+        per_product[product_id] += count
+    with transaction.atomic():
+        for start in range(0, len(keys), CHUNK_SIZE):
+            _write_chunk(keys[start:start + CHUNK_SIZE], pending)
+        if per_product:
+            popularity.record_views(per_product)
+
+    for user_id, session_key, _ in keys:
+        profiles.invalidate(user_id=user_id, session_key=session_key)
+    return len(pending)
+
+
+class ViewBuffer:
+    """Thread-safe aggregation of pending view increments"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._wake = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, user_id, session_key, product_id, when=None):
+        key = (user_id, None if user_id else session_key, product_id)
+        with self._lock:
+            entry = self._pending.setdefault(key, [0, None])
+            entry[0] += 1
+            entry[1] = when or timezone.now()
+            full = len(self._pending) >= MAX_PENDING
+        self._ensure_flusher()
+        if full:
+            self._wake.set()
+
+    def drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def flush(self):
+        pending = self.drain()
+        if not pending:
+            return 0
+        try:
+            return write_views(pending)
+        except OperationalError:
+            logger.exception('Failed to flush %d buffered product views, will retry', len(pending))
+            self._requeue(pending)
+        except Exception:
+            logger.exception('Dropped %d buffered product views that could not be written', len(pending))
+        return 0
+
+    def rekey(self, session_key, user_id):
+        """Move a guest session's pending views over to a user"""
+        with self._lock:
+            for key in [k for k in self._pending if k[0] is None and k[1] == session_key]:
+                count, last_seen = self._pending.pop(key)
+                entry = self._pending.setdefault((user_id, None, key[2]), [0, last_seen])
+                entry[0] += count
+                entry[1] = max(entry[1], last_seen)
+
+    def _requeue(self, pending):
+        with self._lock:
+            dropped = 0
+            for key, (count, last_seen) in pending.items():
+                if key not in self._pending and len(self._pending) >= MAX_REQUEUED:
+                    dropped += 1
+                    continue
+                entry = self._pending.setdefault(key, [0, last_seen])
+                entry[0] += count
+                entry[1] = max(entry[1], last_seen)
+        if dropped:
+            logger.warning('Buffer full, dropped %d product view keys', dropped)
+
+    def _ensure_flusher(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='product-view-flusher', daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        interval = settings.RECOMMENDATIONS_VIEW_FLUSH_INTERVAL
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            self.flush()
+            close_old_connections()
+
+
+buffer = ViewBuffer()
+
+
+def is_buffered():
+    return settings.RECOMMENDATIONS_VIEW_TRACKING == 'buffered'
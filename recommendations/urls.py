@@ -0,0 +1,8 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('for-you/', views.recommended_for_you, name='recommended_for_you'),
+    path('similar/<int:product_id>/', views.similar_products, name='similar_products'),
+    path('stats/', views.cache_stats, name='cache_stats'),
+]
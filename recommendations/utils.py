@@ -1,36 +1,80 @@
 """
 Utility functions for tracking and getting recommendations
 """
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Greatest
+
 from .models import ProductView
 from .engine import RecommendationEngine
+from .popularity import record_view
+from . import pipeline, profiles, result_cache, tracking
+
+# Session entry naming the key a guest's views were recorded under; it
+# survives the key change at login, unlike anything the client sends
+GUEST_HISTORY_KEY = 'recommendations_guest_key'
 
 
 def track_product_view(request, product):
     """
     Track that a user/session viewed a product.
-    Call this from product_detail view.
+    Call this from product_detail view. Visitors without a session are
+    not tracked here (that would create one per anonymous page view); the
+    similar products block starts their session and tracks the view.
     """
     if request.user.is_authenticated:
-        # Logged-in user
-        view, created = ProductView.objects.get_or_create(
-            user=request.user,
-            product=product,
-            defaults={'view_count': 1}
-        )
-        if not created:
-            view.view_count += 1
-            view.save()
+        user, session_key = request.user, None
     elif request.session.session_key:
-        # Guest user with session
-        view, created = ProductView.objects.get_or_create(
-            session_key=request.session.session_key,
-            product=product,
-            user=None,
-            defaults={'view_count': 1}
+        user, session_key = None, request.session.session_key
+        request.session.setdefault(GUEST_HISTORY_KEY, session_key)
+    else:
+        return
+
+    if tracking.is_buffered():
+        # Written in bulk by the background flusher (see tracking.py)
+        tracking.buffer.add(user.id if user else None, session_key, product.id)
+        return
+
+    view, created = ProductView.objects.get_or_create(
+        user=user,
+        session_key=session_key,
+        product=product,
+        defaults={'view_count': 1}
+    )
+    if not created:
+        view.view_count += 1
+        view.save()
+    record_view(product)
+
+
+def merge_guest_views(user, session_key):
+    """
+    Fold a guest session's views into the user's history.
+
+    Runs three statements however long the history is: add guest counts
+    (and the later timestamp) onto products the user already viewed,
+    hand the remaining guest rows over to the user, delete the rest.
+    """
+    tracking.buffer.rekey(session_key, user.id)
+
+    guest = ProductView.objects.filter(user__isnull=True, session_key=session_key)
+    same_product = guest.filter(product_id=OuterRef('product_id')).order_by()
+    with transaction.atomic():
+        ProductView.objects.filter(
+            user=user,
+            product_id__in=guest.values('product_id')
+        ).update(
+            view_count=F('view_count') + Subquery(same_product.values('view_count')[:1]),
+            viewed_at=Greatest('viewed_at', Subquery(same_product.values('viewed_at')[:1])),
         )
-        if not created:
-            view.view_count += 1
-            view.save()
+        guest.exclude(
+            product_id__in=ProductView.objects.filter(user=user).values('product_id')
+        ).update(user=user, session_key=None)
+        # Everything left was summed above; skip per-row delete signals
+        # (the profiles they would invalidate are dropped below)
+        guest._raw_delete(guest.db)
+
+    profiles.invalidate(user_id=user.id, session_key=session_key)
 
 
 def get_recommendations(request, product=None, limit=6):
@@ -45,12 +89,11 @@ def get_recommendations(request, product=None, limit=6):
     Returns:
         List of Product objects
     """
-    engine = RecommendationEngine(request)
-    
     if product:
-        return engine.get_recommendations_for_product(product, limit=limit)
+        return result_cache.get_recommendations_for_product(request, product, limit=limit)
     else:
-        return engine.get_personalized_recommendations(limit=limit)
+        engine = RecommendationEngine(request)
+        return pipeline.run('personalized', engine, limit)
 
 
 def get_homepage_recommendations(request, limit=8):
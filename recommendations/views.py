@@ -1,3 +1,147 @@
+"""
+Deferred recommendation blocks.
+
+Catalog pages render without waiting for the engine and fetch these
+fragments afterwards. The views are async: lookups use the async ORM,
+the (synchronous) engine runs in a worker thread, and a block that
+takes longer than ``RECOMMENDATIONS_BLOCK_TIMEOUT`` seconds is answered
+with cached popular products instead. The engine runs on a dedicated
+thread pool rather than through ``sync_to_async``: a cancelled
+``sync_to_async`` call still waits for its function to return, and the
+request's sync thread would stay busy with it, so the fallback could
+only be sent once the slow call was done anyway.
+"""
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.http import Http404, JsonResponse
 from django.shortcuts import render
 
-# Create your views here.
+from products.models import Product
+from wishlist.models import Wishlist
+from .stats import get_cache_stats
+from .utils import get_homepage_recommendations, get_recommendations, track_product_view
+
+logger = logging.getLogger(__name__)
+
+POPULAR_CACHE_KEY = 'recs:popular-fallback'
+POPULAR_CACHE_SIZE = 24
+POPULAR_CACHE_TIMEOUT = 5 * 60
+MAX_LIMIT = 24
+
+engine_executor = ThreadPoolExecutor(thread_name_prefix='recommendations')
+
+
+async def cached_popular_products(limit):
+    """Popular products from the cache, refreshed with one async query"""
+    products = await cache.aget(POPULAR_CACHE_KEY)
+    if products is None:
+        products = [
+            product async for product in Product.objects.filter(
+                available=True, popularity__isnull=False
+            ).for_listing().order_by('-popularity__score')[:POPULAR_CACHE_SIZE]
+        ]
+        if not products:
+            products = [
+                product async for product in Product.objects.filter(
+                    available=True
+                ).for_listing().order_by('-created')[:POPULAR_CACHE_SIZE]
+            ]
+        await cache.aset(POPULAR_CACHE_KEY, products, POPULAR_CACHE_TIMEOUT)
+    return products[:limit]
+
+
+def _run_engine(func, *args, **kwargs):
+    try:
+        return func(*args, **kwargs)
+    finally:
+        # Pool threads outlive requests, so close their connection like a request would
+        close_old_connections()
+
+
+async def _recommend(request, block, func, *args, limit, **kwargs):
+    """Run a sync engine call, falling back to popular products on timeout"""
+    call = functools.partial(_run_engine, func, request, *args, limit=limit, **kwargs)
+    try:
+        return await asyncio.wait_for(
+            asyncio.get_running_loop().run_in_executor(engine_executor, call),
+            timeout=settings.RECOMMENDATIONS_BLOCK_TIMEOUT,
+        )
+    except asyncio.TimeoutError:
+        logger.warning('Recommendation block %r timed out, serving popular products', block)
+        return await cached_popular_products(limit)
+
+
+def _limit(request, default):
+    try:
+        return max(1, min(int(request.GET.get('limit', default)), MAX_LIMIT))
+    except ValueError:
+        return default
+
+
+async def _respond(request, products):
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'products': [
+            {
+                'id': product.id,
+                'name': product.name,
+                'price': str(product.price),
+                'url': product.get_absolute_url(),
+                'image': product.image.url if product.image else None,
+            }
+            for product in products
+        ]})
+
+    user = await request.auser()
+    wishlist_product_ids = []
+    if user.is_authenticated:
+        wishlist_product_ids = [
+            product_id async for product_id in
+            Wishlist.objects.filter(user=user).values_list('product_id', flat=True)
+        ]
+    # Rendering runs context processors that read the session synchronously
+    return await sync_to_async(render)(request, 'recommendations/product_grid.html', {
+        'products': products,
+        'wishlist_product_ids': wishlist_product_ids,
+    })
+
+
+async def recommended_for_you(request):
+    """'Recommended for You' block for the product list page"""
+    limit = _limit(request, 8)
+    products = await _recommend(request, 'for-you', get_homepage_recommendations, limit=limit)
+    return await _respond(request, products)
+
+
+async def similar_products(request, product_id):
+    """'You may also like' block for a product page"""
+    try:
+        product = await Product.objects.for_listing().aget(
+            id=product_id, available=True
+        )
+    except Product.DoesNotExist:
+        raise Http404('No product matches the given query.')
+
+    # Guests without a session got the shared copy of the product page,
+    # which tracked nothing: start their session and history here, a
+    # request only browsers that run the page's script make
+    if not request.session.session_key and not (await request.auser()).is_authenticated:
+        await request.session.acreate()
+        await sync_to_async(track_product_view)(request, product)
+
+    limit = _limit(request, 6)
+    products = await _recommend(request, 'similar', get_recommendations, product=product, limit=limit)
+    return await _respond(request, products)
+
+
+@staff_member_required
+def cache_stats(request):
+    """Hit ratio and recompute latency of this worker's recommendation caches"""
+    return JsonResponse(get_cache_stats())
@@ -0,0 +1,14 @@
+"""
+Signal handlers invalidating pages that show the wishlist
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from products import conditional
+from .models import Wishlist
+
+
+@receiver(post_save, sender=Wishlist)
+@receiver(post_delete, sender=Wishlist)
+def invalidate_wishlist_pages(sender, instance, **kwargs):
+    conditional.bump_user_state(instance.user_id)
@@ -1,3 +1,23 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from products.models import Category
+from products.testing import QueryCountMixin
+from .models import Wishlist
+
+
+class WishlistQueryCountTests(QueryCountMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Books', slug='books')
+        cls.user = User.objects.create_user('shopper', password='secret')
+
+    def add_items(self, count):
+        for product in self.add_products(count, [self.category], name='Book'):
+            Wishlist.objects.create(user=self.user, product=product)
+
+    def test_constant_queries(self):
+        self.client.force_login(self.user)
+        self.add_items(10)
+        self.assertConstantQueries(reverse('wishlist'), lambda: self.add_items(90))
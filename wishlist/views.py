@@ -5,7 +5,7 @@ from .models import Wishlist
 
 @login_required
 def wishlist(request):
-    wishlist_items = Wishlist.objects.filter(user=request.user)
+    wishlist_items = Wishlist.objects.filter(user=request.user).select_related('product__category')
     return render(request, 'wishlist/wishlist.html', {'wishlist_items': wishlist_items})
 
 @login_required